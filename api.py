@@ -1,70 +1,221 @@
-from pathlib import Path
-
-from fastapi import FastAPI
-
-from src.farmer import is_account_farmer, wallet_balances, read_farmer_spec
-from src.wallet_interraction import is_associated_with_addresses, read_interraction_spec
-from src.nft_owneship import read_nft_spec, minimum_owned_nfts, nft_ownership_from_list
+import time
+from typing import List, Optional
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, conint
+
+from src.farmer import is_account_farmer_async, wallet_balances_async
+from src.wallet_interraction import is_associated_with_addresses_async
+from src.nft_owneship import minimum_owned_nfts_async
+from src.specs import get_spec_with_digest, MONEY_MIXER_SPEC
+from src.batch import prepare_checks, score_wallets_async, score_wallets_ndjson
+from src.profile import prepare_profile, wallet_profile_async
+from src.multichain import prepare_networks, multichain_profile_async
+from src.verdicts import cached_verdict, verdict_cache, VERDICT_TTLS
+from src.utils import http_client, metrics
+from src.utils.chains import NETWORKS
 
 app = FastAPI()
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Record the latency and the number of upstream requests of each route.
+    For streamed responses the latency is until the response starts."""
+    start = time.perf_counter()
+    token = metrics.begin_request()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        upstream_calls = metrics.end_request(token)
+        route = request.scope.get('route')
+        path = route.path if route is not None else 'unmatched'
+        metrics.ROUTE_SECONDS.observe(time.perf_counter() - start,
+                                      path, request.method, status)
+        metrics.ROUTE_UPSTREAM_CALLS.observe(upstream_calls, path)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "Navigate to '/docs' path to interact with the API's GUI"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """The metrics of the server in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4")
+
 @app.get("/farmer/totalview/{wallet_address}/{spec_file}")
 async def root(wallet_address: str, spec_file: str):
 
-    file_path = Path(f'./specfiles/farmer/{spec_file}')
-    if not file_path.is_file():
+    try:
+        spec, spec_hash = get_spec_with_digest('farmer', spec_file)
+    except FileNotFoundError:
         return {"error": "There is no such spec file"}
 
-    spec = read_farmer_spec(file_path)
-    balances = wallet_balances(wallet_address)
+    async def is_farmer():
+        balances = await wallet_balances_async(wallet_address)
+        return await is_account_farmer_async(**balances, **spec)
 
-    return {"is_farmer": is_account_farmer(**balances, **spec)}
+    return {
+        "is_farmer": await cached_verdict('farmer', wallet_address, spec_hash,
+                                          None, is_farmer)
+    }
 
 @app.get("/interraction/{wallet_address}/{spec_file}")
 async def root(wallet_address: str, spec_file: str):
 
-    file_path = Path(f'./specfiles/interractions/{spec_file}')
-    if not file_path.is_file():
+    try:
+        spec, spec_hash = get_spec_with_digest('interraction', spec_file)
+    except FileNotFoundError:
         return {"error": "There is no such spec file"}
 
-    spec = read_interraction_spec(file_path)
-
     return {
-        "is_associated_with": is_associated_with_addresses(wallet_address, spec)
+        "is_associated_with": await cached_verdict(
+            'interraction', wallet_address, spec_hash, None,
+            lambda: is_associated_with_addresses_async(wallet_address, spec))
     }
 
 @app.get("/money-mixer/{wallet_address}")
 async def root(wallet_address: str):
 
-    file_path = Path(f'./specfiles/money_mixer_addresses/tornado_addresses_ethereum.json')
-    if not file_path.is_file():
+    try:
+        contract_addresses, spec_hash = get_spec_with_digest('money_mixer', MONEY_MIXER_SPEC)
+    except FileNotFoundError:
         return {"error": "There is no such spec file"}
 
-    contract_addresses = read_interraction_spec(file_path)
-
     return {
-        "interracted_with_money_mixers": is_associated_with_addresses(wallet_address, contract_addresses)
+        "interracted_with_money_mixers": await cached_verdict(
+            'money_mixer', wallet_address, spec_hash, None,
+            lambda: is_associated_with_addresses_async(wallet_address, contract_addresses))
     }
 
 @app.get("/min-nft-ownership/{wallet_address}/{spec_file}/{minimum_owned}")
 async def root(wallet_address: str, spec_file: str, minimum_owned: int):
 
-    file_path = Path(f'./specfiles/nft_ownership/{spec_file}')
-    if not file_path.is_file():
+    try:
+        nft_addresses, spec_hash = get_spec_with_digest('nft', spec_file)
+    except FileNotFoundError:
         return {"error": "There is no such spec file"}
 
-    nft_addresses = read_nft_spec(file_path)
-
     if minimum_owned == 1:
         message = 'is_at_least_1_nft_owned'
     else:
         message = f'are_at_least_{minimum_owned}_owned'
 
     return {
-        message: minimum_owned_nfts(wallet_address, nft_addresses, minimum_owned)
+        message: await cached_verdict(
+            'nft', wallet_address, spec_hash, {'minimum_owned': minimum_owned},
+            lambda: minimum_owned_nfts_async(wallet_address, nft_addresses, minimum_owned))
     }
 
+@app.get("/profile/{wallet_address}")
+async def profile(wallet_address: str,
+                  farmer: List[str] = Query([]),
+                  interraction: List[str] = Query([]),
+                  money_mixer: bool = False,
+                  nft: List[str] = Query([]),
+                  minimum_owned: int = 1):
+    """Evaluate any number of farmer, interaction and NFT spec files on the
+    wallet, fetching its balances, transfers and NFTs only once, e.g.
+    `/profile/0x...?farmer=a.json&nft=b.json&nft=c.json&money_mixer=true`
+    """
+
+    try:
+        specs = prepare_profile(farmer=farmer, interraction=interraction,
+                                money_mixer=money_mixer, nft=nft)
+    except FileNotFoundError:
+        return {"error": "There is no such spec file"}
+
+    return await wallet_profile_async(wallet_address, **specs,
+                                      minimum_owned=minimum_owned)
+
+@app.get("/multichain/{wallet_address}")
+async def multichain(wallet_address: str,
+                     network: List[str] = Query([]),
+                     money_mixer: bool = True,
+                     minimum_total_balance: Optional[float] = None):
+    """Score the wallet on several networks at once, all of them by default,
+    e.g. `/multichain/0x...?network=ethereum&network=polygon-pos`. Returns
+    the USD balance of each network and their total, and whether the wallet
+    has interacted with money mixers on any of them.
+    """
+
+    networks = network or list(NETWORKS)
+    if any(n not in NETWORKS for n in networks):
+        return {"error": "There is no such network"}
+
+    try:
+        specs = prepare_networks(networks, money_mixer)
+    except FileNotFoundError:
+        return {"error": "There is no such spec file"}
+
+    return await multichain_profile_async(wallet_address, specs,
+                                          minimum_total_balance)
+
+@app.delete("/verdicts/{wallet_address}")
+async def invalidate_verdicts(wallet_address: str, check: Optional[str] = None):
+    """Remove the cached verdicts of the wallet, only those of `check` if
+    it is given."""
+
+    if check is not None and check not in VERDICT_TTLS:
+        return {"error": "There is no such check"}
+
+    return {"invalidated": await verdict_cache().invalidate(wallet_address, check)}
+
+@app.delete("/verdicts")
+async def invalidate_all_verdicts():
+    """Remove all the cached verdicts."""
+
+    await verdict_cache().invalidate()
+    return {"invalidated": "all"}
+
+
+class BatchChecks(BaseModel):
+    farmer: Optional[str] = None
+    interraction: Optional[str] = None
+    money_mixer: bool = False
+    nft: Optional[str] = None
+    minimum_owned: int = 1
+
+class BatchRequest(BaseModel):
+    wallets: List[str]
+    checks: BatchChecks
+    concurrency: conint(ge=1, le=100) = 10
+
+@app.post("/batch")
+async def batch(request: BatchRequest):
+
+    try:
+        checks = prepare_checks(**request.checks.dict())
+    except FileNotFoundError:
+        return {"error": "There is no such spec file"}
+
+    results = []
+    async for result in score_wallets_async(request.wallets, checks,
+                                            request.concurrency):
+        results.append(result)
+
+    return {"results": results}
+
+@app.post("/batch/stream")
+async def batch_stream(request: BatchRequest):
+    """Same as `/batch` but stream one JSON line per wallet as soon as the
+    wallet is scored. New wallets are started only as fast as the client
+    reads the results.
+    """
+
+    try:
+        checks = prepare_checks(**request.checks.dict())
+    except FileNotFoundError:
+        return {"error": "There is no such spec file"}
+
+    return StreamingResponse(
+        score_wallets_ndjson(request.wallets, checks, request.concurrency),
+        media_type="application/x-ndjson")
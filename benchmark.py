@@ -0,0 +1,367 @@
+"""
+Offline benchmark of the components and the API routes.
+
+A local stand-in of the Alchemy and CoinGecko APIs is started and the
+helpers are configured to use it, so the benchmark needs no network access and no
+API key. The stand-in answers with synthetic, deterministic data for every
+wallet, after a configurable latency, with as many pages of transfers and as
+many tokens and NFTs per wallet as asked.
+
+For each component and route it reports the p50/p99 latency, the requests
+per second and the number of upstream requests per checked wallet:
+
+    python benchmark.py --requests 200 --concurrency 20 --latency 0.05 \
+        --transfer-pages 3 --tokens 20 --nfts 50
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FARMER_SPEC = 'sample_farmer_spec.json'
+INTERRACTION_SPEC = 'sample_interractions_spec.json'
+NFT_SPEC = 'sample_nft_spec.json'
+
+# Token held by every synthetic wallet, required by the sample farmer spec
+USDC = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+
+NFT_PAGE_SIZE = 100
+
+class MockUpstream:
+    """Local HTTP server that answers the requests the helpers send to
+    Alchemy and CoinGecko and counts them, per upstream endpoint.
+    """
+
+    def __init__(self, latency: float = 0.0, transfer_pages: int = 3,
+                 transfers_per_page: int = 100, tokens: int = 20, nfts: int = 50,
+                 token_contracts: list = ()):
+        self.latency = latency
+        self.transfer_pages = transfer_pages
+        self.transfers_per_page = transfers_per_page
+        self.tokens = tokens
+        self.nfts = nfts
+        self.token_contracts = list(token_contracts) or [USDC]
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    # synthetic data, always the same for the same wallet
+
+    @staticmethod
+    def _rng(*seed) -> random.Random:
+        return random.Random(':'.join(str(s) for s in seed))
+
+    @staticmethod
+    def _address(rng: random.Random) -> str:
+        return '0x%040x' % rng.getrandbits(160)
+
+    def transfers(self, params: dict) -> dict:
+        direction = 'to' if 'toAddress' in params else 'from'
+        wallet = params.get('toAddress') or params.get('fromAddress')
+        page = int(params.get('pageKey', 0))
+        rng = self._rng(wallet, direction, page)
+        transfers = []
+        for i in range(self.transfers_per_page):
+            counterparty = self._address(rng)
+            transfers.append({
+                'uniqueId': f'{wallet}:{direction}:{page}:{i}',
+                'hash': self._address(rng),
+                'blockNum': hex(page * self.transfers_per_page + i + 1),
+                'category': 'external',
+                'from': counterparty if direction == 'to' else wallet,
+                'to': wallet if direction == 'to' else counterparty,
+                'value': 0.1,
+                'asset': 'ETH',
+            })
+        result = {'transfers': transfers}
+        if page + 1 < self.transfer_pages:
+            result['pageKey'] = str(page + 1)
+        return result
+
+    def token_balances(self, wallet: str) -> dict:
+        rng = self._rng(wallet, 'tokens')
+        contracts = rng.sample(self.token_contracts,
+                               min(self.tokens, len(self.token_contracts)))
+        balances = {c: hex(rng.randrange(10 ** 18, 10 ** 21)) for c in contracts}
+        balances[USDC] = hex(5000 * 10 ** 6)
+        return {
+            'address': wallet,
+            'tokenBalances': [{'contractAddress': c, 'tokenBalance': b}
+                                for c, b in balances.items()],
+        }
+
+    def owned_nfts(self, wallet: str, contracts: list) -> list:
+        if not contracts:
+            rng = self._rng(wallet, 'nfts')
+            return [self._address(rng) for _ in range(self.nfts)]
+        # about one of every four of the requested contracts is owned
+        return [c for c in contracts if self._rng(wallet, c).random() < 0.25]
+
+    def rpc(self, call: dict) -> dict:
+        method, params = call['method'], call['params']
+        if method == 'alchemy_getAssetTransfers':
+            result = self.transfers(params[0])
+        elif method == 'alchemy_getTokenBalances':
+            result = self.token_balances(params[0])
+        elif method == 'eth_getBalance':
+            result = hex(self._rng(params[0], 'eth').randrange(10 ** 20))
+        elif method == 'alchemy_getTokenMetadata':
+            result = {'decimals': 6 if params[0] == USDC else 18,
+                      'symbol': 'TKN', 'name': 'Token', 'logo': None}
+        else:
+            return {'id': call['id'], 'jsonrpc': '2.0',
+                    'error': {'code': -32601, 'message': 'Method not found'}}
+        return {'id': call['id'], 'jsonrpc': '2.0', 'result': result}
+
+    def handle(self, method: str, url: str, body: bytes):
+        """Return the status code and the JSON response of a request."""
+        parts = urlsplit(url)
+        path = parts.path.strip('/').split('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+
+        if path[0] == 'v2' and method == 'POST':
+            payload = json.loads(body)
+            if isinstance(payload, list):
+                self.count('alchemy:batch')
+                return 200, [self.rpc(call) for call in payload]
+            self.count('alchemy:' + payload['method'])
+            return 200, self.rpc(payload)
+
+        if path[:2] == ['nft', 'v2'] and path[-1] == 'getNFTs':
+            self.count('alchemy:getNFTs')
+            contracts = [c for c in query.get('contractAddresses[]', '').split(',') if c]
+            owned = self.owned_nfts(query['owner'], contracts)
+            start = int(query.get('pageKey', 0))
+            result = {'ownedNfts': [{'contract': {'address': c}}
+                                    for c in owned[start:start + NFT_PAGE_SIZE]],
+                      'totalCount': len(owned)}
+            if start + NFT_PAGE_SIZE < len(owned):
+                result['pageKey'] = str(start + NFT_PAGE_SIZE)
+            return 200, result
+
+        if path[:2] == ['api', 'v3']:
+            path = path[2:]
+            if path[:2] == ['simple', 'token_price']:
+                self.count('coingecko:token_price')
+                return 200, {c: {'usd': 1.0}
+                             for c in query['contract_addresses'].split(',')}
+            if path == ['simple', 'price']:
+                self.count('coingecko:price')
+                return 200, {query['ids']: {'usd': 2000.0}}
+            if path[0] == 'coins' and path[2] == 'contract':
+                self.count('coingecko:contract')
+                return 200, {'detail_platforms': {path[1]: {'decimal_place': 18}}}
+
+        self.count('unknown')
+        return 404, {'error': 'Not found'}
+
+    def start(self) -> str:
+        """Start serving in a background thread and return the base URL."""
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, as the real APIs
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if upstream.latency:
+                    time.sleep(upstream.latency)
+                status, result = upstream.handle(method, self.path, body)
+                data = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+async def run_scenario(name: str, check, wallets: list, concurrency: int,
+                       upstream: MockUpstream) -> dict:
+    """Run `check(wallet)` for each of the wallets, `concurrency` at a time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def timed(wallet):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await check(wallet)
+            except Exception as e:
+                errors += 1
+                print('%s failed for %s: %s' % (name, wallet, e), file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+
+    calls_before = Counter(upstream.calls)
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(w) for w in wallets])
+    elapsed = time.perf_counter() - start
+    calls = upstream.calls - calls_before
+
+    return {
+        'scenario': name,
+        'requests': len(wallets),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'requests_per_s': len(wallets) / elapsed,
+        'upstream_per_request': sum(calls.values()) / len(wallets),
+        'upstream_calls': dict(calls),
+    }
+
+def scenarios(args) -> dict:
+    """Return the benchmarked checks, by name. The modules are imported here,
+    after `CACHE_DIR` points to an empty directory."""
+    import httpx
+    import api
+    from src.batch import farmer_check
+    from src.nft_owneship import minimum_owned_nfts_async
+    from src.profile import prepare_profile, wallet_profile_async
+    from src.specs import get_spec, MONEY_MIXER_SPEC
+    from src.wallet_interraction import is_associated_with_addresses_async
+
+    farmer = get_spec('farmer', FARMER_SPEC)
+    mixer = get_spec('money_mixer', MONEY_MIXER_SPEC)
+    nft = get_spec('nft', NFT_SPEC)
+    profile = prepare_profile(farmer=[FARMER_SPEC], interraction=[INTERRACTION_SPEC],
+                              money_mixer=True, nft=[NFT_SPEC])
+    client = httpx.AsyncClient(app=api.app, base_url='http://api')
+
+    async def route(path):
+        r = await client.get(path)
+        r.raise_for_status()
+        if 'error' in r.json():
+            raise Exception(r.json()['error'])
+
+    return {
+        'component:farmer': lambda w: farmer_check(w, farmer),
+        'component:money_mixer': lambda w: is_associated_with_addresses_async(w, mixer),
+        'component:nft': lambda w: minimum_owned_nfts_async(w, nft, args.minimum_owned),
+        'component:profile': lambda w: wallet_profile_async(
+            w, **profile, minimum_owned=args.minimum_owned),
+        'route:farmer': lambda w: route(f'/farmer/totalview/{w}/{FARMER_SPEC}'),
+        'route:money_mixer': lambda w: route(f'/money-mixer/{w}'),
+        'route:nft': lambda w: route(
+            f'/min-nft-ownership/{w}/{NFT_SPEC}/{args.minimum_owned}'),
+        'route:profile': lambda w: route(
+            f'/profile/{w}?farmer={FARMER_SPEC}&interraction={INTERRACTION_SPEC}'
+            f'&money_mixer=true&nft={NFT_SPEC}&minimum_owned={args.minimum_owned}'),
+    }
+
+async def run(args, upstream: MockUpstream, base_url: str) -> list:
+    from src.utils import alchemy, coingecko, http_client
+
+    # the stand-in is not rate limited, so it measures only our own code
+    alchemy.configure(api_key='benchmark', base_url=base_url)
+    coingecko.configure(base_url=base_url + '/api/v3/')
+
+    checks = scenarios(args)
+    selected = args.scenario or list(checks)
+    results = []
+    try:
+        for index, name in enumerate(selected):
+            # different wallets for each scenario, so that none of them
+            # reuses the transfers or the verdicts of another one
+            wallets = ['0x%040x' % (index << 32 | i) for i in range(args.requests)]
+            results.append(await run_scenario(name, checks[name], wallets,
+                                              args.concurrency, upstream))
+    finally:
+        await http_client.aclose()
+    return results
+
+def print_report(results: list):
+    print('%-22s %8s %6s %10s %10s %10s %14s' % (
+        'scenario', 'requests', 'errors', 'p50 ms', 'p99 ms', 'req/s', 'upstream/req'))
+    for r in results:
+        print('%-22s %8d %6d %10.1f %10.1f %10.1f %14.2f' % (
+            r['scenario'], r['requests'], r['errors'], r['p50_ms'], r['p99_ms'],
+            r['requests_per_s'], r['upstream_per_request']))
+        for endpoint, count in sorted(r['upstream_calls'].items()):
+            print('%-22s   %-32s %8d' % ('', endpoint, count))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the components and the API routes against a '
+                    'local stand-in of the Alchemy and CoinGecko APIs.')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='Wallets checked per scenario.')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Wallets checked at the same time.')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds the stand-in waits before each response.')
+    parser.add_argument('--transfer-pages', type=int, default=3,
+                        help='Pages of transfers per wallet and direction.')
+    parser.add_argument('--transfers-per-page', type=int, default=100)
+    parser.add_argument('--tokens', type=int, default=20,
+                        help='Tokens held by each wallet.')
+    parser.add_argument('--nfts', type=int, default=50,
+                        help='NFT contracts owned by each wallet when no '
+                             'contracts are given.')
+    parser.add_argument('--minimum-owned', type=int, default=1)
+    parser.add_argument('--scenario', action='append',
+                        help='Run only this scenario, can be repeated.')
+    parser.add_argument('--json', help='File to write the results to as JSON.')
+    args = parser.parse_args(argv)
+
+    with open('ethereum-coin-address.json') as f:
+        token_contracts = [c.lower() for c in json.load(f)]
+
+    upstream = MockUpstream(latency=args.latency, transfer_pages=args.transfer_pages,
+                            transfers_per_page=args.transfers_per_page,
+                            tokens=args.tokens, nfts=args.nfts,
+                            token_contracts=token_contracts)
+    base_url = upstream.start()
+
+    # the on-disk caches start empty
+    os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='benchmark-cache-')
+
+    try:
+        results = asyncio.run(run(args, upstream, base_url))
+    finally:
+        upstream.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Score many wallets with the same set of checks.
+
+The spec files of the checks are taken from the spec registry and the wallets are
+scored concurrently, up to a limit, sharing the connection pools and the
+caches of the helpers. The results are produced one wallet at a time, as
+soon as the checks of that wallet finish.
+
+It can be used from the command line, reading the wallet addresses from a
+file, one per line, and writing one JSON line per wallet:
+
+    python -m src.batch wallets.txt --farmer sample_farmer_spec.json \
+        --money-mixer --output results.ndjson
+"""
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from .farmer import wallet_balances_async, is_account_farmer_async
+from .nft_owneship import minimum_owned_nfts_async
+from .specs import get_spec_with_digest, MONEY_MIXER_SPEC
+from .verdicts import cached_verdict
+from .wallet_interraction import is_associated_with_addresses_async
+from .utils import http_client, metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# Number of wallets scored at the same time
+DEFAULT_CONCURRENCY = 10
+
+def prepare_checks(farmer: Optional[str] = None,
+                   interraction: Optional[str] = None,
+                   money_mixer: bool = False,
+                   nft: Optional[str] = None,
+                   minimum_owned: int = 1) -> Dict:
+    """Get the parsed spec files of the checks to run on every wallet.
+
+    :param farmer: Spec file under `specfiles/farmer/`.
+    :type farmer: Optional[str]
+    :param interraction: Spec file under `specfiles/interractions/`.
+    :type interraction: Optional[str]
+    :param money_mixer: Whether to check for interactions with money mixers.
+    :type money_mixer: bool
+    :param nft: Spec file under `specfiles/nft_ownership/`.
+    :type nft: Optional[str]
+    :param minimum_owned: Number of the `nft` contracts that need to be owned.
+    :type minimum_owned: int
+    :raises FileNotFoundError: When any of the spec files does not exist.
+    :return: The parsed specs, keyed by check, and the hashes of the spec
+        files under 'spec_hashes'.
+    :rtype: Dict
+    """
+    spec_files = {}
+    if farmer:
+        spec_files['farmer'] = farmer
+    if interraction:
+        spec_files['interraction'] = interraction
+    if money_mixer:
+        spec_files['money_mixer'] = MONEY_MIXER_SPEC
+    if nft:
+        spec_files['nft'] = nft
+
+    checks = {'spec_hashes': {}}
+    for check, spec_file in spec_files.items():
+        checks[check], checks['spec_hashes'][check] = \
+            get_spec_with_digest(check, spec_file)
+    if nft:
+        checks['nft'] = (checks['nft'], minimum_owned)
+    return checks
+
+async def farmer_check(wallet_address: str, spec: Dict) -> bool:
+    """Fetch the balances of the wallet and check them against the parsed
+    farmer `spec`."""
+    balances = await wallet_balances_async(wallet_address)
+    return await is_account_farmer_async(**balances, **spec)
+
+@metrics.timed('score_wallet_async')
+async def score_wallet_async(wallet_address: str, checks: Dict) -> Dict:
+    """Run the `checks` on the wallet concurrently. A check that fails is
+    reported under 'errors' and doesn't affect the other checks. The
+    verdicts of the checks whose spec hash is known are cached.
+
+    :param wallet_address: The address of the wallet.
+    :type wallet_address: str
+    :param checks: The parsed specs returned by `prepare_checks()`.
+    :type checks: Dict
+    :return: The result of each check for the wallet.
+    :rtype: Dict
+    """
+    # check -> (parameters of the verdict, function returning the coroutine)
+    computations = {}
+    if 'farmer' in checks:
+        computations['farmer'] = (None, lambda: farmer_check(
+            wallet_address, checks['farmer']))
+    if 'interraction' in checks:
+        computations['interraction'] = (None, lambda: is_associated_with_addresses_async(
+            wallet_address, checks['interraction']))
+    if 'money_mixer' in checks:
+        computations['money_mixer'] = (None, lambda: is_associated_with_addresses_async(
+            wallet_address, checks['money_mixer']))
+    if 'nft' in checks:
+        computations['nft'] = ({'minimum_owned': checks['nft'][1]},
+                               lambda: minimum_owned_nfts_async(wallet_address,
+                                                                *checks['nft']))
+
+    spec_hashes = checks.get('spec_hashes', {})
+    coroutines = {
+        check: cached_verdict(check, wallet_address, spec_hashes.get(check),
+                              params, compute)
+        for check, (params, compute) in computations.items()
+    }
+    results = await asyncio.gather(*coroutines.values(), return_exceptions=True)
+
+    scores = {'wallet_address': wallet_address}
+    for check, result in zip(coroutines, results):
+        if isinstance(result, Exception):
+            logger.error('Check %s failed for %s: %s', check, wallet_address, result)
+            scores.setdefault('errors', {})[check] = str(result)
+        else:
+            scores[check] = result
+    return scores
+
+async def score_wallets_async(wallet_addresses: Iterable[str], checks: Dict,
+                              concurrency: int = DEFAULT_CONCURRENCY) -> AsyncIterator[Dict]:
+    """Score the wallets with at most `concurrency` wallets in progress at
+    any time and yield the result of each wallet as soon as it is ready, in
+    order of completion. A new wallet is started only after a result has
+    been consumed, so a slow consumer also slows down the requests.
+
+    :param wallet_addresses: The wallets to score.
+    :type wallet_addresses: Iterable[str]
+    :param checks: The parsed specs returned by `prepare_checks()`.
+    :type checks: Dict
+    :param concurrency: Maximum number of wallets scored at the same time.
+    :type concurrency: int
+    :return: Iterator over the result of each wallet.
+    :rtype: AsyncIterator[Dict]
+    """
+    wallets = iter(wallet_addresses)
+    running = set()
+
+    def start_next() -> bool:
+        for wallet_address in wallets:
+            wallet_address = wallet_address.strip()
+            if wallet_address:
+                running.add(asyncio.create_task(
+                    score_wallet_async(wallet_address, checks)))
+                return True
+        return False
+
+    try:
+        while len(running) < concurrency and start_next():
+            pass
+
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.remove(task)
+                yield task.result()
+                start_next()
+    finally:
+        for task in running:
+            task.cancel()
+
+async def score_wallets_ndjson(wallet_addresses: Iterable[str], checks: Dict,
+                               concurrency: int = DEFAULT_CONCURRENCY) -> AsyncIterator[str]:
+    """Same as `score_wallets_async()` but yield each result as a line of
+    JSON, ready to be written to a file or streamed to a client.
+    """
+    async for result in score_wallets_async(wallet_addresses, checks, concurrency):
+        yield json.dumps(result) + '\n'
+
+async def _score_file(args):
+    checks = prepare_checks(farmer=args.farmer, interraction=args.interraction,
+                            money_mixer=args.money_mixer, nft=args.nft,
+                            minimum_owned=args.minimum_owned)
+    if not checks['spec_hashes']:
+        raise SystemExit('No checks selected.')
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with open(args.wallets, 'r') as wallets:
+            async for line in score_wallets_ndjson(wallets, checks,
+                                                   args.concurrency):
+                output.write(line)
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await http_client.aclose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Score the wallets of a file, one address per line.')
+    parser.add_argument('wallets', help='File with one wallet address per line.')
+    parser.add_argument('--farmer', help='Spec file under specfiles/farmer/.')
+    parser.add_argument('--interraction', help='Spec file under specfiles/interractions/.')
+    parser.add_argument('--money-mixer', action='store_true',
+                        help='Check for interactions with money mixers.')
+    parser.add_argument('--nft', help='Spec file under specfiles/nft_ownership/.')
+    parser.add_argument('--minimum-owned', type=int, default=1,
+                        help='Number of the NFT contracts that need to be owned.')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of wallets scored at the same time.')
+    parser.add_argument('--output', help='File to write the results to, '
+                        'one JSON line per wallet. Default stdout.')
+    asyncio.run(_score_file(parser.parse_args(argv)))
+
+if __name__ == '__main__':
+    main()
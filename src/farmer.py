@@ -1,30 +1,56 @@
+import os
 import json
+import asyncio
 import logging
 from decimal import Decimal
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
-from .utils.alchemy import current_eth_balance, current_token_balances, \
-                            get_token_metadata
-from .utils.coingecko import load_coin_data, get_token_price, get_currency_price
+from .utils import metrics
+from .utils.addresses import normalize_address
+from .utils.valuation import valuation, amount_units, native_value, token_values, \
+                            to_usd, USD_DECIMALS
+from .utils.alchemy import current_balances, current_balances_async
+from .utils.token_metadata import tokens_metadata, tokens_metadata_async
+from .utils.coingecko import contract_index, get_token_prices, get_currency_price, \
+                            get_token_prices_async, get_currency_price_async
 
 logger = logging.getLogger(__name__)
 logger.setLevel("DEBUG")
 
+# Number of tokens priced at a time by `is_account_farmer()`, about as many
+# as fit in a single CoinGecko request
+FARMER_PRICING_ROUND = int(os.environ.get('FARMER_PRICING_ROUND', 40))
+
 def to_decimals(token_amount, decimals):
-    return Decimal(token_amount) / Decimal(10 ** decimals)
+    return Decimal(token_amount).scaleb(-decimals)
 
-def wallet_balances(wallet_address: str) -> Dict:
+@metrics.timed('wallet_balances')
+def wallet_balances(wallet_address: str, network: Optional[str] = 'ethereum') -> Dict:
     """Get the wallet's ETH balance and balance for each token the account
-    holds.
+    holds. On other networks 'eth_balance' is the balance of their native
+    coin.
 
     :param wallet_address: The wallet's address.
     :type wallet_address: str
+    :param network: The name of the blockchain network, defaults to 'ethereum'
+    :type network: Optional[str]
     :return: Dictionary of the wallet's balances.
     :rtype: _type_
     """
-    # Get the tokens hold by the wallet
-    eth_balance = current_eth_balance(wallet_address)
-    coins_balance = current_token_balances(wallet_address)
+    # Get the ETH and the tokens hold by the wallet in one request
+    eth_balance, coins_balance = current_balances(wallet_address, network)
+
+    return {
+        "eth_balance": eth_balance,
+        "coins_balance": coins_balance,
+    }
+
+@metrics.timed('wallet_balances_async')
+async def wallet_balances_async(wallet_address: str,
+                                network: Optional[str] = 'ethereum') -> Dict:
+    """Async version of `wallet_balances()`."""
+    eth_balance, coins_balance = await current_balances_async(wallet_address,
+                                                              network)
 
     return {
         "eth_balance": eth_balance,
@@ -36,8 +62,12 @@ def read_farmer_spec(filename: str) -> Dict:
     data it contains as a dictionary.
     """
     with open(filename, 'r') as f:
-        data = json.loads(f.read())
+        return parse_farmer_spec(json.loads(f.read()))
 
+def parse_farmer_spec(data: Dict) -> Dict:
+    """Return the specification of the loaded JSON data of a farmer
+    specification file, see `read_farmer_spec()`.
+    """
     specification = {
         "minimum_total_balance": 0,
         "token_contract_amount": {}
@@ -51,14 +81,107 @@ def read_farmer_spec(filename: str) -> Dict:
 
     return specification
 
+def _listed_tokens(coins_balance: Dict, network: str = 'ethereum') -> List[str]:
+    """Case (1): keep only the tokens in the CoinGecko DB."""
+    # The tokens on the network, loaded once per process
+    token_contracts = contract_index(network)
+    return [t for t in coins_balance if t.lower() in token_contracts]
+
+def _decimals(metadata: Dict, token_address: str) -> Optional[int]:
+    """Return the decimals of the token, or None if they are not known,
+    e.g. when CoinGecko has no `decimal_place` for it."""
+    tmd = metadata.get(token_address)
+    return tmd.get('decimals') if tmd else None
+
+def _token_amounts(coins_balance: Dict, listed_metadata: Dict) -> Dict:
+    """Get the balances of the listed tokens as (integer amount, decimals).
+    A null balance counts as zero, and the tokens with unknown decimals are
+    left out since they can't be priced."""
+    amounts = {}
+    for token_address in listed_metadata:
+        decimals = _decimals(listed_metadata, token_address)
+        if decimals is None:
+            logger.warning('Skip token with unknown decimals: %s', token_address)
+            continue
+        amounts[token_address] = (int(coins_balance[token_address] or '0x0', 16), decimals)
+    return amounts
+
+def _valuation(eth_balance: str, eth_price, token_amounts: Dict,
+               token_prices: Dict) -> Dict:
+    """Case (3): value the priced tokens and the ETH, or the native coin of
+    the network, held. Tokens without a price don't count toward the total.
+    """
+    value = valuation(int(eth_balance, 16), eth_price, token_amounts, token_prices)
+    for token_address, usd in value['tokens'].items():
+        logger.debug('Token address: %s, amount: %s, price: %s, usd: %s',
+                        token_address, to_decimals(*token_amounts[token_address]),
+                        token_prices[token_address], usd)
+    return value
+
+def _plan(coins_balance: Dict, token_contract_amount: Dict,
+          network: str) -> Optional[Tuple[Dict, List[str]]]:
+    """Plan the checks of `is_account_farmer()` from the balances alone.
+
+    Return None if a required token is not held at all, else the required
+    tokens that are held, with their required amount, and the listed tokens
+    with a balance to price, the required ones first.
+    """
+    # Tokens with a zero balance are worth nothing, so they are never priced.
+    # Alchemy returns a null balance for the tokens it failed to read.
+    held = {normalize_address(token_address): token_address
+            for token_address, balance in coins_balance.items()
+            if balance and int(balance, 16) > 0}
+
+    required = {}
+    for token_address, amount in token_contract_amount.items():
+        token_address = held.get(normalize_address(token_address))
+        if token_address is not None:
+            required[token_address] = amount
+        elif amount > 0:
+            # Case (2): a required token is not held
+            return None
+
+    rest = [t for t in held.values() if t not in required]
+    return required, _listed_tokens(dict.fromkeys(list(required) + rest), network)
+
+def _requirements_met(coins_balance: Dict, required: Dict,
+                      required_metadata: Dict) -> bool:
+    """Case (2): check the required amounts, which needs only the balances
+    and the decimals of the required tokens."""
+    for token_address, amount in required.items():
+        decimals = _decimals(required_metadata, token_address)
+        if decimals is None:
+            # the held amount can't be compared to the required one
+            return False
+        if int(coins_balance[token_address], 16) < amount_units(amount, decimals):
+            return False
+    return True
+
+def _pricing_rounds(tokens: List[str]) -> List[List[str]]:
+    return [tokens[i:i + FARMER_PRICING_ROUND]
+            for i in range(0, len(tokens), FARMER_PRICING_ROUND)]
+
+def _round_value(coins_balance: Dict, token_prices: Dict, metadata: Dict) -> int:
+    """Case (3): value of the priced tokens of a round of pricing."""
+    token_amounts = _token_amounts(coins_balance, metadata)
+    token_prices = {t: p for t, p in token_prices.items() if t in token_amounts}
+    return sum(token_values(token_amounts, token_prices).values())
+
+@metrics.timed('is_account_farmer')
 def is_account_farmer(eth_balance: str, coins_balance: Dict ,
                         minimum_total_balance: Optional[int] = 0,
-                        token_contract_amount: Optional[Dict] = {}) -> bool:
+                        token_contract_amount: Optional[Dict] = {},
+                        network: Optional[str] = 'ethereum') -> bool:
     """Validate whether the wallet address currently holds the tokens in the
     `token_contract_amount` dictionary and whether they at least the specified
     amount. Also validate if the wallet address has value of at least
     `minimum_total_balance` in USD.
 
+    The required amounts are checked first and nothing is priced if any
+    of them is not held. The ETH is priced next and then the tokens, a
+    round of `FARMER_PRICING_ROUND` tokens at a time, until the value
+    reaches `minimum_total_balance`.
+
     :param wallet_address: A string of the wallet address.
     :type wallet_address: str
     :param minimum_total_balance: Minimum total value, in USD, held in the
@@ -67,55 +190,120 @@ def is_account_farmer(eth_balance: str, coins_balance: Dict ,
     :param token_contract_amount: Dictonary of contract address and amount of
         tokens.
     :type token_contract_amount: Optional[Dict]
+    :param network: The name of the blockchain network of the balances,
+        defaults to 'ethereum'
+    :type network: Optional[str]
     """
 
-    # Load the list of tokens on the ethereum network
-    ethereum_token_contracts = load_coin_data("ethereum")
-
-    # Iterate ove the tokens held by the wallet. There are 3 cases:
+    # There are 3 cases for the tokens held by the wallet:
     # (1) The token does not exist in the CoinGecko DB. The token is not
     #       reputable and not traded so it doesn't count toward the usd_amount.
-    # (2) The token exists in CoinGecko DB. If the token is in the
-    #       token_contract_amount dictionary then check if the amount is
-    #       greater than the minimum, else return False.
-    # (3) The token exists and the amount is greater than the minimum so it
-    #       counts towards the total_usd_amount held.
-    total_usd_amount = 0
+    # (2) The token is in the token_contract_amount dictionary. If it is not
+    #       held or its amount is less than the minimum, return False.
+    # (3) The token exists in the CoinGecko DB, so it counts towards the
+    #       total_usd_amount held.
+    plan = _plan(coins_balance, token_contract_amount, network)
+    if plan is None:
+        return False
+    required, listed_tokens = plan
 
-    required_tokens = set(token_contract_amount)
+    if required and not _requirements_met(coins_balance, required,
+                                          tokens_metadata(list(required), network)):
+        return False
 
-    for token_address in coins_balance.keys():
+    target = amount_units(minimum_total_balance, USD_DECIMALS)
+    if target <= 0:
+        return True
 
-        # Check case (1) or go with the next token the address has
-        if token_address in ethereum_token_contracts:
+    total_usd_amount = native_value(int(eth_balance, 16), get_currency_price(network))
 
-            tmd = get_token_metadata(token_address)
+    for tokens in _pricing_rounds(listed_tokens):
+        if total_usd_amount >= target:
+            break
+        # Tokens without a price don't count, so their metadata is not needed
+        token_prices = get_token_prices(tokens, network)
+        metadata = tokens_metadata(list(token_prices), network)
+        total_usd_amount += _round_value(coins_balance, token_prices, metadata)
 
-            # Get amount of token from hex -> int -> Decimal
-            token_amount = int(coins_balance[token_address], 16)
-            token_amount = to_decimals(token_amount, tmd['decimals'])
+    logger.debug('Total USD amount: %s', to_usd(total_usd_amount))
 
-            if token_address in required_tokens:
-                if token_amount < token_contract_amount[token_address]:
-                    # Case (2): no required amount satisfied
-                    return False
+    # Validate that the user has more than the requested amount
+    if total_usd_amount >= target:
+        return True
+    return False
 
-            # Case(3): there is no requirement or the wallet has the required amount
-            # Get price for token based on CG data
-            token_price = get_token_price(token_address)
+@metrics.timed('is_account_farmer_async')
+async def is_account_farmer_async(eth_balance: str, coins_balance: Dict,
+                                  minimum_total_balance: Optional[int] = 0,
+                                  token_contract_amount: Optional[Dict] = {},
+                                  network: Optional[str] = 'ethereum') -> bool:
+    """Async version of `is_account_farmer()`."""
+    plan = _plan(coins_balance, token_contract_amount, network)
+    if plan is None:
+        return False
+    required, listed_tokens = plan
 
-            logger.debug('Token address: %s, amount: %s, price: %s' %
-                            (token_address, token_amount, token_price))
+    if required and not _requirements_met(
+            coins_balance, required,
+            await tokens_metadata_async(list(required), network)):
+        return False
 
-            total_usd_amount += token_amount * Decimal(token_price)
+    target = amount_units(minimum_total_balance, USD_DECIMALS)
+    if target <= 0:
+        return True
 
-    # Add the value of the eth held in the account
-    token_price = get_currency_price()
+    total_usd_amount = native_value(int(eth_balance, 16),
+                                    await get_currency_price_async(network))
 
-    eth_balance = int(eth_balance, 16)
-    total_usd_amount += to_decimals(eth_balance, 16) * Decimal(token_price)
+    for tokens in _pricing_rounds(listed_tokens):
+        if total_usd_amount >= target:
+            break
+        token_prices = await get_token_prices_async(tokens, network)
+        metadata = await tokens_metadata_async(list(token_prices), network)
+        total_usd_amount += _round_value(coins_balance, token_prices, metadata)
 
-    # Validate that the user has more than the requested amount
-    if total_usd_amount >= minimum_total_balance:
+    logger.debug('Total USD amount: %s', to_usd(total_usd_amount))
+
+    if total_usd_amount >= target:
         return True
     return False
+
+@metrics.timed('wallet_valuation')
+def wallet_valuation(eth_balance: str, coins_balance: Dict,
+                     network: Optional[str] = 'ethereum') -> Dict:
+    """Get the value in USD of the native coin and of the tokens listed on
+    CoinGecko that the wallet holds on the network, in total and for each
+    of them.
+
+    :param eth_balance: Hex balance of the native coin of the network.
+    :type eth_balance: str
+    :param coins_balance: Dictionary of contract address -> hex balance.
+    :type coins_balance: Dict
+    :param network: The name of the blockchain network, defaults to 'ethereum'
+    :type network: Optional[str]
+    :return: The 'total_usd' value, the value of the 'native' coin and
+        the value of each priced token under 'tokens', as Decimals in USD.
+    :rtype: Dict
+    """
+    listed_metadata = tokens_metadata(_listed_tokens(coins_balance, network),
+                                      network)
+    token_amounts = _token_amounts(coins_balance, listed_metadata)
+
+    token_prices = get_token_prices(list(token_amounts), network)
+    eth_price = get_currency_price(network)
+
+    return _valuation(eth_balance, eth_price, token_amounts, token_prices)
+
+@metrics.timed('wallet_valuation_async')
+async def wallet_valuation_async(eth_balance: str, coins_balance: Dict,
+                                 network: Optional[str] = 'ethereum') -> Dict:
+    """Async version of `wallet_valuation()`."""
+    listed_metadata = await tokens_metadata_async(
+        _listed_tokens(coins_balance, network), network)
+    token_amounts = _token_amounts(coins_balance, listed_metadata)
+
+    token_prices, eth_price = await asyncio.gather(
+        get_token_prices_async(list(token_amounts), network),
+        get_currency_price_async(network))
+
+    return _valuation(eth_balance, eth_price, token_amounts, token_prices)
@@ -0,0 +1,118 @@
+"""
+Score a wallet on several blockchain networks at once.
+
+The balances and the transfers of each network are requested concurrently,
+so a wallet is scored in about the time of its slowest network. The values
+held on the networks are added up into the total USD balance of the wallet,
+and the wallet is flagged if it has interacted with the money mixers of any
+of the networks.
+"""
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from .farmer import wallet_balances_async, wallet_valuation_async
+from .specs import get_spec
+from .utils import metrics
+from .utils.addresses import AddressMatcher
+from .utils.chains import network_setting
+from .wallet_interraction import is_associated_with_addresses_async
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+def prepare_networks(networks: List[str],
+                     money_mixer: bool = True) -> Dict[str, Optional[AddressMatcher]]:
+    """Get the money mixer addresses of each network, or None for every
+    network if the money mixers are not checked.
+
+    :param networks: Names of the networks, from `chains.NETWORKS`.
+    :type networks: List[str]
+    :param money_mixer: Whether to check for interactions with money mixers.
+    :type money_mixer: bool
+    :raises Exception: When a network is not supported.
+    :raises FileNotFoundError: When the money mixer spec of a network does
+        not exist.
+    :return: The `networks` argument of `multichain_profile_async()`.
+    :rtype: Dict[str, Optional[AddressMatcher]]
+    """
+    specs = {network: network_setting(network, 'money_mixer_spec')
+             for network in networks}
+    return {network: get_spec('money_mixer', spec) if money_mixer else None
+            for network, spec in specs.items()}
+
+async def _usd_balance(wallet_address: str, network: str) -> Decimal:
+    balances = await wallet_balances_async(wallet_address, network)
+    valuation = await wallet_valuation_async(**balances, network=network)
+    return valuation['total_usd']
+
+async def _network_profile(wallet_address: str, network: str,
+                           money_mixer: Optional[AddressMatcher]) -> Dict:
+    coroutines = [_usd_balance(wallet_address, network)]
+    if money_mixer is not None:
+        coroutines.append(is_associated_with_addresses_async(
+            wallet_address, money_mixer, network))
+
+    results = await asyncio.gather(*coroutines)
+
+    profile = {'usd_balance': results[0]}
+    if money_mixer is not None:
+        profile['money_mixer'] = results[1]
+    return profile
+
+@metrics.timed('multichain_profile_async')
+async def multichain_profile_async(wallet_address: str,
+                                   networks: Dict[str, Optional[AddressMatcher]],
+                                   minimum_total_balance: Optional[float] = None) -> Dict:
+    """Get the USD balance of the wallet on each network and, if the money
+    mixer addresses of the network are given, whether the wallet has
+    interacted with them. All the networks are scored concurrently. A
+    network that fails is reported under 'errors' and left out of the
+    total USD balance. 'is_above_minimum_total_balance' and 'money_mixer'
+    are then None, unless the other networks already make them True.
+
+    :param wallet_address: The address of the wallet.
+    :type wallet_address: str
+    :param networks: Network -> matcher of its money mixer addresses, or
+        None to skip the check, see `prepare_networks()`.
+    :type networks: Dict[str, Optional[AddressMatcher]]
+    :param minimum_total_balance: Minimum total value, in USD, held on all
+        the networks.
+    :type minimum_total_balance: Optional[float]
+    :return: The results of each network and the totals of all of them.
+    :rtype: Dict
+    """
+    results = await asyncio.gather(*[_network_profile(wallet_address, network, matcher)
+                                     for network, matcher in networks.items()],
+                                   return_exceptions=True)
+
+    profile = {'wallet_address': wallet_address, 'networks': {}}
+    total_usd_balance = Decimal(0)
+    mixer_verdicts = []
+    for network, result in zip(networks, results):
+        if isinstance(result, Exception):
+            logger.error('Scoring of %s failed on %s: %s', wallet_address,
+                            network, result)
+            profile.setdefault('errors', {})[network] = str(result)
+            continue
+
+        total_usd_balance += result['usd_balance']
+        if 'money_mixer' in result:
+            mixer_verdicts.append(result['money_mixer'])
+        profile['networks'][network] = dict(result,
+                                            usd_balance=float(result['usd_balance']))
+
+    # a failed network can only add to the balance and to the interactions,
+    # so a verdict is unknown only if the networks that succeeded don't
+    # settle it already
+    failed = 'errors' in profile
+    profile['total_usd_balance'] = float(total_usd_balance)
+    if minimum_total_balance is not None:
+        is_above = total_usd_balance >= Decimal(str(minimum_total_balance))
+        profile['is_above_minimum_total_balance'] = \
+            None if failed and not is_above else is_above
+    if any(matcher is not None for matcher in networks.values()):
+        money_mixer = any(mixer_verdicts)
+        profile['money_mixer'] = None if failed and not money_mixer else money_mixer
+    return profile
@@ -1,46 +1,93 @@
 import json
-from typing import List
+from typing import AbstractSet, Dict, List, Union
 
-from .utils.alchemy import account_nfts, unique_nft_contracts
+from .utils import metrics
+from .utils.addresses import address_set, normalize_address
+from .utils.alchemy import account_nft_contracts, account_nft_contracts_async
 
 def to_lowercase(strings: List) -> List:
     return [s.lower() for s in strings]
 
-def is_nft_owned(owned_nfts: List, nft_address: str) -> bool:
-    """Verify if the 'nft_address' is in the list of 'owned_nfts'
+def owned_set(owned_nfts: Union[List, AbstractSet]) -> AbstractSet:
+    """Return the owned contract addresses as a set of normalized addresses.
+    The `AddressSet` returned by `account_nft_contracts()` is used as it
+    is, any other list or set is normalized.
     """
-    # in case some addresses are uppercase
-    owned_nfts = to_lowercase(owned_nfts)
+    return address_set(owned_nfts)
 
-    if nft_address.lower() in owned_nfts:
-        return True
-    return False
+def is_nft_owned(owned_nfts: Union[List, AbstractSet], nft_address: str) -> bool:
+    """Verify if the 'nft_address' is in the list of 'owned_nfts'
+    """
+    return normalize_address(nft_address) in owned_set(owned_nfts)
 
-def which_nfts_owned(owned_nfts: List, nft_contract_addresses: List) -> List:
+def which_nfts_owned(owned_nfts: Union[List, AbstractSet],
+                     nft_contract_addresses: List) -> List:
     """Verify which of the 'nft_contract_addresses' are in the 'owned_nfts'
     list and return a List of boolean values, one for each one of the
     'nft_contract_addresses'
 
-    :param owned_nfts: NFTs owned by the wallet.
-    :type owned_nfts: List
+    :param owned_nfts: NFTs owned by the wallet, as a list or a set of
+        addresses.
+    :type owned_nfts: Union[List, AbstractSet]
     :param nft_contract_addresses: NFT contract addresses to test.
     :type nft_contract_addresses: List
     :return: List of booleans, one for each of the 'nft_contract_addresses'.
     :rtype: List
     """
-    # in case some addresses are uppercase
-    owned_nfts = to_lowercase(owned_nfts)
-
-    is_owned = []
-
-    for nft_addr in nft_contract_addresses:
-        if nft_addr.lower() in owned_nfts:
-            is_owned.append(True)
-        else:
-            is_owned.append(False)
-
-    return is_owned
+    owned = owned_set(owned_nfts)
+    return [normalize_address(a) in owned for a in nft_contract_addresses]
+
+def evaluate_nft_specs(owned_nfts: Union[List, AbstractSet],
+                       nft_specs: Dict[str, List]) -> Dict[str, List]:
+    """Evaluate many specs against the same owned NFTs, building the owned
+    set only once.
+
+    :param owned_nfts: NFTs owned by the wallet, as a list or a set of
+        addresses.
+    :type owned_nfts: Union[List, AbstractSet]
+    :param nft_specs: Name of each spec -> its NFT contract addresses.
+    :type nft_specs: Dict[str, List]
+    :return: Name of each spec -> list of booleans, one for each of its
+        contract addresses.
+    :rtype: Dict[str, List]
+    """
+    owned = owned_set(owned_nfts)
+    return {name: which_nfts_owned(owned, contracts)
+            for name, contracts in nft_specs.items()}
+
+def all_nft_contracts(nft_specs: Dict[str, List]) -> List:
+    """Return the distinct normalized contract addresses of all the
+    `nft_specs`, so the NFTs of a wallet are fetched once for all of them."""
+    return list({normalize_address(a) for contracts in nft_specs.values()
+                    for a in contracts})
+
+@metrics.timed('nft_ownership_from_specs')
+def nft_ownership_from_specs(wallet_address: str,
+                             nft_specs: Dict[str, List]) -> Dict[str, List]:
+    """Test which of the NFTs of each of the 'nft_specs' are owned by the
+    'wallet_address'. The contracts of all the specs are fetched together
+    and each spec is evaluated against the same owned set.
 
+    :param wallet_address: The wallet address as a string.
+    :type wallet_address: str
+    :param nft_specs: Name of each spec -> its NFT contract addresses.
+    :type nft_specs: Dict[str, List]
+    :return: Name of each spec -> list of True/False values based on which
+        NFTs are owned.
+    :rtype: Dict[str, List]
+    """
+    owned = account_nft_contracts(wallet_address, all_nft_contracts(nft_specs))
+    return evaluate_nft_specs(owned, nft_specs)
+
+@metrics.timed('nft_ownership_from_specs_async')
+async def nft_ownership_from_specs_async(wallet_address: str,
+                                         nft_specs: Dict[str, List]) -> Dict[str, List]:
+    """Async version of `nft_ownership_from_specs()`."""
+    owned = await account_nft_contracts_async(wallet_address,
+                                              all_nft_contracts(nft_specs))
+    return evaluate_nft_specs(owned, nft_specs)
+
+@metrics.timed('nft_ownership_from_list')
 def nft_ownership_from_list(wallet_address: str,
                             nft_contract_addresses: List) -> List:
     """Test which of the NFTs specified in the 'nft_contract_addresses'
@@ -53,10 +100,18 @@ def nft_ownership_from_list(wallet_address: str,
     :return: List of True/False values based on which NFTs are owned.
     :rtype: List
     """
-    owned_nfts = account_nfts(wallet_address, nft_contract_addresses)
-    unique_owned_nfts = unique_nft_contracts(owned_nfts)
-    return which_nfts_owned(unique_owned_nfts, nft_contract_addresses)
-
+    owned_contracts = account_nft_contracts(wallet_address, nft_contract_addresses)
+    return which_nfts_owned(owned_contracts, nft_contract_addresses)
+
+@metrics.timed('nft_ownership_from_list_async')
+async def nft_ownership_from_list_async(wallet_address: str,
+                                        nft_contract_addresses: List) -> List:
+    """Async version of `nft_ownership_from_list()`."""
+    owned_contracts = await account_nft_contracts_async(wallet_address,
+                                                        nft_contract_addresses)
+    return which_nfts_owned(owned_contracts, nft_contract_addresses)
+
+@metrics.timed('minimum_owned_nfts')
 def minimum_owned_nfts(wallet_address: str, nft_contract_addresses: List,
                         minimum_owned_nfts: int=1) -> bool:
     """Examine if at least one of the NFTs specified in the
@@ -74,9 +129,23 @@ def minimum_owned_nfts(wallet_address: str, nft_contract_addresses: List,
         the NFTs specified in the 'nft_contract_addresses.
     :rtype: bool
     """
-    owned_nfts = account_nfts(wallet_address, nft_contract_addresses)
-    unique_owned_nfts = unique_nft_contracts(owned_nfts)
-    validate_owned_nfts = which_nfts_owned(unique_owned_nfts, nft_contract_addresses)
+    # stop querying once enough of the contracts are found
+    owned_contracts = account_nft_contracts(wallet_address, nft_contract_addresses,
+                                            stop_after=minimum_owned_nfts)
+    validate_owned_nfts = which_nfts_owned(owned_contracts, nft_contract_addresses)
+    if sum(validate_owned_nfts) >= minimum_owned_nfts:
+        return True
+    else:
+        return False
+
+@metrics.timed('minimum_owned_nfts_async')
+async def minimum_owned_nfts_async(wallet_address: str,
+                                   nft_contract_addresses: List,
+                                   minimum_owned_nfts: int=1) -> bool:
+    """Async version of `minimum_owned_nfts()`."""
+    owned_contracts = await account_nft_contracts_async(
+        wallet_address, nft_contract_addresses, stop_after=minimum_owned_nfts)
+    validate_owned_nfts = which_nfts_owned(owned_contracts, nft_contract_addresses)
     if sum(validate_owned_nfts) >= minimum_owned_nfts:
         return True
     else:
@@ -91,11 +160,16 @@ def read_nft_spec(nft_contract_address_file: str) -> List:
     :return: List contract addresses.
     :rtype: List
     """
-    nft_contract_addresses = []
     with open(nft_contract_address_file, 'r') as f:
-        data = json.loads(f.read())
-        if 'contracts' in data:
-            for contract in data['contracts'].keys():
-                nft_contract_addresses.append(contract)
+        return parse_nft_spec(json.loads(f.read()))
+
+def parse_nft_spec(data: Dict) -> List:
+    """Return the contract addresses of the loaded JSON data of an NFT
+    specification file, see `read_nft_spec()`.
+    """
+    nft_contract_addresses = []
+    if 'contracts' in data:
+        for contract in data['contracts'].keys():
+            nft_contract_addresses.append(contract)
 
     return nft_contract_addresses
@@ -0,0 +1,140 @@
+"""
+Screen a wallet with any number of farmer, interaction and NFT specs at once.
+
+The data of the wallet is fetched at most once for all the specs: the
+balances, the incoming and outgoing transfers and the owned NFTs are
+requested concurrently and every spec is evaluated against the same data,
+instead of each check fetching the data it needs on its own.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from .farmer import wallet_balances_async, is_account_farmer_async
+from .nft_owneship import all_nft_contracts, which_nfts_owned
+from .specs import get_spec, MONEY_MIXER_SPEC
+from .utils import metrics
+from .utils.addresses import AddressMatcher
+from .utils.alchemy import account_nft_contracts_async
+from .utils.transfer_store import iter_synced_transfers_async
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+def prepare_profile(farmer: Optional[List[str]] = None,
+                    interraction: Optional[List[str]] = None,
+                    money_mixer: bool = False,
+                    nft: Optional[List[str]] = None) -> Dict:
+    """Get the parsed spec files to evaluate, keyed by their file name.
+
+    :param farmer: Spec files under `specfiles/farmer/`.
+    :type farmer: Optional[List[str]]
+    :param interraction: Spec files under `specfiles/interractions/`.
+    :type interraction: Optional[List[str]]
+    :param money_mixer: Whether to check for interactions with money mixers.
+    :type money_mixer: bool
+    :param nft: Spec files under `specfiles/nft_ownership/`.
+    :type nft: Optional[List[str]]
+    :raises FileNotFoundError: When any of the spec files does not exist.
+    :return: The keyword arguments of `wallet_profile_async()`.
+    :rtype: Dict
+    """
+    return {
+        'farmer': {f: get_spec('farmer', f) for f in farmer or []},
+        'interraction': {f: get_spec('interraction', f) for f in interraction or []},
+        'money_mixer': get_spec('money_mixer', MONEY_MIXER_SPEC) if money_mixer else None,
+        'nft': {f: get_spec('nft', f) for f in nft or []},
+    }
+
+async def _farmer_verdicts(wallet_address: str, specs: Dict[str, Dict]) -> Dict[str, bool]:
+    balances = await wallet_balances_async(wallet_address)
+    verdicts = {}
+    # one spec after the other, so that the metadata and the prices fetched
+    # for the first spec are taken from the caches for the rest
+    for name, spec in specs.items():
+        verdicts[name] = await is_account_farmer_async(**balances, **spec)
+    return verdicts
+
+async def _match_transfers(wallet_address: str, direction: str,
+                           pending: Dict[str, AddressMatcher], matched: set):
+    async for page in iter_synced_transfers_async(wallet_address,
+                                                  direction=direction):
+        for name, matcher in list(pending.items()):
+            if matcher.count(page) > 0:
+                matched.add(name)
+                pending.pop(name, None)
+        # no more pages once every spec has matched, in either direction
+        if not pending:
+            return
+
+async def _interraction_verdicts(wallet_address: str,
+                                 matchers: Dict[str, AddressMatcher]) -> Dict[str, bool]:
+    pending = dict(matchers)
+    matched = set()
+    await asyncio.gather(*[_match_transfers(wallet_address, d, pending, matched)
+                           for d in ['to', 'from']])
+    return {name: name in matched for name in matchers}
+
+async def _nft_verdicts(wallet_address: str, specs: Dict[str, List],
+                        minimum_owned: int) -> Dict[str, bool]:
+    owned = await account_nft_contracts_async(wallet_address, all_nft_contracts(specs))
+    return {name: sum(which_nfts_owned(owned, contracts)) >= minimum_owned
+            for name, contracts in specs.items()}
+
+@metrics.timed('wallet_profile_async')
+async def wallet_profile_async(wallet_address: str,
+                               farmer: Optional[Dict[str, Dict]] = None,
+                               interraction: Optional[Dict[str, AddressMatcher]] = None,
+                               money_mixer: Optional[AddressMatcher] = None,
+                               nft: Optional[Dict[str, List]] = None,
+                               minimum_owned: int = 1) -> Dict:
+    """Evaluate all the specs on the wallet, fetching its balances, its
+    transfers and its NFTs at most once each and concurrently. A dataset
+    that fails to be fetched is reported under 'errors' and doesn't affect
+    the verdicts of the others.
+
+    :param wallet_address: The address of the wallet.
+    :type wallet_address: str
+    :param farmer: Name -> parsed farmer spec.
+    :type farmer: Optional[Dict[str, Dict]]
+    :param interraction: Name -> matcher of the addresses of an interaction spec.
+    :type interraction: Optional[Dict[str, AddressMatcher]]
+    :param money_mixer: Matcher of the money mixer addresses.
+    :type money_mixer: Optional[AddressMatcher]
+    :param nft: Name -> NFT contract addresses of an NFT spec.
+    :type nft: Optional[Dict[str, List]]
+    :param minimum_owned: Number of the contracts of an NFT spec that need
+        to be owned.
+    :type minimum_owned: int
+    :return: The verdicts of the specs, keyed by check and spec name.
+    :rtype: Dict
+    """
+    matchers = dict(interraction or {})
+    if money_mixer is not None:
+        # the key can't clash with a spec file name, which ends in .json
+        matchers['money_mixer'] = money_mixer
+
+    coroutines = {}
+    if farmer:
+        coroutines['farmer'] = _farmer_verdicts(wallet_address, farmer)
+    if matchers:
+        coroutines['transfers'] = _interraction_verdicts(wallet_address, matchers)
+    if nft:
+        coroutines['nft'] = _nft_verdicts(wallet_address, nft, minimum_owned)
+
+    results = await asyncio.gather(*coroutines.values(), return_exceptions=True)
+
+    profile = {'wallet_address': wallet_address}
+    for dataset, result in zip(coroutines, results):
+        if isinstance(result, Exception):
+            logger.error('Profile of %s failed on %s: %s', wallet_address,
+                            dataset, result)
+            profile.setdefault('errors', {})[dataset] = str(result)
+        elif dataset == 'transfers':
+            if money_mixer is not None:
+                profile['money_mixer'] = result.pop('money_mixer')
+            if interraction:
+                profile['interraction'] = result
+        else:
+            profile[dataset] = result
+    return profile
@@ -0,0 +1,153 @@
+"""
+Registry of the parsed specification files under `specfiles/`.
+
+Each spec file is parsed once, with its addresses normalized and its
+matching index built, and the parsed spec is kept in memory. The file is
+parsed again only when it changes on disk, so edits to the mounted
+`specfiles/` directory are picked up without restarting the server.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from .farmer import parse_farmer_spec
+from .nft_owneship import parse_nft_spec
+from .wallet_interraction import parse_interraction_matcher
+from .utils.addresses import normalize_address
+from .utils.chains import NETWORKS
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+SPECFILES_DIR = Path('./specfiles')
+MONEY_MIXER_SPEC = NETWORKS['ethereum']['money_mixer_spec']
+
+# Seconds between checks of a spec file for changes
+SPEC_CHECK_INTERVAL = float(os.environ.get('SPEC_CHECK_INTERVAL', 1))
+
+def _parse_farmer_spec(data: Dict) -> Dict:
+    spec = parse_farmer_spec(data)
+    spec['token_contract_amount'] = {
+        normalize_address(address): amount
+        for address, amount in spec['token_contract_amount'].items()}
+    return spec
+
+def _parse_nft_spec(data: Dict) -> List:
+    return [normalize_address(address) for address in parse_nft_spec(data)]
+
+# kind of spec -> (directory under specfiles/, parser of the loaded JSON)
+SPEC_KINDS: Dict[str, tuple] = {
+    'farmer': ('farmer', _parse_farmer_spec),
+    'interraction': ('interractions', parse_interraction_matcher),
+    'money_mixer': ('money_mixer_addresses', parse_interraction_matcher),
+    'nft': ('nft_ownership', _parse_nft_spec),
+}
+
+class SpecRegistry:
+    """Parsed spec files, keyed by their kind and file name. A spec file is
+    checked for changes at most once every `check_interval` seconds.
+    """
+
+    def __init__(self, root: Path = SPECFILES_DIR,
+                 check_interval: float = SPEC_CHECK_INTERVAL):
+        self.root = Path(root)
+        self.check_interval = check_interval
+        # (kind, file name) -> (time of the last check, (mtime, size),
+        #                      parsed spec, hash of the file content)
+        self._specs = {}
+        self._lock = threading.Lock()
+
+    def path(self, kind: str, spec_file: str) -> Path:
+        """Return the path of the `spec_file` of the `kind` of spec.
+
+        :raises FileNotFoundError: When there is no such spec file.
+        """
+        directory = (self.root / SPEC_KINDS[kind][0]).resolve()
+        file_path = (directory / spec_file).resolve()
+        # don't allow spec files outside of the spec directory
+        if file_path.parent != directory or not file_path.is_file():
+            raise FileNotFoundError('There is no such spec file: %s' % spec_file)
+        return file_path
+
+    def get(self, kind: str, spec_file: str) -> Any:
+        """Return the parsed `spec_file` of the `kind` of spec.
+
+        :param kind: One of the `SPEC_KINDS`.
+        :type kind: str
+        :param spec_file: Name of the file under the directory of the kind.
+        :type spec_file: str
+        :raises FileNotFoundError: When there is no such spec file.
+        :return: The parsed spec.
+        :rtype: Any
+        """
+        return self._entry(kind, spec_file)[2]
+
+    def digest(self, kind: str, spec_file: str) -> str:
+        """Return the SHA-256 of the content of the spec file that `get()`
+        returns the parsed spec of.
+
+        :raises FileNotFoundError: When there is no such spec file.
+        """
+        return self._entry(kind, spec_file)[3]
+
+    def get_with_digest(self, kind: str, spec_file: str) -> Tuple[Any, str]:
+        """Return the parsed spec and the SHA-256 of its content, both from
+        the same version of the file.
+
+        :raises FileNotFoundError: When there is no such spec file.
+        """
+        entry = self._entry(kind, spec_file)
+        return entry[2], entry[3]
+
+    def _entry(self, kind: str, spec_file: str) -> tuple:
+        now = time.monotonic()
+        key = (kind, spec_file)
+
+        entry = self._specs.get(key)
+        if entry is not None and now - entry[0] < self.check_interval:
+            return entry
+
+        with self._lock:
+            try:
+                file_path = self.path(kind, spec_file)
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                self._specs.pop(key, None)
+                raise
+
+            version = (stat.st_mtime_ns, stat.st_size)
+            entry = self._specs.get(key)
+            if entry is None or entry[1] != version:
+                logger.debug('Parse spec file: %s', file_path)
+                # the spec is parsed from the same content that is hashed
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+                entry = (now, version, SPEC_KINDS[kind][1](json.loads(content)),
+                         hashlib.sha256(content).hexdigest())
+            else:
+                entry = (now, version) + entry[2:]
+            self._specs[key] = entry
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._specs.clear()
+
+registry = SpecRegistry()
+
+def get_spec(kind: str, spec_file: str) -> Any:
+    """Return the parsed spec from the process-wide registry."""
+    return registry.get(kind, spec_file)
+
+def get_spec_digest(kind: str, spec_file: str) -> str:
+    """Return the hash of the spec file from the process-wide registry."""
+    return registry.digest(kind, spec_file)
+
+def get_spec_with_digest(kind: str, spec_file: str) -> Tuple[Any, str]:
+    """Return the parsed spec and its hash from the process-wide registry."""
+    return registry.get_with_digest(kind, spec_file)
@@ -0,0 +1,71 @@
+"""
+This file includes helpers to compare wallet and contract addresses.
+
+Addresses are compared in their lowercase form, since the same address can be
+written with different (checksum) capitalization.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+def normalize_address(address: str) -> str:
+    """Return the address in the form used for comparisons."""
+    return address.strip().lower()
+
+class AddressSet(frozenset):
+    """Immutable set of normalized addresses, built by `address_set()`, so
+    the addresses are known to be normalized without checking them again.
+    """
+
+def address_set(addresses: Iterable[str]) -> AddressSet:
+    """Return an immutable set of the normalized `addresses`."""
+    if isinstance(addresses, AddressSet):
+        return addresses
+    return AddressSet(normalize_address(a) for a in addresses)
+
+class AddressMatcher:
+    """Set of addresses that transfers are matched against. The addresses
+    are normalized once when the matcher is built, so that matching a
+    transfer costs two set lookups regardless of the number of addresses.
+    """
+
+    def __init__(self, addresses: Iterable[str]):
+        self.addresses = address_set(addresses)
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __contains__(self, address: Optional[str]) -> bool:
+        return address is not None and address.lower() in self.addresses
+
+    def match(self, transfers: List[Dict]) -> Tuple[int, Set[str]]:
+        """Find the transfers from or to any of the addresses.
+
+        :param transfers: List of transfers with 'from' and 'to' addresses.
+        :type transfers: List[Dict]
+        :return: The number of matching transfers and the matched addresses.
+        :rtype: Tuple[int, Set[str]]
+        """
+        addresses = self.addresses
+        count = 0
+        counterparties = set()
+        for t in transfers:
+            matched = False
+            # 'to' is None for transfers that create contracts
+            for address in (t['from'], t['to']):
+                if address is not None:
+                    address = address.lower()
+                    if address in addresses:
+                        counterparties.add(address)
+                        matched = True
+            if matched:
+                count += 1
+        return count, counterparties
+
+    def count(self, transfers: List[Dict]) -> int:
+        """Return the number of transfers from or to any of the addresses."""
+        addresses = self.addresses
+        count = 0
+        for t in transfers:
+            if (t['from'] is not None and t['from'].lower() in addresses) or \
+                    (t['to'] is not None and t['to'].lower() in addresses):
+                count += 1
+        return count
@@ -3,77 +3,160 @@ This file includes utility functions that make requests to the Alchemy
 API. More about the API on: https://www.alchemy.com/
 
 It is required to have an API key to use the use the functions in this file.
+
+Each helper has an `*_async` counterpart that sends the same requests through
+the non-blocking client, to be awaited from a running event loop.
+
+The JSON-RPC helpers take the `network` to send the calls to, one of the
+networks in `chains.NETWORKS`. The NFT helpers are only for Ethereum.
 """
 import os
+import asyncio
 import logging
-from typing import Optional, List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Set, Tuple, Iterator, AsyncIterator
 
-import requests
+from . import http_client, metrics
+from .addresses import AddressSet, address_set
+from .chains import NETWORKS
 
 logger = logging.getLogger(__name__)
 logger.setLevel("DEBUG")
 
+# The API key is only needed when a request is sent, so the module can be
+# imported without it. Both settings can be changed with `configure()`.
 ALCHEMY_API_KEY = os.environ.get('ALCHEMY_API_KEY', None)
-if not ALCHEMY_API_KEY:
-    raise Exception('No ALCHEMY_API_KEY key provided.')
+# network -> base URL of the API, which can be pointed to a local stand-in
+# of the API, e.g. for benchmarks, with `ALCHEMY_BASE_URL` for Ethereum and
+# `ALCHEMY_BASE_URL_<NETWORK>` (e.g. `ALCHEMY_BASE_URL_POLYGON_POS`)
+ALCHEMY_BASE_URLS: Dict[str, str] = {
+    network: os.environ.get(
+        'ALCHEMY_BASE_URL' if network == 'ethereum'
+        else 'ALCHEMY_BASE_URL_' + network.upper().replace('-', '_'),
+        'https://%s.g.alchemy.com' % settings['alchemy'])
+    for network, settings in NETWORKS.items()
+}
 
-ALCHEMY_URL = f'https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}'
-ALCHEMY_NFT_URL = f'https://eth-mainnet.g.alchemy.com/nft/v2/{ALCHEMY_API_KEY}'
+# Maximum number of JSON-RPC calls sent in a single batch request
+ALCHEMY_BATCH_SIZE = int(os.environ.get('ALCHEMY_BATCH_SIZE', 100))
+
+# Maximum number of contract addresses in a single getNFTs request
+NFT_CONTRACTS_PER_REQUEST = 45
+# Maximum number of getNFTs requests of an account sent at the same time
+NFT_CHUNK_CONCURRENCY = int(os.environ.get('NFT_CHUNK_CONCURRENCY', 8))
 
 headers = {
     "accept": "application/json",
     "content-type": "application/json"
 }
 
-def account_nfts(wallet_address: str,
-                 nft_contract_addresses: List = [],
-                 include_spam: bool=False) -> List[str]:
-    """Fetch the NFTs associated with the account. Exclude SPAM NFTs. More
-    about the parameters passed: https://docs.alchemy.com/reference/getnfts
-
-    :param wallet_address: The wallet address as a string.
-    :type wallet_address: str
-    :param include_spam: Whether to include the NFTs categorizes as spam,
-        default False
-    :type include_spam: bool
-    :return: A list of all the NFTs the user has.
-    :rtype: List
+def configure(api_key: Optional[str] = None, base_url: Optional[str] = None,
+              network: str = 'ethereum'):
+    """Set the API key and the base URL of the API, instead of taking them
+    from the environment.
+
+    :param api_key: The Alchemy API key.
+    :type api_key: Optional[str]
+    :param base_url: URL of the API without the version and the key.
+    :type base_url: Optional[str]
+    :param network: The network that `base_url` is for, defaults to 'ethereum'
+    :type network: str
     """
+    global ALCHEMY_API_KEY
+
+    if api_key is not None:
+        ALCHEMY_API_KEY = api_key
+    if base_url is not None:
+        if network not in ALCHEMY_BASE_URLS:
+            raise Exception('Unsupported network: %s' % network)
+        ALCHEMY_BASE_URLS[network] = base_url.rstrip('/')
+
+def _api_key() -> str:
+    if not ALCHEMY_API_KEY:
+        raise Exception('No ALCHEMY_API_KEY key provided.')
+    return ALCHEMY_API_KEY
+
+def _rpc_url(network: str = 'ethereum') -> str:
+    if network not in ALCHEMY_BASE_URLS:
+        raise Exception('Unsupported network: %s' % network)
+    return f'{ALCHEMY_BASE_URLS[network]}/v2/{_api_key()}'
+
+def _nft_url() -> str:
+    return f"{ALCHEMY_BASE_URLS['ethereum']}/nft/v2/{_api_key()}"
+
+def _check_response(r, payload):
+    if r.status_code != 200:
+        logger.error('Alchemy request returned status code %d, payload %s',
+                        r.status_code, payload)
+        raise Exception('Request returned status code %s' % r.status_code)
+
+def _rpc_payload(method: str, params: List, call_id: int = 1) -> Dict:
+    return {
+        'id': call_id,
+        'jsonrpc': '2.0',
+        'method': method,
+        'params': params,
+    }
+
+def _rpc(method: str, params: List, network: str = 'ethereum'):
+    payload = _rpc_payload(method, params)
+    r = http_client.post(_rpc_url(network), json=payload, headers=headers)
+    _check_response(r, payload)
+    return r.json()['result']
+
+async def _rpc_async(method: str, params: List, network: str = 'ethereum'):
+    payload = _rpc_payload(method, params)
+    r = await http_client.async_post(_rpc_url(network), json=payload, headers=headers)
+    _check_response(r, payload)
+    return r.json()['result']
+
+def _nft_arguments(wallet_address: str, nft_contract_addresses: List,
+                   include_spam: bool) -> Dict:
     arguments = {
         'owner': wallet_address,
         'pageSize': 100,
         'withMetadata': 'false',
     }
 
-    if len(nft_contract_addresses) > 45:
-        raise Exception('Can only test up to 45 NFT contract addresses at a time.')
-
     if nft_contract_addresses:
         arguments['contractAddresses[]'] = ','.join(nft_contract_addresses)
 
     if not include_spam:
         arguments['excludeFilters[]'] = 'SPAM'
 
+    return arguments
+
+def _contract_chunks(nft_contract_addresses: List[str]) -> List[List[str]]:
+    """Split the unique contract addresses in chunks that fit in a single
+    getNFTs request. No addresses result in a single request for all the
+    NFTs of the account."""
+    unique_addresses = list(dict.fromkeys(a.lower() for a in nft_contract_addresses))
+    if not unique_addresses:
+        return [[]]
+    return [unique_addresses[i:i + NFT_CONTRACTS_PER_REQUEST]
+            for i in range(0, len(unique_addresses), NFT_CONTRACTS_PER_REQUEST)]
+
+def _iter_nft_pages(wallet_address: str, nft_contract_addresses: List,
+                    include_spam: bool) -> Iterator[List]:
+    arguments = _nft_arguments(wallet_address, nft_contract_addresses, include_spam)
+
     pageKey = None
 
     logger.debug('Get NFTs for address: %s', wallet_address)
-    nfts = []
 
     while True:
         # if there are more pages with results pass the key of the next page
         if pageKey:
             arguments['pageKey'] = pageKey
 
-        r = requests.get(ALCHEMY_NFT_URL + '/getNFTs', params=arguments,
+        r = http_client.get(_nft_url() + '/getNFTs', params=arguments,
                             headers={"accept": "application/json"})
-
-        if r.status_code != 200:
-            logger.error('Alchemy request returned status code %d, payload %s',
-                            r.status_code, arguments)
-            raise Exception('Request returned status code %s' % r.status_code)
+        _check_response(r, arguments)
 
         result = r.json()
-        nfts.extend(result['ownedNfts'])
+        metrics.UPSTREAM_PAGES.inc('nfts')
+        yield result['ownedNfts']
 
         # if there are more pages of tranfers to retrieve, send a request
         # with the updated 'pageKey', else all transfers have been retrieved
@@ -82,8 +165,178 @@ def account_nfts(wallet_address: str,
         else:
             break
 
+async def _iter_nft_pages_async(wallet_address: str, nft_contract_addresses: List,
+                                include_spam: bool) -> AsyncIterator[List]:
+    arguments = _nft_arguments(wallet_address, nft_contract_addresses, include_spam)
+
+    logger.debug('Get NFTs for address: %s', wallet_address)
+
+    while True:
+        r = await http_client.async_get(_nft_url() + '/getNFTs',
+                                        params=arguments,
+                                        headers={"accept": "application/json"})
+        _check_response(r, arguments)
+
+        result = r.json()
+        metrics.UPSTREAM_PAGES.inc('nfts')
+        yield result['ownedNfts']
+
+        if 'pageKey' in result:
+            arguments['pageKey'] = result['pageKey']
+        else:
+            break
+
+def _account_nfts_chunk(wallet_address: str, nft_contract_addresses: List,
+                        include_spam: bool) -> List:
+    nfts = []
+    for page in _iter_nft_pages(wallet_address, nft_contract_addresses, include_spam):
+        nfts.extend(page)
+    return nfts
+
+async def _account_nfts_chunk_async(wallet_address: str, nft_contract_addresses: List,
+                                    include_spam: bool) -> List:
+    nfts = []
+    async for page in _iter_nft_pages_async(wallet_address, nft_contract_addresses,
+                                            include_spam):
+        nfts.extend(page)
+    return nfts
+
+def account_nfts(wallet_address: str,
+                 nft_contract_addresses: List = [],
+                 include_spam: bool=False) -> List[str]:
+    """Fetch the NFTs associated with the account. Exclude SPAM NFTs. More
+    about the parameters passed: https://docs.alchemy.com/reference/getnfts
+
+    When there are more than `NFT_CONTRACTS_PER_REQUEST` contract addresses
+    they are split in chunks which are queried concurrently.
+
+    :param wallet_address: The wallet address as a string.
+    :type wallet_address: str
+    :param nft_contract_addresses: Only return the NFTs of these contracts,
+        default all the NFTs.
+    :type nft_contract_addresses: List
+    :param include_spam: Whether to include the NFTs categorizes as spam,
+        default False
+    :type include_spam: bool
+    :return: A list of all the NFTs the user has.
+    :rtype: List
+    """
+    chunks = _contract_chunks(nft_contract_addresses)
+    if len(chunks) == 1:
+        return _account_nfts_chunk(wallet_address, chunks[0], include_spam)
+
+    nfts = []
+    with ThreadPoolExecutor(min(len(chunks), NFT_CHUNK_CONCURRENCY)) as executor:
+        for chunk_nfts in executor.map(
+                lambda chunk: _account_nfts_chunk(wallet_address, chunk, include_spam),
+                chunks):
+            nfts.extend(chunk_nfts)
     return nfts
 
+async def account_nfts_async(wallet_address: str,
+                             nft_contract_addresses: List = [],
+                             include_spam: bool=False) -> List[str]:
+    """Async version of `account_nfts()`."""
+    semaphore = asyncio.Semaphore(NFT_CHUNK_CONCURRENCY)
+
+    async def fetch(chunk):
+        async with semaphore:
+            return await _account_nfts_chunk_async(wallet_address, chunk, include_spam)
+
+    nfts = []
+    for chunk_nfts in await asyncio.gather(
+            *[fetch(chunk) for chunk in _contract_chunks(nft_contract_addresses)]):
+        nfts.extend(chunk_nfts)
+    return nfts
+
+def account_nft_contracts(wallet_address: str, nft_contract_addresses: List,
+                          include_spam: bool = False,
+                          stop_after: Optional[int] = None) -> AddressSet:
+    """Find which of the `nft_contract_addresses` the account owns NFTs of.
+    The contract addresses are queried concurrently in chunks, keeping only
+    a running set of the owned contracts. If `stop_after` is given, no more
+    pages are fetched once that many contracts have been found.
+
+    :param wallet_address: The wallet address as a string.
+    :type wallet_address: str
+    :param nft_contract_addresses: List of contract addresses for NFTs.
+    :type nft_contract_addresses: List
+    :param include_spam: Whether to include the NFTs categorizes as spam,
+        default False
+    :type include_spam: bool
+    :param stop_after: Number of owned contracts after which to stop.
+    :type stop_after: Optional[int]
+    :return: The lowercase addresses of the owned contracts.
+    :rtype: AddressSet
+    """
+    chunks = _contract_chunks(nft_contract_addresses)
+
+    owned = set()
+    lock = threading.Lock()
+    found = threading.Event()
+
+    def collect(chunk):
+        if found.is_set():
+            return
+        for page in _iter_nft_pages(wallet_address, chunk, include_spam):
+            with lock:
+                owned.update(nft_contract_set(page))
+                if stop_after is not None and len(owned) >= stop_after:
+                    found.set()
+            if found.is_set():
+                break
+
+    if len(chunks) == 1:
+        collect(chunks[0])
+        return address_set(owned)
+
+    executor = ThreadPoolExecutor(min(len(chunks), NFT_CHUNK_CONCURRENCY))
+    try:
+        futures = [executor.submit(collect, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            future.result()
+            if found.is_set():
+                break
+    finally:
+        # the chunks that have not started yet are not queried
+        executor.shutdown(wait=False, cancel_futures=True)
+    return address_set(owned)
+
+async def account_nft_contracts_async(wallet_address: str,
+                                      nft_contract_addresses: List,
+                                      include_spam: bool = False,
+                                      stop_after: Optional[int] = None) -> AddressSet:
+    """Async version of `account_nft_contracts()`. The queries of the
+    remaining chunks are cancelled once `stop_after` contracts are found.
+    """
+    semaphore = asyncio.Semaphore(NFT_CHUNK_CONCURRENCY)
+    owned = set()
+    found = asyncio.Event()
+
+    async def collect(chunk):
+        async with semaphore:
+            if found.is_set():
+                return
+            async for page in _iter_nft_pages_async(wallet_address, chunk,
+                                                    include_spam):
+                owned.update(nft_contract_set(page))
+                if stop_after is not None and len(owned) >= stop_after:
+                    found.set()
+                if found.is_set():
+                    break
+
+    tasks = [asyncio.create_task(collect(chunk))
+                for chunk in _contract_chunks(nft_contract_addresses)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            await finished
+            if found.is_set():
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    return address_set(owned)
+
 def unique_nft_contracts(account_nfts: List) -> List:
     """From a list of NFT-related data received by the Alchemy API, keep only
     the list of the unique NFT contract addresses.
@@ -93,21 +346,13 @@ def unique_nft_contracts(account_nfts: List) -> List:
     :return: List of unique contract addresses.
     :rtype: List
     """
-    unique_nft_contract_addresses = set()
-    for nft in account_nfts:
-        if nft['contract']['address'] not in unique_nft_contract_addresses:
-            unique_nft_contract_addresses.add(nft['contract']['address'])
-    return list(unique_nft_contract_addresses)
+    return list({nft['contract']['address'] for nft in account_nfts})
 
-def account_transfers(wallet_address: str, direction: Optional[str] = 'to',
-                        from_block: Optional[str] = "0x0") -> List:
-    # Main payload to send. Will be updated it for paginated requests.
-    payload = {
-        'id': 1,
-        'jsonrcp': '2.0',
-        'method': 'alchemy_getAssetTransfers',
-    }
+def nft_contract_set(account_nfts: List) -> Set[str]:
+    """Return the set of the lowercase contract addresses of the NFTs."""
+    return {nft['contract']['address'].lower() for nft in account_nfts}
 
+def _transfer_params(wallet_address: str, direction: str, from_block: str) -> Dict:
     params = {
         "fromBlock": from_block,
         "toBlock": "latest",
@@ -123,26 +368,39 @@ def account_transfers(wallet_address: str, direction: Optional[str] = 'to',
     else:
         params['fromAddress'] = wallet_address
 
+    return params
+
+def iter_account_transfers(wallet_address: str, direction: Optional[str] = 'to',
+                           from_block: Optional[str] = "0x0",
+                           network: str = 'ethereum') -> Iterator[List]:
+    """Yield the transfers of the account one page at a time, so that the
+    caller can stop fetching pages when it has found what it needs.
+
+    :param wallet_address: The wallet address as a string.
+    :type wallet_address: str
+    :param direction: 'to' for incoming and 'from' for outgoing transfers.
+    :type direction: Optional[str]
+    :param from_block: The first block to look for transfers, default "0x0".
+    :type from_block: Optional[str]
+    :param network: The network of the transfers, defaults to 'ethereum'
+    :type network: str
+    :return: Iterator over the pages of transfers.
+    :rtype: Iterator[List]
+    """
+    params = _transfer_params(wallet_address, direction, from_block)
+
     pageKey = None
 
     logger.debug('Get account transfers for address: %s', wallet_address)
-    transfers = []
 
     while True:
         # if there are more pages with results pass the key of the next page
         if pageKey:
             params['pageKey'] = pageKey
 
-        # update the parameters to send as payload
-        payload['params'] = [params]
-        r = requests.post(ALCHEMY_URL, json=payload, headers=headers)
-        if r.status_code != 200:
-            logger.error('Alchemy request returned status code %d, payload %s',
-                            r.status_code, payload)
-            raise Exception('Request returned status code %s' % r.status_code)
-
-        result = r.json()['result']
-        transfers.extend(result['transfers'])
+        result = _rpc('alchemy_getAssetTransfers', [params], network)
+        metrics.UPSTREAM_PAGES.inc('transfers')
+        yield result['transfers']
 
         # if there are more pages of tranfers to retrieve, send a request
         # with the updated 'pageKey', else all transfers have been retrieved
@@ -150,9 +408,47 @@ def account_transfers(wallet_address: str, direction: Optional[str] = 'to',
             pageKey = result['pageKey']
         else:
             break
+
+async def iter_account_transfers_async(wallet_address: str,
+                                       direction: Optional[str] = 'to',
+                                       from_block: Optional[str] = "0x0",
+                                       network: str = 'ethereum') -> AsyncIterator[List]:
+    """Async version of `iter_account_transfers()`."""
+    params = _transfer_params(wallet_address, direction, from_block)
+
+    logger.debug('Get account transfers for address: %s', wallet_address)
+
+    while True:
+        result = await _rpc_async('alchemy_getAssetTransfers', [params], network)
+        metrics.UPSTREAM_PAGES.inc('transfers')
+        yield result['transfers']
+
+        if 'pageKey' in result:
+            params['pageKey'] = result['pageKey']
+        else:
+            break
+
+def account_transfers(wallet_address: str, direction: Optional[str] = 'to',
+                        from_block: Optional[str] = "0x0",
+                        network: str = 'ethereum') -> List:
+    transfers = []
+    for page in iter_account_transfers(wallet_address, direction, from_block,
+                                       network):
+        transfers.extend(page)
     return transfers
 
-def current_token_balances(wallet_address: str) -> Dict:
+async def account_transfers_async(wallet_address: str,
+                                  direction: Optional[str] = 'to',
+                                  from_block: Optional[str] = "0x0",
+                                  network: str = 'ethereum') -> List:
+    """Async version of `account_transfers()`."""
+    transfers = []
+    async for page in iter_account_transfers_async(wallet_address, direction,
+                                                    from_block, network):
+        transfers.extend(page)
+    return transfers
+
+def current_token_balances(wallet_address: str, network: str = 'ethereum') -> Dict:
     """Get the balance for each ERC20 token that the wallet
     address currently holds.
 
@@ -163,57 +459,158 @@ def current_token_balances(wallet_address: str) -> Dict:
     :return: A dictionary with contractAddress keys -> tokenBalance values.
     :rtype: dict
     """
-    payload = {
-        'id': 1,
-        'jsonrcp': '2.0',
-        'method': 'alchemy_getTokenBalances',
-        "params": [wallet_address]
-    }
     logger.debug('Get ERC20 balance for address: %s', wallet_address)
-    r = requests.post(ALCHEMY_URL, json=payload, headers=headers)
-    if r.status_code != 200:
-        logger.error('Alchemy request returned status code %d, payload %s',
-                        r.status_code, payload)
-        raise Exception('Request returned status code %s' % r.status_code)
+    return _token_balances(_rpc('alchemy_getTokenBalances', [wallet_address],
+                                network))
 
-    token_balances = r.json()['result']['tokenBalances']
+async def current_token_balances_async(wallet_address: str,
+                                       network: str = 'ethereum') -> Dict:
+    """Async version of `current_token_balances()`."""
+    logger.debug('Get ERC20 balance for address: %s', wallet_address)
+    return _token_balances(
+        await _rpc_async('alchemy_getTokenBalances', [wallet_address], network))
+
+def _token_balances(result: Dict) -> Dict:
     ret = {}
-    for tb in token_balances:
+    for tb in result['tokenBalances']:
         ret[tb['contractAddress']] = tb['tokenBalance']
     return ret
 
-def current_eth_balance(wallet_address: str):
+def current_eth_balance(wallet_address: str, network: str = 'ethereum'):
     """Retrieve current balance of wallet's ETH.
     """
-    payload = {
-        'id': 1,
-        'jsonrcp': '2.0',
-        'method': 'eth_getBalance',
-        "params": [wallet_address]
-    }
     logger.debug('Get ETH balance for address: %s', wallet_address)
-    r = requests.post(ALCHEMY_URL, json=payload, headers=headers)
-    if r.status_code != 200:
-        logger.error('Alchemy request returned status code %d, payload %s',
-                        r.status_code, payload)
-        raise Exception('Request returned status code %s' % r.status_code)
+    return _rpc('eth_getBalance', [wallet_address, 'latest'], network)
 
-    return r.json()['result']
+async def current_eth_balance_async(wallet_address: str, network: str = 'ethereum'):
+    """Async version of `current_eth_balance()`."""
+    logger.debug('Get ETH balance for address: %s', wallet_address)
+    return await _rpc_async('eth_getBalance', [wallet_address, 'latest'], network)
 
-def get_token_metadata(contract_address: str):
+def get_token_metadata(contract_address: str, network: str = 'ethereum'):
     """Retrieve metadata for a specific contract address.
     """
-    payload = {
-        'id': 1,
-        'jsonrcp': '2.0',
-        'method': 'alchemy_getTokenMetadata',
-        "params": [contract_address]
-    }
     logger.debug('Get metadata for token: %s', contract_address)
-    r = requests.post(ALCHEMY_URL, json=payload, headers=headers)
-    if r.status_code != 200:
-        logger.error('Alchemy request returned status code %d, payload %s',
-                        r.status_code, payload)
-        raise Exception('Request returned status code %s' % r.status_code)
+    return _rpc('alchemy_getTokenMetadata', [contract_address], network)
 
-    return r.json()['result']
+async def get_token_metadata_async(contract_address: str, network: str = 'ethereum'):
+    """Async version of `get_token_metadata()`."""
+    logger.debug('Get metadata for token: %s', contract_address)
+    return await _rpc_async('alchemy_getTokenMetadata', [contract_address], network)
+
+def _batch_payloads(calls: List[Tuple[str, List]]):
+    for start in range(0, len(calls), ALCHEMY_BATCH_SIZE):
+        payload = [_rpc_payload(method, params, call_id)
+                    for call_id, (method, params)
+                    in enumerate(calls[start:start + ALCHEMY_BATCH_SIZE], start)]
+        logger.debug('Send batch of %d calls', len(payload))
+        yield start, payload
+
+def _batch_results(r, start: int, payload: List, results: List):
+    _check_response(r, payload)
+
+    received = set()
+    for response in r.json():
+        if 'error' in response:
+            logger.error('Alchemy call %s returned error %s',
+                            payload[response['id'] - start], response['error'])
+            raise Exception('Call returned error %s' % response['error'])
+        results[response['id']] = response['result']
+        received.add(response['id'])
+
+    if len(received) != len(payload):
+        raise Exception('Batch request returned %d of %d results' %
+                        (len(received), len(payload)))
+
+def batch_request(calls: List[Tuple[str, List]], network: str = 'ethereum') -> List:
+    """Send multiple JSON-RPC calls to Alchemy as batch requests, each one
+    with up to `ALCHEMY_BATCH_SIZE` calls. The responses of a batch can come
+    in any order, so they are mapped back to the calls by their `id`.
+
+    :param calls: List of (method, params) tuples.
+    :type calls: List[Tuple[str, List]]
+    :param network: The network to send the calls to, defaults to 'ethereum'
+    :type network: str
+    :raises Exception: When a request returns a status code other than 200
+        or any of the calls returns an error.
+    :return: The results of the calls, in the same order as the `calls`.
+    :rtype: List
+    """
+    results = [None] * len(calls)
+    for start, payload in _batch_payloads(calls):
+        r = http_client.post(_rpc_url(network), json=payload, headers=headers)
+        _batch_results(r, start, payload, results)
+    return results
+
+async def batch_request_async(calls: List[Tuple[str, List]],
+                              network: str = 'ethereum') -> List:
+    """Async version of `batch_request()`. The batches are sent concurrently.
+    """
+    results = [None] * len(calls)
+
+    async def send(start, payload):
+        r = await http_client.async_post(_rpc_url(network), json=payload,
+                                         headers=headers)
+        _batch_results(r, start, payload, results)
+
+    await asyncio.gather(*[send(start, payload)
+                            for start, payload in _batch_payloads(calls)])
+    return results
+
+def current_balances(wallet_address: str, network: str = 'ethereum') -> Tuple[str, Dict]:
+    """Get the ETH balance and the balance for each ERC20 token that the
+    wallet address currently holds with a single batch request. On other
+    networks the balance of their native coin is returned instead of ETH.
+
+    :param wallet_address: String of the wallet address.
+    :type wallet_address: str
+    :param network: The network of the balances, defaults to 'ethereum'
+    :type network: str
+    :return: The hex ETH balance and a dictionary with contractAddress
+        keys -> tokenBalance values.
+    :rtype: Tuple[str, Dict]
+    """
+    logger.debug('Get ETH and ERC20 balance for address: %s', wallet_address)
+    eth_balance, token_balances = batch_request(_balance_calls(wallet_address),
+                                                network)
+    return eth_balance, _token_balances(token_balances)
+
+async def current_balances_async(wallet_address: str,
+                                 network: str = 'ethereum') -> Tuple[str, Dict]:
+    """Async version of `current_balances()`."""
+    logger.debug('Get ETH and ERC20 balance for address: %s', wallet_address)
+    eth_balance, token_balances = await batch_request_async(
+        _balance_calls(wallet_address), network)
+    return eth_balance, _token_balances(token_balances)
+
+def _balance_calls(wallet_address: str) -> List[Tuple[str, List]]:
+    return [
+        ('eth_getBalance', [wallet_address, 'latest']),
+        ('alchemy_getTokenBalances', [wallet_address]),
+    ]
+
+def get_tokens_metadata(contract_addresses: List[str],
+                        network: str = 'ethereum') -> Dict[str, Dict]:
+    """Retrieve the metadata for multiple contract addresses using batch
+    requests.
+
+    :param contract_addresses: List of token contract addresses.
+    :type contract_addresses: List[str]
+    :param network: The network of the tokens, defaults to 'ethereum'
+    :type network: str
+    :return: Dictionary of contract address -> metadata.
+    :rtype: Dict[str, Dict]
+    """
+    logger.debug('Get metadata for %d tokens', len(contract_addresses))
+    results = batch_request([('alchemy_getTokenMetadata', [address])
+                                for address in contract_addresses], network)
+    return dict(zip(contract_addresses, results))
+
+async def get_tokens_metadata_async(contract_addresses: List[str],
+                                    network: str = 'ethereum') -> Dict[str, Dict]:
+    """Async version of `get_tokens_metadata()`."""
+    logger.debug('Get metadata for %d tokens', len(contract_addresses))
+    results = await batch_request_async([('alchemy_getTokenMetadata', [address])
+                                            for address in contract_addresses],
+                                        network)
+    return dict(zip(contract_addresses, results))
@@ -0,0 +1,320 @@
+"""
+This file includes the caches used to keep the results of the API calls
+around between requests:
+- `LRUCache`: in-process cache with a maximum size and an optional TTL.
+- `SQLiteCache`: on-disk cache that survives restarts of the server.
+- `TieredCache`: an `LRUCache` in front of a `SQLiteCache`.
+
+Each cache counts its hits and misses, which can be read with `stats()`.
+"""
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# Directory where the on-disk caches are stored
+CACHE_DIR = os.environ.get('CACHE_DIR', '.cache')
+
+MISSING = object()
+
+def cache_path(filename: str) -> str:
+    """Return the path of `filename` under the `CACHE_DIR` directory, which
+    is created if it does not exist.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+class LRUCache:
+    """In-process cache that evicts the least recently used entry when it
+    holds more than `maxsize` entries. Entries older than `ttl` seconds are
+    treated as missing.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is not MISSING:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Remove the entries whose key starts with `prefix` and return
+        their number."""
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+class SQLiteCache:
+    """On-disk cache stored in a SQLite database. The values are stored as
+    JSON. Entries older than `ttl` seconds are treated as missing and, when
+    there are more than `max_entries`, the oldest entries are removed.
+    """
+
+    # SQLite limits the number of parameters of a query
+    _KEYS_PER_QUERY = 500
+
+    def __init__(self, path: str, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # the database is opened on first use
+        if self._conn is None:
+            logger.debug('Open cache database: %s', self.path)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                                'stored_at REAL NOT NULL, expires REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS cache_stored_at '
+                                'ON cache (stored_at)')
+        return self._conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[tuple]:
+        """Return the value and the time it expires at, None if it doesn't
+        expire, or None if the key is missing."""
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                self.hits += 1
+                return json.loads(row[0]), row[1]
+            self.misses += 1
+            return None
+
+    def get_entries(self, keys: List[str]) -> Dict[str, Tuple[Any, Optional[float]]]:
+        """Return the value and the expiry time, as `get_entry()` does, of
+        each of the `keys` that is stored, looked up with a query per
+        `_KEYS_PER_QUERY` keys."""
+        now = time.time()
+        entries = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(keys), self._KEYS_PER_QUERY):
+                chunk = keys[i:i + self._KEYS_PER_QUERY]
+                rows = conn.execute(
+                    'SELECT key, value, expires FROM cache WHERE key IN (%s)'
+                    % ','.join('?' * len(chunk)), chunk).fetchall()
+                for key, value, expires in rows:
+                    if expires is None or expires > now:
+                        entries[key] = (json.loads(value), expires)
+            self.hits += len(entries)
+            self.misses += len(set(keys)) - len(entries)
+        return entries
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Store all the `items` in a single transaction."""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                                    [(key, json.dumps(value), now, expires)
+                                     for key, value in items.items()])
+            writes = self._writes
+            self._writes += len(items)
+            # check the size every few writes instead of on every write
+            if self.max_entries is not None and writes // 100 != self._writes // 100:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute('DELETE FROM cache WHERE expires IS NOT NULL '
+                            'AND expires <= ?', (time.time(),))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                            'ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                            (self.max_entries,))
+
+    def delete(self, key: str):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Remove the entries whose key starts with `prefix` and return
+        their number."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute('DELETE FROM cache WHERE substr(key, 1, ?) = ?',
+                                    (len(prefix), prefix)).rowcount
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM cache')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute(
+                'SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+class TieredCache:
+    """An `LRUCache` in front of a `SQLiteCache`. Values found only on disk
+    are copied to memory, new values are written to both. The `*_async`
+    methods run the disk operations in a worker thread, so they don't block
+    the event loop.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, MISSING)
+        if value is MISSING and self.disk is not None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                value = self._copy_to_memory(key, entry)
+        return default if value is MISSING else value
+
+    def _copy_to_memory(self, key: str, entry: Tuple[Any, Optional[float]]) -> Any:
+        value, expires = entry
+        # the copy in memory expires no later than the one on disk
+        ttl = self.memory.ttl
+        if expires is not None:
+            remaining = max(expires - time.time(), 0)
+            ttl = remaining if ttl is None else min(ttl, remaining)
+        self.memory.set(key, value, ttl)
+        return value
+
+    def _get_many_memory(self, keys: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+        values = {}
+        missing = []
+        for key in keys:
+            value = self.memory.get(key, MISSING)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+        return values, missing
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Return the values of the `keys` that are cached. The keys missing
+        from memory are looked up on disk together."""
+        values, missing = self._get_many_memory(keys)
+        if missing and self.disk is not None:
+            for key, entry in self.disk.get_entries(missing).items():
+                values[key] = self._copy_to_memory(key, entry)
+        return values
+
+    async def get_many_async(self, keys: List[str]) -> Dict[str, Any]:
+        """Async version of `get_many()`."""
+        values, missing = self._get_many_memory(keys)
+        if missing and self.disk is not None:
+            entries = await asyncio.to_thread(self.disk.get_entries, missing)
+            for key, entry in entries.items():
+                values[key] = self._copy_to_memory(key, entry)
+        return values
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Store all the `items`, on disk in a single transaction."""
+        for key, value in items.items():
+            self.memory.set(key, value, ttl)
+        if self.disk is not None and items:
+            self.disk.set_many(items, ttl)
+
+    async def set_many_async(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Async version of `set_many()`."""
+        for key, value in items.items():
+            self.memory.set(key, value, ttl)
+        if self.disk is not None and items:
+            await asyncio.to_thread(self.disk.set_many, items, ttl)
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        count = self.memory.delete_prefix(prefix)
+        if self.disk is not None:
+            count = max(count, self.disk.delete_prefix(prefix))
+        return count
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        disk = self.disk.stats() if self.disk is not None else {'hits': 0}
+        return {
+            'memory_hits': self.memory.hits,
+            'disk_hits': disk['hits'],
+            'misses': self.memory.misses - disk['hits'],
+            'size': len(self.memory),
+        }
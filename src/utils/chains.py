@@ -0,0 +1,32 @@
+"""
+The blockchain networks that the wallets can be checked on.
+
+A network is named by its CoinGecko platform id, e.g. 'polygon-pos', which is
+also the name that the contract indexes, the token prices and the token
+metadata are stored under.
+"""
+from typing import Dict
+
+# network -> subdomain of the Alchemy API, CoinGecko id of the native coin
+# and spec file with the money mixer addresses on the network
+NETWORKS: Dict[str, Dict[str, str]] = {
+    'ethereum': {
+        'alchemy': 'eth-mainnet',
+        'native_coin': 'ethereum',
+        'money_mixer_spec': 'tornado_addresses_ethereum.json',
+    },
+    'polygon-pos': {
+        'alchemy': 'polygon-mainnet',
+        'native_coin': 'polygon-ecosystem-token',
+        'money_mixer_spec': 'tornado_addresses_polygon.json',
+    },
+}
+
+def network_setting(network: str, setting: str) -> str:
+    """Return a setting of the network from `NETWORKS`.
+
+    :raises Exception: When the network is not supported.
+    """
+    if network not in NETWORKS:
+        raise Exception('Unsupported network: %s' % network)
+    return NETWORKS[network][setting]
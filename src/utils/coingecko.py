@@ -1,24 +1,167 @@
 """
 This file includes utility functions that make requests to the CoinGecko
 API. More about the API on: https://www.coingecko.com/en/api/documentation
+
+The price and metadata helpers have an `*_async` counterpart that sends the
+same requests through the non-blocking client.
 """
 
+import os
 import json
+import asyncio
 import logging
-from typing import List, Optional
+import threading
+from typing import Dict, List, Mapping, Optional
 
-import requests
+from . import http_client, metrics
+from .cache import LRUCache, MISSING
+from .chains import network_setting
+from .contract_snapshot import ContractSnapshot, write_snapshot
 
 logger = logging.getLogger(__name__)
 logger.setLevel("DEBUG")
 
-COINGECKO_URL = 'https://api.coingecko.com/api/v3/'
+# Can be pointed to a local stand-in of the API, e.g. for benchmarks
+COINGECKO_URL = os.environ.get('COINGECKO_URL', 'https://api.coingecko.com/api/v3/')
 COIN_DATA_STORAGE_FILE = '%s-coin-address.json'
 
+# Seconds that a fetched price is reused before it is requested again
+COINGECKO_PRICE_TTL = float(os.environ.get('COINGECKO_PRICE_TTL', 60))
+# Maximum length of the URL of a request for multiple token prices
+COINGECKO_MAX_URL_LENGTH = int(os.environ.get('COINGECKO_MAX_URL_LENGTH', 2000))
+
+# Shared cache of the token and currency prices
+price_cache = LRUCache(maxsize=50000, ttl=COINGECKO_PRICE_TTL)
+metrics.register_cache('prices', lambda: price_cache.stats())
+
+# network -> ((inode, modification time) of the snapshot, contract index)
+_contract_indexes = {}
+_contract_indexes_lock = threading.Lock()
+
 headers = {
     "accept": "application/json",
 }
 
+def configure(base_url: Optional[str] = None):
+    """Set the base URL of the API, instead of taking it from the environment.
+    """
+    global COINGECKO_URL
+
+    if base_url is not None:
+        COINGECKO_URL = base_url.rstrip('/') + '/'
+
+def _price_chunks(contract_addresses: List[str], network: str) -> List[List[str]]:
+    """Split the addresses in chunks, so that the URL of the request for each
+    chunk is not longer than `COINGECKO_MAX_URL_LENGTH`.
+    """
+    # base URL plus the rest of the parameters
+    base_length = len(COINGECKO_URL + f'simple/token_price/{network}'
+                        '?vs_currencies=usd&contract_addresses=')
+    chunks = []
+    chunk = []
+    length = base_length
+    for address in contract_addresses:
+        # each address is followed by an url-encoded comma
+        address_length = len(address) + 3
+        if chunk and length + address_length > COINGECKO_MAX_URL_LENGTH:
+            chunks.append(chunk)
+            chunk = []
+            length = base_length
+        chunk.append(address)
+        length += address_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _check_response(r):
+    if r.status_code != 200:
+        logger.error('CoinGecko request returned status code %d', r.status_code)
+        raise Exception('Request returned status code %s' % r.status_code)
+
+def _cached_prices(contract_addresses: List[str], network: str):
+    """Split the addresses to the ones with a cached price and the ones
+    that need to be requested."""
+    prices = {}
+    missing = []
+    for address in contract_addresses:
+        price = price_cache.get(f'{network}:{address.lower()}', MISSING)
+        if price is MISSING:
+            missing.append(address.lower())
+        elif price is not None:
+            prices[address] = price
+
+    # the same token can be passed more than once
+    return prices, list(dict.fromkeys(missing))
+
+def _price_parameters(chunk: List[str]) -> Dict:
+    logger.debug('Get price for %d tokens', len(chunk))
+    return {
+        'contract_addresses': ','.join(chunk),
+        'vs_currencies': 'usd',
+    }
+
+def _store_prices(chunk: List[str], response: Dict, network: str, fetched: Dict):
+    result = {k.lower(): v for k, v in response.items()}
+    for address in chunk:
+        # tokens without a price are cached too, to not request them again
+        price = result.get(address, {}).get('usd')
+        price_cache.set(f'{network}:{address}', price)
+        fetched[address] = price
+
+def _merge_prices(contract_addresses: List[str], prices: Dict, fetched: Dict) -> Dict:
+    for address in contract_addresses:
+        price = fetched.get(address.lower())
+        if price is not None:
+            prices[address] = price
+    return prices
+
+def get_token_prices(contract_addresses: List[str],
+                     network: Optional[str] = 'ethereum') -> Dict[str, float]:
+    """Get the current price in USD of multiple tokens, based on their
+    'contract_addresses' and the blockchain network where the contracts are
+    deployed. The prices that are not in the price cache are requested with
+    as few requests as the URL length allows.
+
+    :param contract_addresses: The hashes of the addresses of the contracts.
+    :type contract_addresses: List[str]
+    :param network: The name of the blockcahin network, defaults to 'ethereum'
+    :type network: Optional[str], optional
+    :raises Exception: When the returned response code of a request is not 200.
+    :return: Dictionary of contract address -> price in USD. Tokens that
+        CoinGecko has no price for are not included.
+    :rtype: Dict[str, float]
+    """
+    prices, missing = _cached_prices(contract_addresses, network)
+
+    fetched = {}
+    for chunk in _price_chunks(missing, network):
+        r = http_client.get(COINGECKO_URL + f'simple/token_price/{network}',
+                            params=_price_parameters(chunk), headers=headers)
+        _check_response(r)
+        _store_prices(chunk, r.json(), network, fetched)
+
+    return _merge_prices(contract_addresses, prices, fetched)
+
+async def get_token_prices_async(contract_addresses: List[str],
+                                 network: Optional[str] = 'ethereum') -> Dict[str, float]:
+    """Async version of `get_token_prices()`. The chunks are requested
+    concurrently.
+    """
+    prices, missing = _cached_prices(contract_addresses, network)
+
+    fetched = {}
+
+    async def fetch(chunk):
+        r = await http_client.async_get(COINGECKO_URL + f'simple/token_price/{network}',
+                                        params=_price_parameters(chunk),
+                                        headers=headers)
+        _check_response(r)
+        _store_prices(chunk, r.json(), network, fetched)
+
+    await asyncio.gather(*[fetch(chunk) for chunk in _price_chunks(missing, network)])
+
+    return _merge_prices(contract_addresses, prices, fetched)
+
 def get_token_price(contract_address: str, network: Optional[str] = 'ethereum') -> str:
     """Get current price in USD of token based on the 'contract_address' and
     the blockchain network where the contract is deployed. Use the CoinGecko
@@ -28,38 +171,67 @@ def get_token_price(contract_address: str, network: Optional[str] = 'ethereum')
     :type contract_address: str
     :param network: The name of the blockcahin network, defaults to 'ethereum'
     :type network: Optional[str], optional
-    :raises Exception: When the returned response code of the request is not 200.
+    :raises Exception: When the returned response code of the request is not
+        200 or there is no price for the token.
     :return: The exchange rate of the token in USD.
     :rtype: str
     """
-    parameters = {
-        'contract_addresses': contract_address,
+    prices = get_token_prices([contract_address], network)
+    if contract_address not in prices:
+        raise Exception('No price for token %s' % contract_address)
+    return prices[contract_address]
+
+async def get_token_price_async(contract_address: str,
+                                network: Optional[str] = 'ethereum') -> str:
+    """Async version of `get_token_price()`."""
+    prices = await get_token_prices_async([contract_address], network)
+    if contract_address not in prices:
+        raise Exception('No price for token %s' % contract_address)
+    return prices[contract_address]
+
+def _currency_parameters(network: str) -> Dict:
+    return {
+        'ids': network_setting(network, 'native_coin'),
         'vs_currencies': 'usd',
     }
-    r = requests.get(COINGECKO_URL + f'simple/token_price/{network}',
-                        params=parameters, headers=headers)
-    if r.status_code != 200:
-        logger.error('CoinGecko request returned status code %d', r.status_code)
-        raise Exception('Request returned status code %s' % r.status_code)
-    return r.json()[contract_address]['usd']
 
-def get_currency_price() -> str:
-    """Get the current price in USD of 1 ETH.
+def get_currency_price(network: Optional[str] = 'ethereum') -> str:
+    """Get the current price in USD of 1 coin of the native currency of the
+    network, ETH by default.
 
+    :param network: The name of the blockchain network, defaults to 'ethereum'
+    :type network: Optional[str]
     :raises Exception: When the returned response code of the request is not 200.
-    :return: Current price in USD of 1 ETH.
+    :return: Current price in USD of 1 coin.
     :rtype: str
     """
-    parameters = {
-        'ids': 'ethereum',
-        'vs_currencies': 'usd',
-    }
-    r = requests.get(COINGECKO_URL + f'simple/price',
-                        params=parameters, headers=headers)
-    if r.status_code != 200:
-        logger.error('CoinGecko request returned status code %d', r.status_code)
-        raise Exception('Request returned status code %s' % r.status_code)
-    return r.json()['ethereum']['usd']
+    params = _currency_parameters(network)
+    price = price_cache.get(f"currency:{params['ids']}")
+    if price is not None:
+        return price
+
+    r = http_client.get(COINGECKO_URL + f'simple/price',
+                        params=params, headers=headers)
+    _check_response(r)
+
+    price = r.json()[params['ids']]['usd']
+    price_cache.set(f"currency:{params['ids']}", price)
+    return price
+
+async def get_currency_price_async(network: Optional[str] = 'ethereum') -> str:
+    """Async version of `get_currency_price()`."""
+    params = _currency_parameters(network)
+    price = price_cache.get(f"currency:{params['ids']}")
+    if price is not None:
+        return price
+
+    r = await http_client.async_get(COINGECKO_URL + f'simple/price',
+                                    params=params, headers=headers)
+    _check_response(r)
+
+    price = r.json()[params['ids']]['usd']
+    price_cache.set(f"currency:{params['ids']}", price)
+    return price
 
 def fetch_coin_data():
     """Fetch the coin-related data that CoinGecko tracks. Retrieve the
@@ -75,10 +247,8 @@ def fetch_coin_data():
     parameters = {
         'include_platform': 'true',
     }
-    r = requests.get(COINGECKO_URL + 'coins/list', params=parameters, headers=headers)
-    if r.status_code != 200:
-        logger.error('CoinGecko request returned status code %d', r.status_code)
-        raise Exception('Request returned status code %s' % r.status_code)
+    r = http_client.get(COINGECKO_URL + 'coins/list', params=parameters, headers=headers)
+    _check_response(r)
 
     coins = []
     for c in r.json():
@@ -97,11 +267,18 @@ def fetch_coin_data():
 
 def fetch_coin_metadata(contract_address: str, network: str):
 
-    r = requests.get(COINGECKO_URL + f'coins/{network}/contract/{contract_address}',
+    r = http_client.get(COINGECKO_URL + f'coins/{network}/contract/{contract_address}',
                         headers=headers)
-    if r.status_code != 200:
-        logger.error('CoinGecko request returned status code %d', r.status_code)
-        raise Exception('Request returned status code %s' % r.status_code)
+    _check_response(r)
+
+    return r.json()['detail_platforms'][network]['decimal_place']
+
+async def fetch_coin_metadata_async(contract_address: str, network: str):
+    """Async version of `fetch_coin_metadata()`."""
+    r = await http_client.async_get(
+        COINGECKO_URL + f'coins/{network}/contract/{contract_address}',
+        headers=headers)
+    _check_response(r)
 
     return r.json()['detail_platforms'][network]['decimal_place']
 
@@ -113,9 +290,16 @@ def store_contract_data(coin_data: List, network: str):
         if network in cd:
             contract_data[cd[network]] = cd['id']
 
-    # store data
-    with open(COIN_DATA_STORAGE_FILE % network, 'w') as f:
+    # store data, replacing the files at once so that readers never see a
+    # partially written file
+    filename = COIN_DATA_STORAGE_FILE % network
+    with open(filename + '.tmp', 'w') as f:
         json.dump(contract_data, f)
+    os.replace(filename + '.tmp', filename)
+    write_snapshot(_snapshot_path(network), contract_data)
+
+    with _contract_indexes_lock:
+        _contract_indexes.pop(network, None)
 
 def load_coin_data(network: str):
     """Load the coin address and the symbol data for the `network` blockchain.
@@ -124,6 +308,48 @@ def load_coin_data(network: str):
         coin_data = json.load(f)
     return coin_data
 
+def _snapshot_path(network: str) -> str:
+    return os.path.splitext(COIN_DATA_STORAGE_FILE % network)[0] + '.idx'
+
+def _snapshot_version(network: str):
+    """Return the (inode, modification time) of the snapshot of the
+    network, writing the snapshot first if it is missing or older than the
+    JSON file, e.g. for the files that come with the repository."""
+    snapshot = _snapshot_path(network)
+    try:
+        stat = os.stat(snapshot)
+    except FileNotFoundError:
+        stat = None
+
+    if stat is None or stat.st_mtime_ns < os.stat(COIN_DATA_STORAGE_FILE % network).st_mtime_ns:
+        logger.debug('Write contract index snapshot for network: %s', network)
+        write_snapshot(snapshot, load_coin_data(network))
+        stat = os.stat(snapshot)
+    return stat.st_ino, stat.st_mtime_ns
+
+def contract_index(network: str) -> Mapping[str, str]:
+    """Return a read-only mapping of the lowercase contract addresses to the
+    CoinGecko ids of the coins on the `network` blockchain. The mapping is
+    a memory-mapped snapshot of the file, shared by all the processes,
+    which is opened again only when the snapshot is replaced.
+
+    :param network: The name of the blockchain network.
+    :type network: str
+    :return: Mapping of contract address -> coin id.
+    :rtype: Mapping[str, str]
+    """
+    version = _snapshot_version(network)
+
+    entry = _contract_indexes.get(network)
+    if entry is None or entry[0] != version:
+        with _contract_indexes_lock:
+            entry = _contract_indexes.get(network)
+            if entry is None or entry[0] != version:
+                logger.debug('Open contract index for network: %s', network)
+                entry = (version, ContractSnapshot(_snapshot_path(network)))
+                _contract_indexes[network] = entry
+    return entry[1]
+
 if __name__ == '__main__':
     coin_data = fetch_coin_data()
     store_contract_data(coin_data, 'ethereum')
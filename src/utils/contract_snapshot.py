@@ -0,0 +1,144 @@
+"""
+This file includes the compact binary snapshot of a contract index, the
+mapping of the contract addresses of a network to their CoinGecko ids.
+
+The addresses are stored as sorted 20-byte keys, so an address is looked up
+with a binary search, and the file is memory-mapped, so the worker processes
+of the server share its pages instead of each one holding a dictionary of
+thousands of strings. A snapshot is written to a temporary file that is then
+moved in place, so a reader sees either the old or the new snapshot.
+
+The layout of the file, with little-endian integers:
+- header: b'CGIX', version (u16), 2 padding bytes, number of addresses n
+  and number of distinct ids m (u32 each)
+- the n addresses, sorted, 20 bytes each
+- for each address the number of its id (u32)
+- the offsets of the m ids in the ids block and the end of the block (u32)
+- the ids block, the UTF-8 encoded ids one after the other
+"""
+import os
+import mmap
+import bisect
+import struct
+import logging
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional
+
+from .addresses import normalize_address
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+ADDRESS_SIZE = 20
+
+_HEADER = struct.Struct('<4sHxxII')
+_MAGIC = b'CGIX'
+_VERSION = 1
+_U32 = struct.Struct('<I')
+_U32_PAIR = struct.Struct('<II')
+
+def _address_key(address: str) -> Optional[bytes]:
+    address = normalize_address(address)
+    if len(address) != 2 + 2 * ADDRESS_SIZE or not address.startswith('0x'):
+        return None
+    try:
+        return bytes.fromhex(address[2:])
+    except ValueError:
+        return None
+
+def write_snapshot(path: str, index: Dict[str, str]) -> int:
+    """Write the snapshot of the contract address -> coin id `index` to
+    `path`, replacing the file at once. Addresses that are not 20 bytes of
+    hex are left out.
+
+    :return: The number of addresses in the snapshot.
+    :rtype: int
+    """
+    entries = {}
+    for address, coin_id in index.items():
+        key = _address_key(address)
+        if key is None:
+            logger.warning('Skip invalid contract address: %r', address)
+            continue
+        entries[key] = coin_id
+
+    keys = sorted(entries)
+    ids = sorted(set(entries.values()))
+    id_numbers = {coin_id: n for n, coin_id in enumerate(ids)}
+
+    encoded = [coin_id.encode() for coin_id in ids]
+    offsets = [0]
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+
+    # each process writes its own temporary file
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(keys), len(ids)))
+        f.write(b''.join(keys))
+        f.write(struct.pack('<%dI' % len(keys), *(id_numbers[entries[k]] for k in keys)))
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        f.write(b''.join(encoded))
+    os.replace(tmp, path)
+    return len(keys)
+
+class _Keys:
+    """Sequence of the sorted addresses of a snapshot, for `bisect`."""
+
+    def __init__(self, buffer: mmap.mmap, count: int):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = _HEADER.size + i * ADDRESS_SIZE
+        return self._buffer[start:start + ADDRESS_SIZE]
+
+class ContractSnapshot(Mapping):
+    """Read-only mapping of the lowercase contract addresses to the coin
+    ids, backed by a memory-mapped snapshot file. Replacing the file doesn't
+    affect a snapshot that is already open.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._count, id_count = _HEADER.unpack_from(self._buffer)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Not a contract index snapshot: %s' % path)
+
+        self._keys = _Keys(self._buffer, self._count)
+        self._id_numbers_at = _HEADER.size + self._count * ADDRESS_SIZE
+        self._offsets_at = self._id_numbers_at + self._count * _U32.size
+        self._ids_at = self._offsets_at + (id_count + 1) * _U32.size
+
+    def _position(self, address) -> int:
+        key = _address_key(address) if isinstance(address, str) else None
+        if key is None:
+            return -1
+        i = bisect.bisect_left(self._keys, key)
+        if i < self._count and self._keys[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, address) -> bool:
+        return self._position(address) >= 0
+
+    def __getitem__(self, address: str) -> str:
+        i = self._position(address)
+        if i < 0:
+            raise KeyError(address)
+        n, = _U32.unpack_from(self._buffer, self._id_numbers_at + i * _U32.size)
+        start, end = _U32_PAIR.unpack_from(self._buffer, self._offsets_at + n * _U32.size)
+        return self._buffer[self._ids_at + start:self._ids_at + end].decode()
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield '0x' + self._keys[i].hex()
+
+    def __len__(self) -> int:
+        return self._count
@@ -0,0 +1,316 @@
+"""
+This file includes the shared HTTP client that the Alchemy and CoinGecko
+helpers use to send their requests.
+
+All requests go through a single `requests.Session` whose adapters keep a
+pool of keep-alive connections for each host, so consecutive calls to the
+same API reuse an already open TCP+TLS connection instead of opening a new
+one for every request.
+
+The `async_get()` and `async_post()` functions do the same for the async
+helpers with an `httpx.AsyncClient`, one for each running event loop.
+
+The pool sizes and the timeouts can be set with the environment variables
+below or with `configure()`.
+
+Requests are limited per host and retried on 429 and 5xx responses as set in
+`ratelimit`. Identical requests that are sent while the same request is
+already in flight wait for its response instead of being sent again.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Callable, Optional, Dict
+from urllib.parse import urlsplit
+
+from . import metrics, ratelimit
+
+# requests and httpx take most of the import time, they are imported when
+# the first client is created
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# Number of hosts for which a connection pool is kept around
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+# Maximum number of keep-alive connections kept open per host
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 20))
+# Seconds to wait for a connection to be established / for the response
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+
+# Pool sizes for specific hosts, e.g. {'https://api.coingecko.com': 4}
+host_pool_sizes: Dict[str, int] = {}
+
+_session = None
+_session_lock = threading.Lock()
+
+# event loop -> async client used by the coroutines running in that loop
+_async_clients = weakref.WeakKeyDictionary()
+
+# request key -> future of the response of the request in flight
+_in_flight: Dict[tuple, Future] = {}
+_in_flight_lock = threading.Lock()
+# event loop -> {request key -> task of the request in flight}
+_async_in_flight = weakref.WeakKeyDictionary()
+
+def _build_session() -> 'requests.Session':
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                            pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # more specific prefixes take precedence over the generic adapters
+    for prefix, pool_size in host_pool_sizes.items():
+        session.mount(prefix, HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size))
+    return session
+
+def get_session() -> 'requests.Session':
+    """Return the process-wide session, creating it on first use.
+
+    :return: The shared session.
+    :rtype: requests.Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                logger.debug('Create HTTP session, pool size: %d', HTTP_POOL_SIZE)
+                _session = _build_session()
+    return _session
+
+def get_async_client() -> 'httpx.AsyncClient':
+    """Return the async client of the running event loop, creating it on
+    first use. A client can't be shared between event loops, since its
+    connections belong to the loop they were opened in.
+
+    :return: The shared async client.
+    :rtype: httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+
+        logger.debug('Create async HTTP client, pool size: %d', HTTP_POOL_SIZE)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE * HTTP_POOL_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT,
+                                    connect=HTTP_CONNECT_TIMEOUT))
+        _async_clients[loop] = client
+    return client
+
+def close():
+    """Close all the pooled connections. A new session is created on the
+    next request.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+async def aclose():
+    """Close the async client of the running event loop."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def configure(pool_size: Optional[int] = None,
+              pool_connections: Optional[int] = None,
+              connect_timeout: Optional[float] = None,
+              read_timeout: Optional[float] = None,
+              host_pools: Optional[Dict[str, int]] = None):
+    """Change the settings of the shared client. Connections that are
+    already open are closed, the new settings apply to the next request.
+
+    :param pool_size: Maximum number of keep-alive connections per host.
+    :type pool_size: Optional[int]
+    :param pool_connections: Number of hosts that have a connection pool.
+    :type pool_connections: Optional[int]
+    :param connect_timeout: Seconds to wait for a connection.
+    :type connect_timeout: Optional[float]
+    :param read_timeout: Seconds to wait for the response.
+    :type read_timeout: Optional[float]
+    :param host_pools: Pool size for specific URL prefixes.
+    :type host_pools: Optional[Dict[str, int]]
+    """
+    global HTTP_POOL_SIZE, HTTP_POOL_CONNECTIONS, HTTP_CONNECT_TIMEOUT, \
+            HTTP_READ_TIMEOUT
+
+    if pool_size is not None:
+        HTTP_POOL_SIZE = pool_size
+    if pool_connections is not None:
+        HTTP_POOL_CONNECTIONS = pool_connections
+    if connect_timeout is not None:
+        HTTP_CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        HTTP_READ_TIMEOUT = read_timeout
+    if host_pools is not None:
+        host_pool_sizes.clear()
+        host_pool_sizes.update(host_pools)
+    close()
+    _async_clients.clear()
+
+def _request_key(method: str, url: str, kwargs: Dict) -> tuple:
+    return (method, url, json.dumps([kwargs.get('params'), kwargs.get('json')],
+                                    sort_keys=True, default=str))
+
+def _send(method: str, url: str, kwargs: Dict) -> 'requests.Response':
+    import requests
+
+    host = urlsplit(url).hostname
+    limiter = ratelimit.bucket(host)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+            metrics.record_upstream(host, response.status_code,
+                                    time.perf_counter() - start, len(response.content))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.record_upstream(host, 'error', time.perf_counter() - start, 0)
+            if attempt >= ratelimit.HTTP_MAX_RETRIES:
+                raise
+            delay = ratelimit.retry_delay(attempt)
+            logger.warning('%s %s failed: %s, retry in %.2fs', method, url, e, delay)
+        else:
+            if response.status_code not in ratelimit.RETRY_STATUS_CODES or \
+                    attempt >= ratelimit.HTTP_MAX_RETRIES:
+                return response
+            delay = ratelimit.retry_delay(attempt, response.headers.get('Retry-After'))
+            logger.warning('%s %s returned status code %d, retry in %.2fs',
+                            method, url, response.status_code, delay)
+            if response.status_code == 429 and limiter is not None:
+                # the other requests to the host wait as well
+                limiter.pause(delay)
+                delay = 0
+        metrics.UPSTREAM_RETRIES.inc(host)
+        time.sleep(delay)
+        attempt += 1
+
+async def _send_async(method: str, url: str, kwargs: Dict) -> 'httpx.Response':
+    import httpx
+
+    host = urlsplit(url).hostname
+    limiter = ratelimit.bucket(host)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+            metrics.record_upstream(host, response.status_code,
+                                    time.perf_counter() - start, len(response.content))
+        except httpx.TransportError as e:
+            metrics.record_upstream(host, 'error', time.perf_counter() - start, 0)
+            if attempt >= ratelimit.HTTP_MAX_RETRIES:
+                raise
+            delay = ratelimit.retry_delay(attempt)
+            logger.warning('%s %s failed: %s, retry in %.2fs', method, url, e, delay)
+        else:
+            if response.status_code not in ratelimit.RETRY_STATUS_CODES or \
+                    attempt >= ratelimit.HTTP_MAX_RETRIES:
+                return response
+            delay = ratelimit.retry_delay(attempt, response.headers.get('Retry-After'))
+            logger.warning('%s %s returned status code %d, retry in %.2fs',
+                            method, url, response.status_code, delay)
+            if response.status_code == 429 and limiter is not None:
+                # the other requests to the host wait as well
+                limiter.pause(delay)
+                delay = 0
+        metrics.UPSTREAM_RETRIES.inc(host)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+def _coalesce(key: tuple, send: Callable[[], 'requests.Response']) -> 'requests.Response':
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            waiting = True
+        else:
+            waiting = False
+            future = _in_flight[key] = Future()
+    if waiting:
+        metrics.UPSTREAM_COALESCED.inc(urlsplit(key[1]).hostname)
+        return future.result()
+
+    try:
+        response = send()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(response)
+        return response
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+async def _coalesce_async(key: tuple, send: Callable) -> 'httpx.Response':
+    loop = asyncio.get_running_loop()
+    in_flight = _async_in_flight.setdefault(loop, {})
+    task = in_flight.get(key)
+    if task is not None:
+        metrics.UPSTREAM_COALESCED.inc(urlsplit(key[1]).hostname)
+    else:
+        task = in_flight[key] = loop.create_task(send())
+
+        def done(task):
+            if in_flight.get(key) is task:
+                del in_flight[key]
+            if not task.cancelled():
+                # retrieved here in case all the callers have been cancelled
+                task.exception()
+        task.add_done_callback(done)
+    # a caller that is cancelled doesn't cancel the request of the others
+    return await asyncio.shield(task)
+
+def request(method: str, url: str, **kwargs) -> 'requests.Response':
+    """Send a request through the shared session, once the rate limit of
+    the host allows it, retrying it on 429 and 5xx responses. If the same
+    request is already in flight its response is returned instead.
+    """
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return _coalesce(_request_key(method, url, kwargs),
+                     lambda: _send(method, url, kwargs))
+
+async def async_request(method: str, url: str, **kwargs) -> 'httpx.Response':
+    """Async version of `request()`, through the shared async client."""
+    return await _coalesce_async(_request_key(method, url, kwargs),
+                                 lambda: _send_async(method, url, kwargs))
+
+def get(url: str, **kwargs) -> 'requests.Response':
+    """Send a GET request through the shared session."""
+    return request('GET', url, **kwargs)
+
+def post(url: str, **kwargs) -> 'requests.Response':
+    """Send a POST request through the shared session."""
+    return request('POST', url, **kwargs)
+
+async def async_get(url: str, **kwargs) -> 'httpx.Response':
+    """Send a GET request through the shared async client."""
+    return await async_request('GET', url, **kwargs)
+
+async def async_post(url: str, **kwargs) -> 'httpx.Response':
+    """Send a POST request through the shared async client."""
+    return await async_request('POST', url, **kwargs)
@@ -0,0 +1,221 @@
+"""
+This file includes the counters and the latency histograms of the upstream
+requests, the components and the API routes, rendered in the Prometheus text
+format by `render()`.
+
+Recording a value costs a lock and a few dictionary operations, so the
+metrics are always on. The upstream requests sent while serving an API
+request are also counted per request, through a context variable that the
+route middleware sets with `begin_request()`.
+"""
+import time
+import asyncio
+import bisect
+import functools
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds, in seconds, of the latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+# name -> function that returns the stats of a cache
+_caches: Dict[str, Callable[[], Dict]] = {}
+
+# number of upstream requests of the API request being served
+_request_upstream_calls: ContextVar[Optional[List[int]]] = ContextVar(
+    'request_upstream_calls', default=None)
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    labels = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+              for n, v in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{%s}' % ','.join(labels) if labels else ''
+
+class Counter:
+    """Monotonic counter, one value for each combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s counter' % self.name]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            lines.append('%s%s %s' % (self.name,
+                                      _format_labels(self.labels, label_values), value))
+        return lines
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, one for each
+    combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count of each bucket and of +Inf, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *label_values) -> int:
+        entry = self._values.get(label_values)
+        return sum(entry[0]) if entry is not None else 0
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            values = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    _format_labels(self.labels, label_values, 'le="%s"' % bound),
+                    cumulative))
+            labels = _format_labels(self.labels, label_values)
+            lines.append('%s_sum%s %s' % (self.name, labels, total))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+    """Create a counter that is included in `render()`."""
+    metric = Counter(name, documentation, labels)
+    _metrics.append(metric)
+    return metric
+
+def histogram(name: str, documentation: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    """Create a histogram that is included in `render()`."""
+    metric = Histogram(name, documentation, labels, buckets)
+    _metrics.append(metric)
+    return metric
+
+def register_cache(name: str, stats: Callable[[], Dict]):
+    """Include the hits and misses of a cache in `render()`. `stats` is
+    called on every render and returns the `stats()` of the cache."""
+    _caches[name] = stats
+
+UPSTREAM_REQUESTS = counter('upstream_requests_total',
+                            'Requests sent to the upstream APIs.',
+                            ['upstream', 'status'])
+UPSTREAM_SECONDS = histogram('upstream_request_seconds',
+                             'Latency of the requests to the upstream APIs.',
+                             ['upstream'])
+UPSTREAM_BYTES = counter('upstream_received_bytes_total',
+                         'Bytes received from the upstream APIs.', ['upstream'])
+UPSTREAM_RETRIES = counter('upstream_retries_total',
+                           'Requests to the upstream APIs that were retried.',
+                           ['upstream'])
+UPSTREAM_COALESCED = counter('upstream_coalesced_total',
+                             'Requests that shared the response of an identical '
+                             'request in flight.', ['upstream'])
+UPSTREAM_PAGES = counter('upstream_pages_total',
+                         'Pages of results fetched from the upstream APIs.', ['kind'])
+COMPONENT_SECONDS = histogram('component_seconds',
+                              'Latency of the component functions.', ['component'])
+ROUTE_SECONDS = histogram('http_request_seconds',
+                          'Latency of the API routes.', ['route', 'method', 'status'])
+ROUTE_UPSTREAM_CALLS = histogram('http_request_upstream_calls',
+                                 'Upstream requests sent per API request.', ['route'],
+                                 buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+def record_upstream(upstream: str, status: int, seconds: float, received: int):
+    """Record a request sent to an upstream API."""
+    UPSTREAM_REQUESTS.inc(upstream, status)
+    UPSTREAM_SECONDS.observe(seconds, upstream)
+    UPSTREAM_BYTES.inc(upstream, amount=received)
+    calls = _request_upstream_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+def begin_request():
+    """Start counting the upstream requests of the current context, e.g. an
+    API request. Return the token to pass to `end_request()`."""
+    return _request_upstream_calls.set([0])
+
+def end_request(token) -> int:
+    """Stop counting and return the number of upstream requests sent."""
+    calls = _request_upstream_calls.get()
+    _request_upstream_calls.reset(token)
+    return calls[0] if calls is not None else 0
+
+def timed(component: str):
+    """Decorator that records the latency of a function, or a coroutine
+    function, under `component`."""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    COMPONENT_SECONDS.observe(time.perf_counter() - start, component)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    COMPONENT_SECONDS.observe(time.perf_counter() - start, component)
+        return wrapper
+    return decorator
+
+def _render_caches() -> List[str]:
+    stats = {}
+    for name, cache_stats in _caches.items():
+        s = cache_stats()
+        hits = s.get('hits', s.get('memory_hits', 0) + s.get('disk_hits', 0))
+        stats[name] = (hits, s['misses'])
+
+    lines = []
+    for metric, kind, documentation, value in (
+            ('cache_hits_total', 'counter', 'Lookups found in the cache.',
+                lambda h, m: h),
+            ('cache_misses_total', 'counter', 'Lookups not found in the cache.',
+                lambda h, m: m),
+            ('cache_hit_ratio', 'gauge', 'Share of the lookups found in the cache.',
+                lambda h, m: h / (h + m) if h + m else 0)):
+        lines.append('# HELP %s %s' % (metric, documentation))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for name, (hits, misses) in stats.items():
+            lines.append('%s{cache="%s"} %s' % (metric, name, value(hits, misses)))
+    return lines
+
+def render() -> str:
+    """Return all the metrics in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_caches())
+    return '\n'.join(lines) + '\n'
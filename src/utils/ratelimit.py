@@ -0,0 +1,133 @@
+"""
+This file includes the client-side rate limiting and the retry policy of the
+requests sent to the upstream APIs.
+
+Each upstream host has a token bucket that allows `rate` requests per second
+on average with bursts of up to `burst` requests. Requests that fail with a
+429 or 5xx status are retried after a jittered exponential backoff, or after
+the time the `Retry-After` header asks for.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# Maximum number of times a failed request is retried
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 4))
+# Backoff before the first retry, doubled for every retry after that
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))
+# Maximum seconds to wait before a retry
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 30))
+
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# host -> (requests per second, burst); hosts not listed are not limited.
+# The CoinGecko free tier allows 10-30 requests per minute.
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    'api.coingecko.com': (
+        float(os.environ.get('COINGECKO_RATE_LIMIT', 0.5)),
+        int(os.environ.get('COINGECKO_RATE_BURST', 5)),
+    ),
+    'eth-mainnet.g.alchemy.com': (
+        float(os.environ.get('ALCHEMY_RATE_LIMIT', 25)),
+        int(os.environ.get('ALCHEMY_RATE_BURST', 50)),
+    ),
+    'polygon-mainnet.g.alchemy.com': (
+        float(os.environ.get('ALCHEMY_RATE_LIMIT', 25)),
+        int(os.environ.get('ALCHEMY_RATE_BURST', 50)),
+    ),
+}
+
+class TokenBucket:
+    """Token bucket shared by the threads and the coroutines that send
+    requests to the same host. Each request reserves a token and waits
+    until the bucket has refilled enough for it.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                            self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """Reserve a token and return the seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def pause(self, seconds: float):
+        """Hold back all the requests for `seconds`, e.g. after the host
+        responded with 429."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def bucket(host: str) -> Optional[TokenBucket]:
+    """Return the token bucket of the host, or None if it's not limited."""
+    limiter = _buckets.get(host)
+    if limiter is None and host in RATE_LIMITS:
+        with _buckets_lock:
+            limiter = _buckets.get(host)
+            if limiter is None:
+                limiter = _buckets[host] = TokenBucket(*RATE_LIMITS[host])
+    return limiter
+
+def configure(host: str, rate: float, burst: int):
+    """Set the rate limit of the host."""
+    with _buckets_lock:
+        RATE_LIMITS[host] = (rate, burst)
+        _buckets.pop(host, None)
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, given either in seconds or as a date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Return the seconds to wait before the retry number `attempt`, starting
+    from 0. Honor the Retry-After header if there is one, else use an
+    exponential backoff with full jitter.
+    """
+    delay = _retry_after(retry_after)
+    if delay is None:
+        delay = random.uniform(0, HTTP_BACKOFF_BASE * 2 ** attempt)
+    return min(delay, HTTP_BACKOFF_MAX)
@@ -0,0 +1,138 @@
+"""
+This file includes the cache for the token metadata (decimals, symbol, etc).
+The metadata of a token practically never changes, so it is fetched from the
+Alchemy API once and then served from an in-process LRU cache and from an
+on-disk SQLite store that survives restarts.
+
+When Alchemy does not know the decimals of a token, they are fetched from
+CoinGecko instead.
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from .alchemy import get_tokens_metadata, get_tokens_metadata_async
+from .cache import LRUCache, SQLiteCache, TieredCache, MISSING, cache_path
+from .coingecko import fetch_coin_metadata, fetch_coin_metadata_async
+from . import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# Seconds that the metadata of a token are considered valid
+TOKEN_METADATA_TTL = float(os.environ.get('TOKEN_METADATA_TTL', 7 * 24 * 3600))
+# Number of tokens kept in memory
+TOKEN_METADATA_CACHE_SIZE = int(os.environ.get('TOKEN_METADATA_CACHE_SIZE', 10000))
+# Number of tokens kept on disk, set TOKEN_METADATA_DB to '' to disable it
+TOKEN_METADATA_DB_SIZE = int(os.environ.get('TOKEN_METADATA_DB_SIZE', 500000))
+TOKEN_METADATA_DB = os.environ.get('TOKEN_METADATA_DB', 'token_metadata.sqlite')
+
+_cache = None
+
+def metadata_cache() -> TieredCache:
+    """Return the process-wide metadata cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        disk = None
+        if TOKEN_METADATA_DB:
+            disk = SQLiteCache(cache_path(TOKEN_METADATA_DB),
+                                ttl=TOKEN_METADATA_TTL,
+                                max_entries=TOKEN_METADATA_DB_SIZE)
+        _cache = TieredCache(LRUCache(TOKEN_METADATA_CACHE_SIZE,
+                                        ttl=TOKEN_METADATA_TTL), disk)
+    return _cache
+
+metrics.register_cache('token_metadata', lambda: metadata_cache().stats())
+
+def _cache_key(contract_address: str, network: str) -> str:
+    return f'{network}:{contract_address.lower()}'
+
+def _split_cached(contract_addresses: List[str], network: str, cached: Dict):
+    metadata = {}
+    missing = []
+    for address in contract_addresses:
+        md = cached.get(_cache_key(address, network), MISSING)
+        if md is MISSING:
+            missing.append(address)
+        else:
+            metadata[address] = md
+
+    if missing:
+        logger.debug('Token metadata cache misses: %d of %d', len(missing),
+                        len(contract_addresses))
+    return metadata, missing
+
+def _cached_metadata(contract_addresses: List[str], network: str):
+    cached = metadata_cache().get_many([_cache_key(address, network)
+                                        for address in contract_addresses])
+    return _split_cached(contract_addresses, network, cached)
+
+async def _cached_metadata_async(contract_addresses: List[str], network: str):
+    cached = await metadata_cache().get_many_async(
+        [_cache_key(address, network) for address in contract_addresses])
+    return _split_cached(contract_addresses, network, cached)
+
+def _has_decimals(md: Optional[Dict]) -> bool:
+    return md is not None and md.get('decimals') is not None
+
+def tokens_metadata(contract_addresses: List[str],
+                    network: Optional[str] = 'ethereum') -> Dict[str, Dict]:
+    """Get the metadata for each of the `contract_addresses`. Only the
+    tokens that are not in the cache are requested from Alchemy, with a
+    single batch request. The metadata is cached per network.
+
+    :param contract_addresses: List of token contract addresses.
+    :type contract_addresses: List[str]
+    :param network: The name of the blockchain network, defaults to 'ethereum'
+    :type network: Optional[str]
+    :return: Dictionary of contract address -> metadata.
+    :rtype: Dict[str, Dict]
+    """
+    metadata, missing = _cached_metadata(contract_addresses, network)
+
+    if missing:
+        fetched = {}
+        for address, md in get_tokens_metadata(missing, network).items():
+            if not _has_decimals(md):
+                md = dict(md or {})
+                md['decimals'] = fetch_coin_metadata(address, network)
+            fetched[address] = md
+
+        metadata_cache().set_many({_cache_key(address, network): md
+                                   for address, md in fetched.items()})
+        metadata.update(fetched)
+
+    return metadata
+
+async def tokens_metadata_async(contract_addresses: List[str],
+                                network: Optional[str] = 'ethereum') -> Dict[str, Dict]:
+    """Async version of `tokens_metadata()`. The on-disk cache is read and
+    written in a worker thread."""
+    metadata, missing = await _cached_metadata_async(contract_addresses, network)
+
+    if missing:
+        fetched = await get_tokens_metadata_async(missing, network)
+
+        # the fallbacks to CoinGecko are sent concurrently
+        fallback = [address for address, md in fetched.items()
+                    if not _has_decimals(md)]
+        decimals = await asyncio.gather(*[fetch_coin_metadata_async(address, network)
+                                            for address in fallback])
+        for address, d in zip(fallback, decimals):
+            fetched[address] = dict(fetched[address] or {}, decimals=d)
+
+        await metadata_cache().set_many_async({_cache_key(address, network): md
+                                               for address, md in fetched.items()})
+        metadata.update(fetched)
+
+    return metadata
+
+def token_metadata(contract_address: str,
+                   network: Optional[str] = 'ethereum') -> Dict:
+    """Get the metadata of a single token, see `tokens_metadata()`."""
+    return tokens_metadata([contract_address], network)[contract_address]
+
+def cache_stats() -> Dict:
+    """Return the hit and miss counters of the metadata cache."""
+    return metadata_cache().stats()
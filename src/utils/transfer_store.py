@@ -0,0 +1,233 @@
+"""
+This file includes a local SQLite store of the wallets' transfers.
+
+For each wallet and direction the store keeps the transfers that have been
+fetched so far and the last block they reach. When the same wallet is
+checked again only the transfers from that block on are requested from
+Alchemy, while the older ones are read from the store.
+
+The transfers on networks other than Ethereum are stored under the direction
+prefixed with the network, e.g. 'polygon-pos:to'.
+
+The store is saved under `CACHE_DIR`, set `TRANSFER_STORE_DB` to '' to
+disable it. The store keeps every transfer of every wallet checked and is
+never trimmed, so for large batches of wallets it grows without bound; the
+data of a wallet can be removed with `TransferStore.delete()` and the whole
+store by deleting the file.
+"""
+import os
+import json
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set
+
+from .addresses import normalize_address
+from .alchemy import iter_account_transfers, iter_account_transfers_async
+from .cache import cache_path
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+TRANSFER_STORE_DB = os.environ.get('TRANSFER_STORE_DB', 'transfers.sqlite')
+
+# Number of stored transfers read from the database at a time
+READ_PAGE_SIZE = 1000
+
+def _unique_id(transfer: Dict) -> str:
+    return transfer.get('uniqueId') or '%s:%s' % (transfer['hash'],
+                                                  transfer.get('category'))
+
+class TransferStore:
+    """Transfers of each wallet and the last block they have been synced to.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            logger.debug('Open transfer store: %s', self.path)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS transfers ('
+                                'wallet TEXT NOT NULL, direction TEXT NOT NULL, '
+                                'unique_id TEXT NOT NULL, block INTEGER NOT NULL, '
+                                'data TEXT NOT NULL, '
+                                'PRIMARY KEY (wallet, direction, unique_id))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS sync_state ('
+                                'wallet TEXT NOT NULL, direction TEXT NOT NULL, '
+                                'last_block INTEGER NOT NULL, '
+                                'PRIMARY KEY (wallet, direction))')
+        return self._conn
+
+    def last_block(self, wallet_address: str, direction: str) -> Optional[int]:
+        """Return the last block the transfers have been synced to, or None
+        if the wallet has not been synced yet."""
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT last_block FROM sync_state WHERE wallet = ? AND direction = ?',
+                (wallet_address, direction)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, wallet_address: str, direction: str, transfers: List[Dict]) -> List[Dict]:
+        """Store the transfers and move the last synced block forward to the
+        last block of the transfers. The transfers must be in block order.
+
+        :return: The transfers that were not already in the store.
+        :rtype: List[Dict]
+        """
+        new_transfers = []
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for t in transfers:
+                    cursor = conn.execute(
+                        'INSERT OR IGNORE INTO transfers VALUES (?, ?, ?, ?, ?)',
+                        (wallet_address, direction, _unique_id(t),
+                            int(t['blockNum'], 16), json.dumps(t)))
+                    if cursor.rowcount:
+                        new_transfers.append(t)
+
+                if transfers:
+                    conn.execute(
+                        'INSERT INTO sync_state VALUES (?, ?, ?) '
+                        'ON CONFLICT (wallet, direction) DO UPDATE SET '
+                        'last_block = MAX(last_block, excluded.last_block)',
+                        (wallet_address, direction,
+                            int(transfers[-1]['blockNum'], 16)))
+        return new_transfers
+
+    def read_page(self, wallet_address: str, direction: str, offset: int) -> List[Dict]:
+        """Return up to `READ_PAGE_SIZE` stored transfers from `offset` on."""
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT data FROM transfers WHERE wallet = ? AND direction = ? '
+                'ORDER BY block, unique_id LIMIT ? OFFSET ?',
+                (wallet_address, direction, READ_PAGE_SIZE, offset)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def iter_transfers(self, wallet_address: str, direction: str) -> Iterator[List[Dict]]:
+        """Yield the stored transfers in pages of `READ_PAGE_SIZE`."""
+        offset = 0
+        while True:
+            page = self.read_page(wallet_address, direction, offset)
+            if not page:
+                break
+            yield page
+            offset += len(page)
+
+    def delete(self, wallet_address: str):
+        """Remove the transfers and the sync state of the wallet."""
+        wallet_address = normalize_address(wallet_address)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM transfers WHERE wallet = ?', (wallet_address,))
+                conn.execute('DELETE FROM sync_state WHERE wallet = ?', (wallet_address,))
+
+_store = None
+
+def transfer_store() -> Optional[TransferStore]:
+    """Return the process-wide transfer store, or None if it is disabled."""
+    global _store
+    if _store is None and TRANSFER_STORE_DB:
+        _store = TransferStore(cache_path(TRANSFER_STORE_DB))
+    return _store
+
+def _stored_direction(direction: str, network: str) -> str:
+    # the Ethereum transfers keep the plain direction of the stores written
+    # before other networks were supported
+    return direction if network == 'ethereum' else f'{network}:{direction}'
+
+def _from_block(last_block: Optional[int]) -> str:
+    # the last synced block is requested again, in case only some of its
+    # transfers had been stored; the duplicates are dropped by the store
+    return hex(last_block) if last_block is not None else '0x0'
+
+def _yielded_ids(page: List[Dict], last_block: Optional[int], seen: Set[str]):
+    """Remember the stored transfers that are fetched again, those from the
+    last synced block on."""
+    if last_block is not None:
+        seen.update(_unique_id(t) for t in page if int(t['blockNum'], 16) >= last_block)
+
+def _not_yielded(page: List[Dict], seen: Set[str]) -> List[Dict]:
+    # the whole fetched page is returned, not only the transfers that this
+    # call added to the store, since a concurrent check of the same wallet
+    # may have stored them first
+    return [t for t in page if _unique_id(t) not in seen] if seen else page
+
+def iter_synced_transfers(wallet_address: str, direction: Optional[str] = 'to',
+                          network: str = 'ethereum') -> Iterator[List[Dict]]:
+    """Yield all the transfers of the wallet a page at a time: first the
+    transfers in the store and then the new ones, which are fetched from
+    Alchemy and added to the store as they arrive.
+
+    :param wallet_address: The wallet address as a string.
+    :type wallet_address: str
+    :param direction: 'to' for incoming and 'from' for outgoing transfers.
+    :type direction: Optional[str]
+    :param network: The network of the transfers, defaults to 'ethereum'
+    :type network: str
+    :return: Iterator over the pages of transfers.
+    :rtype: Iterator[List[Dict]]
+    """
+    store = transfer_store()
+    if store is None:
+        yield from iter_account_transfers(wallet_address, direction,
+                                          network=network)
+        return
+
+    wallet_address = normalize_address(wallet_address)
+    stored = _stored_direction(direction, network)
+    last_block = store.last_block(wallet_address, stored)
+
+    seen = set()
+    for page in store.iter_transfers(wallet_address, stored):
+        _yielded_ids(page, last_block, seen)
+        yield page
+
+    from_block = _from_block(last_block)
+    logger.debug('Sync %s transfers of %s from block %s', network,
+                    wallet_address, from_block)
+    for page in iter_account_transfers(wallet_address, direction, from_block,
+                                       network):
+        store.add(wallet_address, stored, page)
+        yield _not_yielded(page, seen)
+
+async def iter_synced_transfers_async(wallet_address: str,
+                                      direction: Optional[str] = 'to',
+                                      network: str = 'ethereum') -> AsyncIterator[List[Dict]]:
+    """Async version of `iter_synced_transfers()`. The store is read and
+    written in a worker thread, so that the event loop isn't blocked."""
+    store = transfer_store()
+    if store is None:
+        async for page in iter_account_transfers_async(wallet_address, direction,
+                                                       network=network):
+            yield page
+        return
+
+    wallet_address = normalize_address(wallet_address)
+    stored = _stored_direction(direction, network)
+    last_block = await asyncio.to_thread(store.last_block, wallet_address, stored)
+
+    seen = set()
+    offset = 0
+    while True:
+        page = await asyncio.to_thread(store.read_page, wallet_address, stored, offset)
+        if not page:
+            break
+        _yielded_ids(page, last_block, seen)
+        yield page
+        offset += len(page)
+
+    from_block = _from_block(last_block)
+    logger.debug('Sync %s transfers of %s from block %s', network,
+                    wallet_address, from_block)
+    async for page in iter_account_transfers_async(wallet_address, direction,
+                                                   from_block, network):
+        await asyncio.to_thread(store.add, wallet_address, stored, page)
+        yield _not_yielded(page, seen)
@@ -0,0 +1,92 @@
+"""
+This file includes the exact fixed-point valuation of the wallet balances.
+
+A balance is kept as an integer in the smallest unit of its token and a price
+is turned into an integer of 10**-PRICE_DECIMALS USD, so the value of a
+balance is an exact integer product divided by a power of ten. The powers of
+ten are computed once, and the values are only turned into `Decimal`s after
+they have been summed.
+"""
+from decimal import Decimal, ROUND_CEILING
+from typing import Dict, Tuple
+
+# Prices are rounded to this many decimal places, and the values are
+# integers of 10**-USD_DECIMALS USD
+PRICE_DECIMALS = 18
+USD_DECIMALS = PRICE_DECIMALS
+
+# Decimals of ETH and of the native coins of the other networks
+NATIVE_DECIMALS = 18
+
+# 10**n for the decimals an ERC20 token can have, which is a uint8
+_POW10 = tuple(10 ** n for n in range(256 + PRICE_DECIMALS))
+
+def pow10(n: int) -> int:
+    """Return 10**n, precomputed for the decimals of any token."""
+    return _POW10[n] if n < len(_POW10) else 10 ** n
+
+def price_units(price) -> int:
+    """Turn a price in USD, e.g. a float from CoinGecko, into an integer of
+    10**-PRICE_DECIMALS USD. A float is taken as the decimal it prints as."""
+    return int((Decimal(str(price)) * _POW10[PRICE_DECIMALS]).to_integral_value())
+
+def amount_units(amount, decimals: int) -> int:
+    """Turn an amount of tokens, e.g. a required amount of a spec file, into
+    an integer of the smallest unit of the token, rounded up."""
+    return int((Decimal(str(amount)) * pow10(decimals))
+               .to_integral_value(rounding=ROUND_CEILING))
+
+def to_usd(units: int) -> Decimal:
+    """Turn a value in 10**-USD_DECIMALS USD into an exact Decimal."""
+    return Decimal(units).scaleb(-USD_DECIMALS)
+
+def token_values(balances: Dict[str, Tuple[int, int]], prices: Dict) -> Dict[str, int]:
+    """Value each of the balances that has a price.
+
+    :param balances: Contract address -> (balance in the smallest unit,
+        decimals of the token).
+    :type balances: Dict[str, Tuple[int, int]]
+    :param prices: Contract address -> price in USD. Tokens without a price
+        are left out.
+    :type prices: Dict
+    :return: Contract address -> value in 10**-USD_DECIMALS USD.
+    :rtype: Dict[str, int]
+    """
+    # tokens often share a price, e.g. the stablecoins
+    units = {}
+    values = {}
+    for address, price in prices.items():
+        p = units.get(price)
+        if p is None:
+            p = units[price] = price_units(price)
+        amount, decimals = balances[address]
+        values[address] = amount * p // pow10(decimals)
+    return values
+
+def native_value(native_balance: int, native_price) -> int:
+    """Value a balance of the native coin, in 10**-USD_DECIMALS USD."""
+    return native_balance * price_units(native_price) // _POW10[NATIVE_DECIMALS]
+
+def valuation(native_balance: int, native_price, balances: Dict[str, Tuple[int, int]],
+              prices: Dict) -> Dict:
+    """Value the native coin and the priced tokens of a wallet.
+
+    :param native_balance: Balance of the native coin in its smallest unit.
+    :type native_balance: int
+    :param native_price: Price in USD of 1 native coin.
+    :param balances: Contract address -> (balance in the smallest unit,
+        decimals of the token).
+    :type balances: Dict[str, Tuple[int, int]]
+    :param prices: Contract address -> price in USD.
+    :type prices: Dict
+    :return: The 'total_usd' value, the value of the 'native' coin and the
+        value of each token under 'tokens', all as Decimals in USD.
+    :rtype: Dict
+    """
+    values = token_values(balances, prices)
+    native = native_value(native_balance, native_price)
+    return {
+        'total_usd': to_usd(native + sum(values.values())),
+        'native': to_usd(native),
+        'tokens': {address: to_usd(v) for address, v in values.items()},
+    }
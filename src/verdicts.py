@@ -0,0 +1,163 @@
+"""
+Cache of the verdicts of the checks on a wallet.
+
+A verdict is cached under the check, the wallet, the hash of the content of
+the spec file and the parameters of the check, so a changed spec file or
+different parameters never reuse an older verdict. Each check has its own
+TTL, set with `VERDICT_TTL_<CHECK>` (e.g. `VERDICT_TTL_FARMER`).
+
+With `VERDICT_STALE_TTL` set, a verdict that has expired less than that many
+seconds ago is still returned while it is computed again in the background.
+
+The verdicts are kept in memory, or in a SQLite database under `CACHE_DIR`
+when `VERDICT_CACHE_DB` is set.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .utils.addresses import normalize_address
+from .utils import metrics
+from .utils.cache import LRUCache, SQLiteCache, MISSING, cache_path
+
+logger = logging.getLogger(__name__)
+logger.setLevel("DEBUG")
+
+# check -> seconds a verdict is considered fresh
+VERDICT_TTLS: Dict[str, float] = {
+    check: float(os.environ.get('VERDICT_TTL_' + check.upper(), ttl))
+    for check, ttl in (('farmer', 300), ('interraction', 900),
+                       ('money_mixer', 900), ('nft', 300))
+}
+# Seconds a verdict is still served after it expires, while it is refreshed
+VERDICT_STALE_TTL = float(os.environ.get('VERDICT_STALE_TTL', 0))
+# Number of verdicts kept in memory
+VERDICT_CACHE_SIZE = int(os.environ.get('VERDICT_CACHE_SIZE', 100000))
+# Database under CACHE_DIR to store the verdicts in instead of memory
+VERDICT_CACHE_DB = os.environ.get('VERDICT_CACHE_DB', '')
+
+class VerdictCache:
+    """Verdicts stored in an `LRUCache` or a `SQLiteCache` backend. The
+    verdicts must be JSON serializable to be stored in a `SQLiteCache`,
+    which is then used from a worker thread so it doesn't block the event
+    loop.
+    """
+
+    def __init__(self, backend, ttls: Optional[Dict[str, float]] = None,
+                 stale_ttl: float = VERDICT_STALE_TTL):
+        self.backend = backend
+        self.ttls = VERDICT_TTLS if ttls is None else ttls
+        self.stale_ttl = stale_ttl
+        # keys whose verdict is being refreshed in the background
+        self._refreshing = {}
+
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        """Call a method of the backend, in a worker thread if it is on disk."""
+        f = getattr(self.backend, method)
+        if isinstance(self.backend, SQLiteCache):
+            return await asyncio.to_thread(f, *args, **kwargs)
+        return f(*args, **kwargs)
+
+    @staticmethod
+    def key(check: str, wallet_address: str, spec_hash: str,
+            params: Optional[Dict] = None) -> str:
+        params = hashlib.sha256(json.dumps(params or {}, sort_keys=True)
+                                .encode()).hexdigest()[:16]
+        return f'{normalize_address(wallet_address)}:{check}:{spec_hash}:{params}'
+
+    async def get(self, check: str, wallet_address: str, spec_hash: str,
+                  params: Optional[Dict], compute: Callable[[], Awaitable]) -> Any:
+        """Return the cached verdict of the check, or await `compute()` and
+        cache its result.
+
+        :param check: The type of the check, one of the `VERDICT_TTLS`.
+        :type check: str
+        :param wallet_address: The wallet the check is run on.
+        :type wallet_address: str
+        :param spec_hash: Hash of the content of the spec file of the check.
+        :type spec_hash: str
+        :param params: Other parameters that the verdict depends on.
+        :type params: Optional[Dict]
+        :param compute: Function that returns the coroutine of the check.
+        :type compute: Callable[[], Awaitable]
+        :return: The verdict.
+        :rtype: Any
+        """
+        key = self.key(check, wallet_address, spec_hash, params)
+        entry = await self._call('get', key, MISSING)
+        if entry is not MISSING:
+            if time.time() - entry['at'] < self.ttls[check]:
+                return entry['verdict']
+            # the backend keeps the entry only for stale_ttl after it expires
+            if self.stale_ttl > 0:
+                self._refresh(check, key, compute)
+                return entry['verdict']
+        return await self._compute(check, key, compute)
+
+    async def _compute(self, check: str, key: str, compute: Callable[[], Awaitable]) -> Any:
+        verdict = await compute()
+        await self._call('set', key, {'verdict': verdict, 'at': time.time()},
+                         ttl=self.ttls[check] + self.stale_ttl)
+        return verdict
+
+    def _refresh(self, check: str, key: str, compute: Callable[[], Awaitable]):
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                await self._compute(check, key, compute)
+            except Exception as e:
+                logger.error('Refresh of verdict %s failed: %s', key, e)
+            finally:
+                del self._refreshing[key]
+
+        logger.debug('Serve stale verdict and refresh it: %s', key)
+        # the task is referenced until it finishes
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def invalidate(self, wallet_address: Optional[str] = None,
+                   check: Optional[str] = None) -> int:
+        """Remove the cached verdicts of the wallet, only those of `check`
+        if it is given, or all the verdicts if no wallet is given.
+
+        :return: The number of verdicts removed, or -1 if all were removed.
+        :rtype: int
+        """
+        if wallet_address is None:
+            await self._call('clear')
+            return -1
+        prefix = normalize_address(wallet_address) + ':'
+        if check is not None:
+            prefix += check + ':'
+        return await self._call('delete_prefix', prefix)
+
+_cache = None
+
+def verdict_cache() -> VerdictCache:
+    """Return the process-wide verdict cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        if VERDICT_CACHE_DB:
+            backend = SQLiteCache(cache_path(VERDICT_CACHE_DB),
+                                  max_entries=VERDICT_CACHE_SIZE)
+        else:
+            backend = LRUCache(VERDICT_CACHE_SIZE)
+        _cache = VerdictCache(backend)
+    return _cache
+
+metrics.register_cache('verdicts', lambda: verdict_cache().backend.stats())
+
+async def cached_verdict(check: str, wallet_address: str, spec_hash: Optional[str],
+                         params: Optional[Dict], compute: Callable[[], Awaitable]) -> Any:
+    """Return the verdict through the process-wide cache. When the hash of
+    the spec is not known the verdict is computed and not cached.
+    """
+    if spec_hash is None:
+        return await compute()
+    return await verdict_cache().get(check, wallet_address, spec_hash,
+                                     params, compute)
@@ -1,29 +1,41 @@
 import json
-from typing import List
+import asyncio
+from typing import Dict, List, Set, Tuple, Union
 
-from .utils.alchemy import account_transfers
+from .utils import metrics
+from .utils.addresses import AddressMatcher
+from .utils.transfer_store import iter_synced_transfers, iter_synced_transfers_async
 
-def count_interractions(transfers: List, addresses: List[str]) -> int:
+def _matcher(addresses: Union[List[str], AddressMatcher]) -> AddressMatcher:
+    if isinstance(addresses, AddressMatcher):
+        return addresses
+    return AddressMatcher(addresses)
+
+def count_interractions(transfers: List,
+                        addresses: Union[List[str], AddressMatcher]) -> int:
     """Find if any of the addresses in the 'transfers' list is in the
     'addresses' list.
 
     :param transfers: List of transactions that transfer tokens between addresses.
     :type transfers: List
-    :param addresses: List of addresses that might be in the transfers list.
-    :type addresses: List[str]
+    :param addresses: List of addresses that might be in the transfers list,
+        or an AddressMatcher built from them.
+    :type addresses: Union[List[str], AddressMatcher]
     :return: Number of times at least one of the addresses was found in the
         transfers list.
     :rtype: int
     """
+    return _matcher(addresses).count(transfers)
 
-    # turn addresses into lowercase characters for comparisson uniformity
-    addresses = [s.lower() for s in addresses]
+def find_interractions(transfers: List,
+                       addresses: Union[List[str], AddressMatcher]) -> Tuple[int, Set[str]]:
+    """Same as `count_interractions()` but also return which of the
+    'addresses' were found in the 'transfers' list.
 
-    count = 0
-    for t in transfers:
-        if t['from'].lower() in addresses or t['to'].lower() in addresses:
-            count += 1
-    return count
+    :return: Number of matching transfers and the set of matched addresses.
+    :rtype: Tuple[int, Set[str]]
+    """
+    return _matcher(addresses).match(transfers)
 
 def read_interraction_spec(address_file: str) -> List:
     """Loads the data from the 'address_file' and returns a list of the
@@ -35,38 +47,93 @@ def read_interraction_spec(address_file: str) -> List:
     :return: List of all the contract addresses
     :rtype: List
     """
+    with open(address_file, 'r') as f:
+        return parse_interraction_spec(json.loads(f.read()))
+
+def parse_interraction_spec(data: Dict) -> List:
+    """Return the addresses of the loaded JSON data of an interraction
+    specification file, see `read_interraction_spec()`.
+    """
     addresses_list = []
 
-    with open(address_file, 'r') as f:
-        data = json.loads(f.read())
-        if 'contracts' in data:
-            for contract in data['contracts'].keys():
-                addresses_list.append(contract)
-        if 'addresses' in data:
-            for address in data['addresses'].keys():
-                addresses_list.append(address)
+    if 'contracts' in data:
+        for contract in data['contracts'].keys():
+            addresses_list.append(contract)
+    if 'addresses' in data:
+        for address in data['addresses'].keys():
+            addresses_list.append(address)
 
     return addresses_list
 
+def read_interraction_matcher(address_file: str) -> AddressMatcher:
+    """Loads the addresses of the 'address_file' into an AddressMatcher."""
+    return AddressMatcher(read_interraction_spec(address_file))
+
+def parse_interraction_matcher(data: Dict) -> AddressMatcher:
+    """Loads the addresses of the loaded JSON data of an interraction
+    specification file into an AddressMatcher."""
+    return AddressMatcher(parse_interraction_spec(data))
+
+@metrics.timed('is_associated_with_addresses')
 def is_associated_with_addresses(wallet_address: str,
-                                 addresses_list: List[str]) -> bool:
+                                 addresses_list: Union[List[str], AddressMatcher],
+                                 network: str = 'ethereum') -> bool:
     """Retrive the transfers of the 'wallet_address'  and returns True if the
     'wallet_address' has interracted with any of addresses in the
-    addresses_list.
+    addresses_list. Each page of transfers is checked as soon as it is
+    received and no more pages are fetched after the first match. Only the
+    transfers since the last check of the wallet are fetched, the older ones
+    are read from the local transfer store.
 
     :param wallet_address: The address of the wallet.
     :type wallet_address: str
     :param mixer_address_file: List of files with addresses that the wallet
         might have interracted with.
     :type mixer_address_file: str
+    :param network: The network of the transfers, defaults to 'ethereum'
+    :type network: str
     :return: True if the wallet address has interracted with any of the
         addresses in the address_files.
     :rtype: bool
     """
 
-    transfers = account_transfers(wallet_address, direction='to')
-    transfers.extend(account_transfers(wallet_address, direction='from'))
+    matcher = _matcher(addresses_list)
+
+    for direction in ['to', 'from']:
+        for page in iter_synced_transfers(wallet_address, direction=direction,
+                                          network=network):
+            if matcher.count(page) > 0:
+                return True
+    return False
 
-    if count_interractions(transfers, addresses_list) > 0:
-        return True
+async def _has_interracted_async(wallet_address: str, direction: str,
+                                 matcher: AddressMatcher,
+                                 network: str = 'ethereum') -> bool:
+    async for page in iter_synced_transfers_async(wallet_address,
+                                                  direction=direction,
+                                                  network=network):
+        if matcher.count(page) > 0:
+            return True
     return False
+
+@metrics.timed('is_associated_with_addresses_async')
+async def is_associated_with_addresses_async(
+        wallet_address: str,
+        addresses_list: Union[List[str], AddressMatcher],
+        network: str = 'ethereum') -> bool:
+    """Async version of `is_associated_with_addresses()`. The incoming and
+    outgoing transfers are paginated concurrently and, as soon as one of
+    them finds a match, the other one stops fetching pages.
+    """
+    matcher = _matcher(addresses_list)
+    tasks = [asyncio.create_task(_has_interracted_async(wallet_address, d,
+                                                        matcher, network))
+                for d in ['to', 'from']]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            if await finished:
+                return True
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,8 +1,27 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import asyncio
+import tempfile
+import threading
 import unittest
+from decimal import Decimal
+from unittest import mock
 
 from src.wallet_interraction import count_interractions, is_associated_with_addresses, \
-                                read_interraction_spec
-from src.nft_owneship import which_nfts_owned, minimum_owned_nfts
+                                read_interraction_spec, find_interractions
+from src.utils.addresses import AddressMatcher
+from src.nft_owneship import is_nft_owned, which_nfts_owned, minimum_owned_nfts, \
+                                nft_ownership_from_specs
+from src import farmer, wallet_interraction, batch, profile, multichain
+from src.specs import SpecRegistry
+from src.verdicts import VerdictCache
+from src.utils import http_client, alchemy, token_metadata, coingecko
+from src.utils.cache import LRUCache, SQLiteCache, TieredCache
+from src.utils import transfer_store, metrics, valuation, contract_snapshot
+from src.utils.ratelimit import TokenBucket
 
 class AccountInterractionTests(unittest.TestCase):
 
@@ -44,6 +63,19 @@ class AccountInterractionTests(unittest.TestCase):
         addresses=['GQL', 'AAA']
         self.assertEqual(count_interractions(transfers, addresses), 2)
 
+    def test_matched_counterparties_are_returned(self):
+        transfers = [
+            {'from': '0xAbC', 'to': '0xdef'},
+            {'from': '0x123', 'to': None},
+            {'from': '0xdef', 'to': '0x456'},
+        ]
+        matcher = AddressMatcher(['0xDEF', '0x123'])
+        count, counterparties = find_interractions(transfers, matcher)
+        self.assertEqual(count, 3)
+        self.assertEqual(counterparties, {'0xdef', '0x123'})
+        self.assertEqual(count_interractions(transfers, matcher), 3)
+        self.assertIn('0XDEF', matcher)
+
     def test_account_has_interracted_with_tornado_cash(self):
         """Test that an address that has interracted with one of the Tornado
         Cash addresses returns true.
@@ -58,6 +90,448 @@ class AccountInterractionTests(unittest.TestCase):
             is_associated_with_addresses(wallet_address, tornado_addresses)
         )
 
+    def test_interraction_check_stops_at_first_match(self):
+        fetched = []
+
+        async def pages(wallet_address, direction, network='ethereum'):
+            for i in range(100):
+                fetched.append(direction)
+                await asyncio.sleep(0)
+                if direction == 'from' and i == 2:
+                    yield [{'from': wallet_address, 'to': '0xMIXER'}]
+                else:
+                    yield [{'from': '0xA', 'to': '0xB'}]
+
+        with mock.patch.object(wallet_interraction, 'iter_synced_transfers_async', pages):
+            self.assertTrue(asyncio.run(
+                wallet_interraction.is_associated_with_addresses_async('0xW', ['0xmixer'])))
+        self.assertEqual(fetched.count('from'), 3)
+        self.assertLess(len(fetched), 10)
+
+class TransferStoreTests(unittest.TestCase):
+
+    def test_only_new_blocks_are_fetched(self):
+        store = transfer_store.TransferStore(os.path.join(tempfile.mkdtemp(), 't.sqlite'))
+        old = [{'uniqueId': 'a', 'blockNum': '0x1', 'from': '0xw', 'to': '0x1'},
+               {'uniqueId': 'b', 'blockNum': '0x5', 'from': '0xw', 'to': '0x2'}]
+        new = [{'uniqueId': 'b', 'blockNum': '0x5', 'from': '0xw', 'to': '0x2'},
+               {'uniqueId': 'c', 'blockNum': '0x9', 'from': '0xw', 'to': '0x3'}]
+
+        def pages(wallet_address, direction, from_block='0x0', network='ethereum'):
+            yield old if from_block == '0x0' else new
+
+        with mock.patch.object(transfer_store, '_store', store), \
+                mock.patch.object(transfer_store, 'iter_account_transfers',
+                                    side_effect=pages) as fetch:
+            first = sum(transfer_store.iter_synced_transfers('0xW', 'from'), [])
+            second = sum(transfer_store.iter_synced_transfers('0xW', 'from'), [])
+
+        self.assertEqual(fetch.call_args_list[1].args[2], '0x5')
+        self.assertEqual([t['uniqueId'] for t in first], ['a', 'b'])
+        self.assertEqual([t['uniqueId'] for t in second], ['a', 'b', 'c'])
+        self.assertEqual(store.last_block('0xw', 'from'), 9)
+
+    def test_concurrent_checks_of_a_wallet_see_all_transfers(self):
+        store = transfer_store.TransferStore(os.path.join(tempfile.mkdtemp(), 't.sqlite'))
+        page = [{'uniqueId': 'a', 'blockNum': '0x1', 'from': '0xmixer', 'to': '0xw'},
+                {'uniqueId': 'b', 'blockNum': '0x2', 'from': '0xdex', 'to': '0xw'}]
+
+        async def pages(wallet_address, direction, from_block='0x0', network='ethereum'):
+            # both checks fetch the page before either stores it
+            await asyncio.sleep(0.01)
+            yield page if direction == 'to' else []
+
+        async def run():
+            return await asyncio.gather(
+                wallet_interraction.is_associated_with_addresses_async('0xw', ['0xmixer']),
+                wallet_interraction.is_associated_with_addresses_async('0xw', ['0xdex']))
+
+        with mock.patch.object(transfer_store, '_store', store), \
+                mock.patch.object(transfer_store, 'iter_account_transfers_async', pages):
+            self.assertEqual(asyncio.run(run()), [True, True])
+            # the second time the transfers are read from the store
+            self.assertEqual(asyncio.run(run()), [True, True])
+
+class BatchScoringTests(unittest.TestCase):
+
+    def test_wallets_are_scored_with_bounded_concurrency(self):
+        in_progress = []
+        max_in_progress = []
+
+        async def score(wallet_address, checks):
+            in_progress.append(wallet_address)
+            max_in_progress.append(len(in_progress))
+            await asyncio.sleep(0.001 * int(wallet_address))
+            in_progress.remove(wallet_address)
+            return {'wallet_address': wallet_address}
+
+        async def run():
+            return [r async for r in batch.score_wallets_async(
+                        [str(i) for i in range(10)] + [''], {}, concurrency=3)]
+
+        with mock.patch.object(batch, 'score_wallet_async', score):
+            results = asyncio.run(run())
+
+        self.assertEqual(sorted(int(r['wallet_address']) for r in results), list(range(10)))
+        self.assertEqual(max(max_in_progress), 3)
+
+    def test_batch_results_are_streamed_as_ndjson(self):
+        from fastapi.testclient import TestClient
+        import api
+
+        async def score(wallet_address, checks):
+            return {'wallet_address': wallet_address, 'money_mixer': False}
+
+        with mock.patch.object(batch, 'score_wallet_async', score):
+            r = TestClient(api.app).post('/batch/stream', json={
+                'wallets': ['0x1', '0x2'], 'checks': {'money_mixer': True}})
+
+        self.assertEqual(r.headers['content-type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in r.text.splitlines()]
+        self.assertEqual({l['wallet_address'] for l in lines}, {'0x1', '0x2'})
+
+    def test_failed_check_is_reported_per_wallet(self):
+        async def failing(wallet_address, addresses):
+            raise Exception('upstream error')
+
+        checks = {'money_mixer': AddressMatcher(['0xabc'])}
+        with mock.patch.object(batch, 'is_associated_with_addresses_async', failing):
+            result = asyncio.run(batch.score_wallet_async('0xW', checks))
+        self.assertEqual(result, {'wallet_address': '0xW',
+                                    'errors': {'money_mixer': 'upstream error'}})
+
+class WalletProfileTests(unittest.TestCase):
+
+    def test_each_dataset_is_fetched_once_for_all_specs(self):
+        pages = {'to': [[{'from': '0xmixer', 'to': '0xw'}]],
+                 'from': [[{'from': '0xw', 'to': '0xdex'}]]}
+        directions = []
+        async def transfers(wallet_address, direction):
+            directions.append(direction)
+            for page in pages[direction]:
+                yield page
+
+        balances = mock.AsyncMock(return_value={'eth_balance': '0x0',
+                                                'coins_balance': {}})
+        nfts = mock.AsyncMock(return_value={'0xn1'})
+        with mock.patch.object(profile, 'wallet_balances_async', balances), \
+                mock.patch.object(profile, 'is_account_farmer_async',
+                                  mock.AsyncMock(side_effect=[True, False])), \
+                mock.patch.object(profile, 'iter_synced_transfers_async', transfers), \
+                mock.patch.object(profile, 'account_nft_contracts_async', nfts):
+            result = asyncio.run(profile.wallet_profile_async(
+                '0xw',
+                farmer={'a.json': {}, 'b.json': {}},
+                interraction={'dex.json': AddressMatcher(['0xDEX']),
+                              'other.json': AddressMatcher(['0xother'])},
+                money_mixer=AddressMatcher(['0xmixer']),
+                nft={'x.json': ['0xN1', '0xn2'], 'y.json': ['0xn3']}))
+
+        self.assertEqual(balances.await_count, 1)
+        self.assertEqual(nfts.await_count, 1)
+        self.assertEqual(sorted(nfts.await_args[0][1]), ['0xn1', '0xn2', '0xn3'])
+        self.assertEqual(sorted(directions), ['from', 'to'])
+        self.assertEqual(result['farmer'], {'a.json': True, 'b.json': False})
+        self.assertEqual(result['interraction'], {'dex.json': True, 'other.json': False})
+        self.assertTrue(result['money_mixer'])
+        self.assertEqual(result['nft'], {'x.json': True, 'y.json': False})
+
+    def test_transfers_stop_once_every_spec_matches(self):
+        fetched = []
+        async def transfers(wallet_address, direction):
+            for i in range(3):
+                fetched.append(direction)
+                yield [{'from': '0xmixer', 'to': '0xw'}]
+
+        with mock.patch.object(profile, 'iter_synced_transfers_async', transfers):
+            result = asyncio.run(profile.wallet_profile_async(
+                '0xw', money_mixer=AddressMatcher(['0xmixer'])))
+
+        self.assertTrue(result['money_mixer'])
+        self.assertLess(len(fetched), 6)
+
+class ValuationTests(unittest.TestCase):
+
+    def test_values_are_exact(self):
+        a, b, c = '0x%040x' % 1, '0x%040x' % 2, '0x%040x' % 3
+        value = valuation.valuation(
+            10 ** 18, 1500.0,
+            {a: (10 ** 17, 18), b: (2 * 10 ** 17, 18), c: (2000 * 10 ** 6, 6)},
+            {a: 1.0, b: 1.0, c: 0.999})
+
+        self.assertEqual(value['native'], Decimal('1500'))
+        self.assertEqual(value['tokens'][a] + value['tokens'][b], Decimal('0.3'))
+        self.assertEqual(value['tokens'][c], Decimal('1998'))
+        self.assertEqual(value['total_usd'], Decimal('3498.3'))
+
+    def test_eth_balance_has_18_decimals(self):
+        with mock.patch.object(farmer, 'tokens_metadata', return_value={}), \
+                mock.patch.object(farmer, 'get_token_prices', return_value={}), \
+                mock.patch.object(farmer, 'get_currency_price', return_value=1500.0):
+            self.assertTrue(farmer.is_account_farmer(hex(10 ** 18), {}, 1500))
+            self.assertFalse(farmer.is_account_farmer(hex(10 ** 18), {}, 1501))
+
+class FarmerPlanTests(unittest.TestCase):
+
+    def test_missing_required_token_is_not_priced(self):
+        usdc = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+        with mock.patch.object(farmer, 'tokens_metadata') as metadata, \
+                mock.patch.object(farmer, 'get_token_prices') as prices, \
+                mock.patch.object(farmer, 'get_currency_price') as eth_price:
+            self.assertFalse(farmer.is_account_farmer(
+                hex(10 ** 20), {usdc: '0x0'}, 100, {usdc.upper(): 1}))
+        metadata.assert_not_called()
+        prices.assert_not_called()
+        eth_price.assert_not_called()
+
+    def test_null_token_balances_are_skipped(self):
+        usdc = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+        dai = '0x6b175474e89094c44da98b954eedeac495271d0f'
+        plan = farmer._plan({usdc: None, dai: hex(10 ** 18)}, {dai: 1}, 'ethereum')
+        self.assertEqual(plan, ({dai: 1}, [dai]))
+        self.assertIsNone(farmer._plan({usdc: None}, {usdc: 1}, 'ethereum'))
+
+    def test_tokens_with_unknown_decimals_are_not_priced(self):
+        usdc = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+        dai = '0x6b175474e89094c44da98b954eedeac495271d0f'
+        balances = {usdc: hex(10 ** 6), dai: hex(10 ** 18)}
+        metadata = lambda addresses, network: {usdc: {'decimals': None},
+                                               dai: {'decimals': 18}}
+        prices = lambda addresses, network: {a: 1.0 for a in addresses}
+        with mock.patch.object(farmer, 'contract_index', return_value={usdc, dai}), \
+                mock.patch.object(farmer, 'tokens_metadata', side_effect=metadata), \
+                mock.patch.object(farmer, 'get_token_prices', side_effect=prices), \
+                mock.patch.object(farmer, 'get_currency_price', return_value=1500.0):
+            self.assertFalse(farmer.is_account_farmer('0x0', balances, 0, {usdc: 1}))
+            self.assertTrue(farmer.is_account_farmer('0x0', balances, 1))
+            self.assertFalse(farmer.is_account_farmer('0x0', balances, 2))
+            valuation = farmer.wallet_valuation('0x0', balances)
+        self.assertEqual(valuation['tokens'], {dai: Decimal(1)})
+
+    def test_pricing_stops_at_minimum_total_balance(self):
+        tokens = ['0x%040x' % i for i in range(1, 31)]
+        priced = []
+        def prices(addresses, network):
+            priced.append(len(addresses))
+            return {a: 1.0 for a in addresses}
+
+        async def prices_async(addresses, network):
+            return prices(addresses, network)
+
+        async def metadata_async(addresses, network):
+            return {a: {'decimals': 18} for a in addresses}
+
+        async def eth_price_async(network):
+            return 1500.0
+
+        with mock.patch.object(farmer, 'FARMER_PRICING_ROUND', 10), \
+                mock.patch.object(farmer, 'contract_index', return_value=set(tokens)), \
+                mock.patch.object(farmer, 'tokens_metadata',
+                                  side_effect=lambda a, n: {t: {'decimals': 18} for t in a}), \
+                mock.patch.object(farmer, 'get_token_prices', side_effect=prices), \
+                mock.patch.object(farmer, 'get_currency_price', return_value=1500.0), \
+                mock.patch.object(farmer, 'tokens_metadata_async', metadata_async), \
+                mock.patch.object(farmer, 'get_token_prices_async', prices_async), \
+                mock.patch.object(farmer, 'get_currency_price_async', eth_price_async):
+            balances = {t: hex(10 ** 18) for t in tokens}
+            self.assertTrue(farmer.is_account_farmer('0x0', balances, 15))
+            self.assertTrue(asyncio.run(farmer.is_account_farmer_async('0x0', balances, 15)))
+            self.assertEqual(priced, [10, 10, 10, 10])
+
+            priced.clear()
+            self.assertFalse(farmer.is_account_farmer('0x0', balances, 31))
+            self.assertEqual(priced, [10, 10, 10])
+
+class MultichainTests(unittest.TestCase):
+
+    def test_networks_are_scored_concurrently_and_aggregated(self):
+        started = []
+        events = {}
+        async def balances(wallet_address, network):
+            started.append(network)
+            if len(started) == 2:
+                events['both_started'].set()
+            # fails with a timeout if the networks are scored one at a time
+            await asyncio.wait_for(events['both_started'].wait(), 1)
+            return {'eth_balance': '0x0', 'coins_balance': {}}
+
+        async def valuation(eth_balance, coins_balance, network):
+            usd = {'ethereum': Decimal('100.5'), 'polygon-pos': Decimal('20')}[network]
+            return {'total_usd': usd, 'native': usd, 'tokens': {}}
+
+        async def mixer(wallet_address, matcher, network):
+            return network == 'polygon-pos'
+
+        async def run():
+            # created in the running loop, which Python 3.9 requires
+            events['both_started'] = asyncio.Event()
+            return await multichain.multichain_profile_async(
+                '0xw', {'ethereum': AddressMatcher([]),
+                        'polygon-pos': AddressMatcher([])},
+                minimum_total_balance=120)
+
+        with mock.patch.object(multichain, 'wallet_balances_async', balances), \
+                mock.patch.object(multichain, 'wallet_valuation_async', valuation), \
+                mock.patch.object(multichain, 'is_associated_with_addresses_async', mixer):
+            result = asyncio.run(run())
+
+        self.assertEqual(result['networks']['ethereum'],
+                         {'usd_balance': 100.5, 'money_mixer': False})
+        self.assertEqual(result['total_usd_balance'], 120.5)
+        self.assertTrue(result['is_above_minimum_total_balance'])
+        self.assertTrue(result['money_mixer'])
+        self.assertNotIn('errors', result)
+
+    def _profile_with_failed_network(self, interacted, minimum_total_balance):
+        async def balances(wallet_address, network):
+            if network == 'polygon-pos':
+                raise Exception('upstream error')
+            return {'eth_balance': '0x0', 'coins_balance': {}}
+
+        async def valuation(eth_balance, coins_balance, network):
+            return {'total_usd': Decimal('500'), 'native': Decimal('500'), 'tokens': {}}
+
+        async def mixer(wallet_address, matcher, network):
+            return interacted
+
+        with mock.patch.object(multichain, 'wallet_balances_async', balances), \
+                mock.patch.object(multichain, 'wallet_valuation_async', valuation), \
+                mock.patch.object(multichain, 'is_associated_with_addresses_async', mixer):
+            result = asyncio.run(multichain.multichain_profile_async(
+                '0xw', {'ethereum': AddressMatcher([]),
+                        'polygon-pos': AddressMatcher([])},
+                minimum_total_balance=minimum_total_balance))
+
+        self.assertEqual(result['networks']['ethereum'],
+                         {'usd_balance': 500.0, 'money_mixer': interacted})
+        self.assertIn('polygon-pos', result['errors'])
+        return result
+
+    def test_totals_are_unknown_when_a_network_fails(self):
+        result = self._profile_with_failed_network(False, 1000)
+        self.assertIsNone(result['is_above_minimum_total_balance'])
+        self.assertIsNone(result['money_mixer'])
+
+    def test_totals_settled_by_other_networks_survive_a_failure(self):
+        result = self._profile_with_failed_network(True, 120)
+        self.assertTrue(result['is_above_minimum_total_balance'])
+        self.assertTrue(result['money_mixer'])
+
+    def test_requests_are_sent_to_the_network(self):
+        with mock.patch.object(alchemy, 'ALCHEMY_API_KEY', 'key'):
+            self.assertIn('polygon-mainnet', alchemy._rpc_url('polygon-pos'))
+            self.assertIn('eth-mainnet', alchemy._rpc_url())
+            with self.assertRaises(Exception):
+                alchemy._rpc_url('solana')
+
+        response = mock.Mock(status_code=200, content=b'{}',
+                             json=lambda: {'polygon-ecosystem-token': {'usd': 0.5}})
+        coingecko.price_cache.clear()
+        with mock.patch.object(coingecko.http_client, 'get',
+                               return_value=response) as get:
+            self.assertEqual(coingecko.get_currency_price('polygon-pos'), 0.5)
+        self.assertEqual(get.call_args[1]['params']['ids'], 'polygon-ecosystem-token')
+
+class SpecRegistryTests(unittest.TestCase):
+
+    def test_spec_is_parsed_again_only_when_changed(self):
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, 'nft_ownership'))
+        spec_file = os.path.join(root, 'nft_ownership', 'spec.json')
+        with open(spec_file, 'w') as f:
+            json.dump({'contracts': {'0xABC': 'first'}}, f)
+
+        registry = SpecRegistry(root, check_interval=0)
+        spec = registry.get('nft', 'spec.json')
+        self.assertEqual(spec, ['0xabc'])
+        self.assertIs(registry.get('nft', 'spec.json'), spec)
+
+        with open(spec_file, 'w') as f:
+            json.dump({'contracts': {'0xABC': 'first', '0xDEF': 'second'}}, f)
+        self.assertEqual(registry.get('nft', 'spec.json'), ['0xabc', '0xdef'])
+
+        with self.assertRaises(FileNotFoundError):
+            registry.get('nft', '../nft_ownership/missing.json')
+        with self.assertRaises(FileNotFoundError):
+            registry.get('farmer', '../nft_ownership/spec.json')
+
+    def test_spec_and_digest_come_from_the_same_file(self):
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, 'nft_ownership'))
+        spec_file = os.path.join(root, 'nft_ownership', 'spec.json')
+        content = json.dumps({'contracts': {'0xABC': 'first'}})
+        with open(spec_file, 'w') as f:
+            f.write(content)
+
+        registry = SpecRegistry(root, check_interval=0)
+        spec, digest = registry.get_with_digest('nft', 'spec.json')
+        self.assertEqual(spec, ['0xabc'])
+        self.assertEqual(digest, hashlib.sha256(content.encode()).hexdigest())
+        self.assertEqual(digest, registry.digest('nft', 'spec.json'))
+
+    def test_spec_is_hashed_and_parsed_from_one_read(self):
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, 'farmer'))
+        with open(os.path.join(root, 'farmer', 'spec.json'), 'w') as f:
+            json.dump({'minimum_total_balance': 10,
+                       'token_contract_amount': {'0xABC': 1}}, f)
+
+        registry = SpecRegistry(root, check_interval=0)
+        with mock.patch('builtins.open', wraps=open) as opened:
+            spec, _ = registry.get_with_digest('farmer', 'spec.json')
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(spec, {'minimum_total_balance': 10,
+                                'token_contract_amount': {'0xabc': 1}})
+
+class VerdictCacheTests(unittest.TestCase):
+
+    def test_verdict_is_cached_per_spec_and_params(self):
+        cache = VerdictCache(LRUCache(), ttls={'nft': 60})
+        compute = mock.AsyncMock(return_value=True)
+
+        async def run():
+            for spec_hash, params in (('h1', {'minimum_owned': 1}),
+                                      ('h1', {'minimum_owned': 1}),
+                                      ('h2', {'minimum_owned': 1}),
+                                      ('h1', {'minimum_owned': 2})):
+                await cache.get('nft', '0xW', spec_hash, params, compute)
+            await cache.get('nft', '0xw', 'h1', {'minimum_owned': 1}, compute)
+
+        asyncio.run(run())
+        self.assertEqual(compute.await_count, 3)
+
+    def test_stale_verdict_is_served_while_refreshed(self):
+        cache = VerdictCache(LRUCache(), ttls={'farmer': 0}, stale_ttl=60)
+        compute = mock.AsyncMock(side_effect=[False, True])
+
+        async def run():
+            first = await cache.get('farmer', '0xw', 'h', None, compute)
+            stale = await cache.get('farmer', '0xw', 'h', None, compute)
+            await asyncio.sleep(0.01)
+            cache.ttls['farmer'] = 60
+            fresh = await cache.get('farmer', '0xw', 'h', None, compute)
+            return first, stale, fresh
+
+        self.assertEqual(asyncio.run(run()), (False, False, True))
+
+    def test_verdicts_of_a_wallet_are_invalidated(self):
+        backend = SQLiteCache(os.path.join(tempfile.mkdtemp(), 'v.sqlite'))
+        cache = VerdictCache(backend, ttls={'farmer': 60, 'nft': 60})
+        compute = mock.AsyncMock(return_value=True)
+
+        async def run():
+            await cache.get('farmer', '0xa', 'h', None, compute)
+            await cache.get('nft', '0xa', 'h', None, compute)
+            await cache.get('farmer', '0xb', 'h', None, compute)
+            return (await cache.invalidate('0xA', 'nft'),
+                    await cache.invalidate('0xa'))
+
+        with mock.patch.object(asyncio, 'to_thread', wraps=asyncio.to_thread) as to_thread:
+            self.assertEqual(asyncio.run(run()), (1, 1))
+        # the SQLite backend is only used from worker threads
+        self.assertEqual(to_thread.call_count, 8)
+        self.assertEqual(len(backend), 1)
+
 class NFTOwnershipTests(unittest.TestCase):
 
     def test_which_nfts_owned_when_not_owning_nfts(self):
@@ -92,6 +566,79 @@ class NFTOwnershipTests(unittest.TestCase):
         for o in owned:
             self.assertTrue(o)
 
+    def test_which_nfts_owned_normalizes_a_set_of_owned_nfts(self):
+        owned_nfts = {'0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D'}
+
+        owned = which_nfts_owned(owned_nfts,
+                                 ['0xbc4ca0eda7647a8ab7c2061c2e118a18a936f13d'])
+        self.assertEqual(owned, [True])
+        self.assertEqual(which_nfts_owned(frozenset(owned_nfts),
+                                          ['0xbc4ca0eda7647a8ab7c2061c2e118a18a936f13d']),
+                         [True])
+        self.assertTrue(is_nft_owned(frozenset({'0xABC'}), '0xabc'))
+
+    def test_many_specs_are_evaluated_with_one_fetch(self):
+        specs = {
+            'bayc': ['0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D'],
+            'mixed': ['0xbc4ca0eda7647a8ab7c2061c2e118a18a936f13d',
+                      '0x23581767a106ae21c074b2276D25e5C3e136a68b'],
+        }
+        owned = {'0xbc4ca0eda7647a8ab7c2061c2e118a18a936f13d'}
+        with mock.patch('src.nft_owneship.account_nft_contracts',
+                        return_value=owned) as fetch:
+            result = nft_ownership_from_specs('0xW', specs)
+
+        fetch.assert_called_once()
+        self.assertEqual(len(fetch.call_args.args[1]), 2)
+        self.assertEqual(result, {'bayc': [True], 'mixed': [True, False]})
+
+    def test_large_contract_lists_are_queried_in_chunks(self):
+        contracts = ['0x%040X' % i for i in range(100)] + ['0x%040x' % 1]
+        queried = []
+
+        def chunk_pages(wallet_address, chunk, include_spam):
+            queried.append(len(chunk))
+            yield [{'contract': {'address': chunk[0]}}]
+
+        with mock.patch.object(alchemy, '_iter_nft_pages', side_effect=chunk_pages):
+            owned = which_nfts_owned(
+                list(alchemy.account_nft_contracts('0xW', contracts)), contracts)
+            nfts = alchemy.account_nfts('0xW', contracts)
+
+        self.assertEqual(sorted(queried), [10, 10, 45, 45, 45, 45])
+        self.assertEqual(sum(owned), 3)
+        self.assertEqual(len(nfts), 3)
+
+    def test_chunked_query_stops_at_threshold(self):
+        contracts = ['0x%040x' % i for i in range(450)]
+        started = []
+
+        async def chunk_pages(wallet_address, chunk, include_spam):
+            started.append(chunk[0])
+            await asyncio.sleep(0)
+            yield [{'contract': {'address': chunk[0]}}]
+
+        with mock.patch.object(alchemy, 'NFT_CHUNK_CONCURRENCY', 2), \
+                mock.patch.object(alchemy, '_iter_nft_pages_async', chunk_pages):
+            owned = asyncio.run(alchemy.account_nft_contracts_async(
+                '0xW', contracts, stop_after=2))
+
+        self.assertGreaterEqual(len(owned), 2)
+        self.assertLess(len(started), 4)
+
+    def test_nft_pages_stop_once_minimum_is_owned(self):
+        contracts = ['0x%040x' % i for i in range(5)]
+        pages = []
+
+        def nft_pages(wallet_address, chunk, include_spam):
+            for address in chunk:
+                pages.append(address)
+                yield [{'contract': {'address': address}}] * 100
+
+        with mock.patch.object(alchemy, '_iter_nft_pages', side_effect=nft_pages):
+            self.assertTrue(minimum_owned_nfts('0xW', contracts, 2))
+        self.assertEqual(len(pages), 2)
+
     def test_nft_ownership_is_above_minimum_when_it_is(self):
         """
         WARNING: This test case makes API calls.
@@ -116,6 +663,278 @@ class NFTOwnershipTests(unittest.TestCase):
         is_over_minimum = minimum_owned_nfts('vitalik.eth', nft_contract_addresses, 1)
         self.assertFalse(is_over_minimum)
 
+class HTTPClientTests(unittest.TestCase):
+
+    def test_session_is_shared_between_requests(self):
+        self.assertIs(http_client.get_session(), http_client.get_session())
+
+    def test_configure_replaces_session(self):
+        session = http_client.get_session()
+        http_client.configure(pool_size=5, host_pools={'https://example.com': 2})
+        self.addCleanup(http_client.configure, pool_size=20, host_pools={})
+
+        new_session = http_client.get_session()
+        self.assertIsNot(session, new_session)
+        adapter = new_session.get_adapter('https://example.com/v1')
+        self.assertEqual(adapter._pool_maxsize, 2)
+        adapter = new_session.get_adapter('https://api.coingecko.com/api/v3/')
+        self.assertEqual(adapter._pool_maxsize, 5)
+
+    def test_token_bucket_allows_bursts(self):
+        limiter = TokenBucket(rate=10, burst=2)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertAlmostEqual(limiter.reserve(), 0.1, places=2)
+
+    def test_request_is_retried_on_429(self):
+        session = mock.Mock()
+        session.request.side_effect = [
+            mock.Mock(status_code=429, headers={'Retry-After': '0'}, content=b''),
+            mock.Mock(status_code=200, headers={}, content=b'{}'),
+        ]
+        with mock.patch.object(http_client, 'get_session', return_value=session):
+            r = http_client.get('https://example.com/price')
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_identical_async_requests_are_coalesced(self):
+        client = mock.Mock()
+        async def request(method, url, **kwargs):
+            await asyncio.sleep(0.01)
+            return mock.Mock(status_code=200, params=kwargs['params'], content=b'{}')
+        client.request = mock.Mock(side_effect=request)
+
+        async def run():
+            return await asyncio.gather(
+                *[http_client.async_get('https://example.com/price', params={'a': 1})
+                    for _ in range(5)],
+                http_client.async_get('https://example.com/price', params={'a': 2}))
+
+        with mock.patch.object(http_client, 'get_async_client', return_value=client):
+            responses = asyncio.run(run())
+
+        self.assertEqual(client.request.call_count, 2)
+        self.assertEqual(len({id(r) for r in responses[:5]}), 1)
+        self.assertEqual(responses[5].params, {'a': 2})
+
+    def test_upstream_requests_are_counted_per_api_request(self):
+        session = mock.Mock()
+        session.request.return_value = mock.Mock(status_code=200, headers={},
+                                                  content=b'12345')
+        with mock.patch.object(http_client, 'get_session', return_value=session):
+            token = metrics.begin_request()
+            http_client.get('https://example.com/a')
+            http_client.get('https://example.com/b')
+            self.assertEqual(metrics.end_request(token), 2)
+
+        self.assertIn('upstream_received_bytes_total{upstream="example.com"}',
+                      metrics.render())
+
+class AlchemyBatchTests(unittest.TestCase):
+
+    def test_modules_are_imported_without_api_key_or_clients(self):
+        import subprocess
+        env = {k: v for k, v in os.environ.items() if k != 'ALCHEMY_API_KEY'}
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, src.wallet_interraction, src.farmer; '
+                'print("httpx" in sys.modules, "requests" in sys.modules)'],
+            env=env, text=True)
+        self.assertEqual(output.split(), ['False', 'False'])
+
+    def test_api_key_is_required_when_a_request_is_sent(self):
+        with mock.patch.object(alchemy, 'ALCHEMY_API_KEY', None), \
+                mock.patch.object(alchemy.http_client, 'post') as post:
+            with self.assertRaises(Exception):
+                alchemy.current_eth_balance('0xw')
+        post.assert_not_called()
+
+    def test_batch_results_are_mapped_back_by_id(self):
+        def post(url, json, headers):
+            # answer in reverse order to make sure the ids are used
+            results = [{'id': c['id'], 'result': c['params'][0] + '-md'}
+                        for c in reversed(json)]
+            return mock.Mock(status_code=200, json=mock.Mock(return_value=results))
+
+        with mock.patch.object(alchemy, 'ALCHEMY_BATCH_SIZE', 2), \
+                mock.patch.object(alchemy, 'ALCHEMY_API_KEY', 'key'), \
+                mock.patch.object(alchemy.http_client, 'post', side_effect=post) as p:
+            metadata = alchemy.get_tokens_metadata(['0xa', '0xb', '0xc'])
+
+        self.assertEqual(p.call_count, 2)
+        self.assertEqual(metadata, {'0xa': '0xa-md', '0xb': '0xb-md', '0xc': '0xc-md'})
+
+class CacheTests(unittest.TestCase):
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lru_cache_expires_entries(self):
+        cache = LRUCache(ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_value_copied_from_disk_keeps_its_expiry(self):
+        disk = SQLiteCache(os.path.join(tempfile.mkdtemp(), 'c.sqlite'))
+        disk.set('a', 1, ttl=5)
+        cache = TieredCache(LRUCache(ttl=3600), disk)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertLessEqual(cache.memory._data['a'][1] - time.monotonic(), 5)
+
+    def test_token_metadata_is_fetched_once(self):
+        cache = TieredCache(LRUCache())
+        fetched = {'0xa': {'decimals': 6}, '0xb': {'decimals': None}}
+        with mock.patch.object(token_metadata, '_cache', cache), \
+                mock.patch.object(token_metadata, 'get_tokens_metadata',
+                                    return_value=fetched) as rpc, \
+                mock.patch.object(token_metadata, 'fetch_coin_metadata',
+                                    return_value=18):
+            token_metadata.tokens_metadata(['0xa', '0xb'])
+            metadata = token_metadata.tokens_metadata(['0xA', '0xb'])
+
+        rpc.assert_called_once()
+        self.assertEqual(metadata['0xA']['decimals'], 6)
+        self.assertEqual(metadata['0xb']['decimals'], 18)
+        self.assertEqual(cache.stats()['memory_hits'], 2)
+
+    def test_async_token_metadata_keeps_the_disk_off_the_loop(self):
+        disk = SQLiteCache(os.path.join(tempfile.mkdtemp(), 'c.sqlite'))
+        disk.set('ethereum:0xa', {'decimals': 6})
+        cache = TieredCache(LRUCache(), disk)
+        threads = []
+        get_entries, set_many = disk.get_entries, disk.set_many
+
+        def on_thread(f):
+            def wrapper(*args):
+                threads.append(threading.current_thread())
+                return f(*args)
+            return wrapper
+
+        async def fetch(addresses, network):
+            return {a: {'decimals': 18} for a in addresses}
+
+        with mock.patch.object(token_metadata, '_cache', cache), \
+                mock.patch.object(token_metadata, 'get_tokens_metadata_async', fetch), \
+                mock.patch.object(disk, 'get_entries', on_thread(get_entries)), \
+                mock.patch.object(disk, 'set_many', on_thread(set_many)):
+            metadata = asyncio.run(token_metadata.tokens_metadata_async(
+                ['0xa', '0xb', '0xc']))
+
+        self.assertEqual(metadata, {'0xa': {'decimals': 6}, '0xb': {'decimals': 18},
+                                    '0xc': {'decimals': 18}})
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual(disk.get_entries(['ethereum:0xb', 'ethereum:0xc']),
+                         {'ethereum:0xb': ({'decimals': 18}, None),
+                          'ethereum:0xc': ({'decimals': 18}, None)})
+
+class CoinGeckoPriceTests(unittest.TestCase):
+
+    def test_token_prices_are_chunked_and_cached(self):
+        addresses = ['0x%040x' % i for i in range(60)]
+
+        def get(url, params, headers):
+            prices = {a: {'usd': 1.5} for a in params['contract_addresses'].split(',')
+                        if a != addresses[0]}
+            return mock.Mock(status_code=200, json=mock.Mock(return_value=prices))
+
+        with mock.patch.object(coingecko, 'price_cache', LRUCache()), \
+                mock.patch.object(coingecko.http_client, 'get', side_effect=get) as g:
+            prices = coingecko.get_token_prices(addresses)
+            self.assertEqual(coingecko.get_token_prices(addresses), prices)
+
+        # 60 addresses don't fit in one 2000 character URL
+        self.assertEqual(g.call_count, 2)
+        for call in g.call_args_list:
+            url_length = len(call.args[0]) + len(call.kwargs['params']['contract_addresses'])
+            self.assertLess(url_length, coingecko.COINGECKO_MAX_URL_LENGTH)
+        # the token without a price is left out
+        self.assertEqual(len(prices), 59)
+        self.assertNotIn(addresses[0], prices)
+
+class ContractIndexTests(unittest.TestCase):
+
+    def test_index_is_loaded_once_and_reloaded_when_stored(self):
+        usdc, dai = '0x' + 'ab' * 20, '0x' + 'de' * 20
+        storage = os.path.join(tempfile.mkdtemp(), '%s-coin-address.json')
+        self.addCleanup(coingecko._contract_indexes.pop, 'ethereum', None)
+        with mock.patch.object(coingecko, 'COIN_DATA_STORAGE_FILE', storage):
+            coingecko.store_contract_data([{'id': 'usdc', 'ethereum': usdc.upper()}], 'ethereum')
+            index = coingecko.contract_index('ethereum')
+            self.assertIs(coingecko.contract_index('ethereum'), index)
+            self.assertEqual(index[usdc], 'usdc')
+
+            coingecko.store_contract_data([{'id': 'dai', 'ethereum': dai}], 'ethereum')
+            index = coingecko.contract_index('ethereum')
+            self.assertNotIn(usdc, index)
+            self.assertEqual(index[dai], 'dai')
+            with self.assertRaises(TypeError):
+                index['0x123'] = 'other'
+
+    def test_snapshot_matches_the_json_index(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ethereum-coin-address.idx')
+        index = coingecko.load_coin_data('ethereum')
+        count = contract_snapshot.write_snapshot(path, index)
+        snapshot = contract_snapshot.ContractSnapshot(path)
+
+        valid = {a.lower(): coin_id for a, coin_id in index.items() if len(a) == 42}
+        self.assertEqual(count, len(valid))
+        self.assertEqual(dict(snapshot), valid)
+        for address in list(valid)[::50]:
+            self.assertIn(address.upper().replace('0X', '0x'), snapshot)
+        self.assertNotIn('0x' + 'f' * 40, snapshot)
+        self.assertNotIn('', snapshot)
+
+class AsyncEngineTests(unittest.TestCase):
+
+    def test_async_batch_request(self):
+        async def post(url, json, headers):
+            results = [{'id': c['id'], 'result': c['method']} for c in json]
+            return mock.Mock(status_code=200, json=mock.Mock(return_value=results))
+
+        with mock.patch.object(alchemy, 'ALCHEMY_API_KEY', 'key'), \
+                mock.patch.object(alchemy.http_client, 'async_post', side_effect=post):
+            eth_balance, _ = asyncio.run(alchemy.batch_request_async([
+                ('eth_getBalance', []), ('alchemy_getTokenBalances', [])]))
+        self.assertEqual(eth_balance, 'eth_getBalance')
+
+    def test_async_farmer_matches_sync_farmer(self):
+        usdc = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+        balances = {
+            'eth_balance': hex(10 ** 16),
+            'coins_balance': {usdc: hex(2000 * 10 ** 6), '0x%040x' % 1: '0x1'},
+        }
+        spec = {'minimum_total_balance': 2000, 'token_contract_amount': {usdc: 1000}}
+
+        async def prices_async(addresses, network='ethereum'):
+            return {usdc: 1.0}
+
+        async def eth_price_async(network='ethereum'):
+            return 1500.0
+
+        async def metadata_async(addresses, network='ethereum'):
+            return {usdc: {'decimals': 6}}
+
+        with mock.patch.object(farmer, 'tokens_metadata', return_value={usdc: {'decimals': 6}}), \
+                mock.patch.object(farmer, 'get_token_prices', return_value={usdc: 1.0}), \
+                mock.patch.object(farmer, 'get_currency_price', return_value=1500.0), \
+                mock.patch.object(farmer, 'tokens_metadata_async', metadata_async), \
+                mock.patch.object(farmer, 'get_token_prices_async', prices_async), \
+                mock.patch.object(farmer, 'get_currency_price_async', eth_price_async):
+            self.assertTrue(farmer.is_account_farmer(**balances, **spec))
+            self.assertTrue(asyncio.run(farmer.is_account_farmer_async(**balances, **spec)))
+
+            spec['token_contract_amount'][usdc] = 3000
+            self.assertFalse(farmer.is_account_farmer(**balances, **spec))
+            self.assertFalse(asyncio.run(farmer.is_account_farmer_async(**balances, **spec)))
+
 
 if __name__ == '__main__':
     unittest.main()